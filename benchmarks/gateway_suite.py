@@ -0,0 +1,294 @@
+"""End-to-end gateway benchmark against a local stub of Funda and its image host.
+
+Starts ``StubUpstream`` (see ``stub_upstream.py``), then the real gateway in a
+child process with pyfunda pointed at the stub, and runs scripted workloads:
+
+- ``search``:   ``search_listings`` over ``--pages`` pages, bypassing the cache
+- ``batch``:    ``get_listings`` for ``--batch-size`` ids, bypassing the cache
+- ``previews``: ``get_previews`` for 50 photos, with the preview cache disabled
+- ``contended``: ``get_listing`` with ``fresh=1`` while ``--crawlers`` clients run
+  ``search`` with ``priority=background``; only the interactive calls are timed.
+  Run it with a rate limit, e.g. ``--gateway-args '{"rate_limit": 20}'``, so the
+  two classes actually compete for upstream tokens
+
+Each workload reports p50/p95/p99 latency, throughput and errors; the gateway
+process tree's peak RSS is reported after each workload. The result is one
+JSON document, so runs on different commits can be diffed or compared:
+
+    python benchmarks/gateway_suite.py --output before.json
+    git checkout other-branch
+    python benchmarks/gateway_suite.py --output after.json --baseline before.json
+
+Run from the skill root with the gateway requirements installed.
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SKILL_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_upstream import LISTING_ID_BASE, StubUpstream, point_pyfunda_at  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gateway benchmark suite")
+    parser.add_argument("--port", type=int, default=9490, help="Gateway port")
+    parser.add_argument("--iterations", type=int, default=20, help="Requests per workload")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("--workloads", default="search,batch,previews", help="CSV subset")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per search request")
+    parser.add_argument("--batch-size", type=int, default=50, help="Ids per get_listings call")
+    parser.add_argument(
+        "--crawlers", type=int, default=2, help="Background search clients for 'contended'"
+    )
+    parser.add_argument("--api-latency-ms", type=float, default=50.0)
+    parser.add_argument("--image-latency-ms", type=float, default=20.0)
+    parser.add_argument("--photo-size", default="1440x960", help="Stub photo WIDTHxHEIGHT")
+    parser.add_argument("--description-bytes", type=int, default=4000)
+    parser.add_argument(
+        "--gateway-args",
+        default='{"rate_limit": 0}',
+        help="JSON keyword arguments for spin_up_server, e.g. '{\"engine\": \"async\"}'",
+    )
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout")
+    parser.add_argument(
+        "--baseline", help="Earlier result file; adds per-metric percentage changes"
+    )
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def serve(port, upstream_url, gateway_args):
+    """Child process: the real gateway, with pyfunda talking to the stub."""
+    sys.path.insert(0, str(SKILL_ROOT / "scripts"))
+    point_pyfunda_at(upstream_url)
+    spec = importlib.util.spec_from_file_location(
+        "funda_gateway", SKILL_ROOT / "scripts" / "funda_gateway.py"
+    )
+    funda_gateway = importlib.util.module_from_spec(spec)
+    sys.modules["funda_gateway"] = funda_gateway
+    spec.loader.exec_module(funda_gateway)
+    funda_gateway.SKILL_ROOT = Path(tempfile.mkdtemp(prefix="funda-bench-"))
+    options = {"preview_cache_mb": 0}
+    options.update(gateway_args)
+    funda_gateway.spin_up_server(port, 10, **options)
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/cache_stats", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"gateway did not start on port {port}")
+
+
+def process_tree(pid):
+    pids = [pid]
+    for child in Path(f"/proc/{pid}/task/{pid}/children").read_text().split():
+        pids.extend(process_tree(int(child)))
+    return pids
+
+
+def peak_rss_mb(pid):
+    """Sum of VmHWM over the gateway's process tree; ``None`` without /proc."""
+    total_kb = 0
+    try:
+        for tree_pid in process_tree(pid):
+            for line in Path(f"/proc/{tree_pid}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    total_kb += int(line.split()[1])
+    except OSError:
+        return None
+    return round(total_kb / 1024, 1)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def fetch(port, path):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=120) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run_workload(port, paths, iterations, concurrency):
+    """Time ``iterations`` requests cycling through ``paths``."""
+    fetch(port, paths[0])  # warm-up: connections, sessions, fingerprint selection
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        batch = itertools.islice(itertools.cycle(paths), iterations)
+        results = list(pool.map(lambda path: fetch(port, path), batch))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        "requests": iterations,
+        "errors": sum(1 for _, ok in results if not ok),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "throughput_rps": round(iterations / elapsed, 2),
+    }
+
+
+def run_contended(port, paths, crawl_path, iterations, concurrency, crawlers):
+    """``run_workload`` on ``paths`` while ``crawlers`` clients loop on ``crawl_path``."""
+    stop = threading.Event()
+
+    def crawl():
+        while not stop.is_set():
+            fetch(port, crawl_path)
+
+    threads = [threading.Thread(target=crawl, daemon=True) for _ in range(crawlers)]
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(0.5)  # let the crawl fill the background queue
+        return run_workload(port, paths, iterations, concurrency)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def compare(result, baseline):
+    """Percentage change per workload metric relative to ``baseline``."""
+    changes = {}
+    for name, workload in result["workloads"].items():
+        before = baseline.get("workloads", {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            metric: round((value - before[metric]) / before[metric] * 100, 1)
+            for metric, value in workload.items()
+            if metric not in ("requests", "errors")
+            and value is not None
+            and before.get(metric)
+        }
+    return {"commit": baseline.get("commit"), "change_percent": changes}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SKILL_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    if json.loads(args.gateway_args).get("workers", 1) > 1:
+        # Spawned workers would re-import the gateway without the stub redirect.
+        sys.exit("--gateway-args: workers > 1 is not supported by this suite")
+    if args.serve:
+        serve(args.port, args.serve, json.loads(args.gateway_args))
+        return
+
+    width, height = (int(part) for part in args.photo_size.lower().split("x"))
+    upstream = StubUpstream(
+        api_latency=args.api_latency_ms / 1000,
+        image_latency=args.image_latency_ms / 1000,
+        photo_size=(width, height),
+        description_bytes=args.description_bytes,
+    ).start()
+
+    pages = ",".join(str(page) for page in range(args.pages))
+    ids = ",".join(str(LISTING_ID_BASE + index) for index in range(args.batch_size))
+    paths = {
+        "search": [f"/search_listings?location=amsterdam&pages={pages}&fresh=1"],
+        "batch": [f"/get_listings?ids={ids}&fresh=1"],
+        "previews": [f"/get_previews/{LISTING_ID_BASE + 1}?limit=50"],
+        "contended": [
+            f"/get_listing/{LISTING_ID_BASE + index}?fresh=1" for index in range(args.batch_size)
+        ],
+    }
+    crawl_path = f"{paths['search'][0]}&priority=background"
+
+    child = subprocess.Popen(
+        [
+            sys.executable,
+            __file__,
+            "--serve",
+            upstream.base_url,
+            "--port",
+            str(args.port),
+            "--gateway-args",
+            args.gateway_args,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("serve", "output", "baseline")
+        },
+        "workloads": {},
+    }
+    try:
+        wait_until_up(args.port)
+        for name in args.workloads.split(","):
+            if name == "contended":
+                workload = run_contended(
+                    args.port,
+                    paths[name],
+                    crawl_path,
+                    args.iterations,
+                    args.concurrency,
+                    args.crawlers,
+                )
+            else:
+                workload = run_workload(args.port, paths[name], args.iterations, args.concurrency)
+            workload["peak_rss_mb"] = peak_rss_mb(child.pid)
+            result["workloads"][name] = workload
+            print(f"[bench] {name}: {workload}", file=sys.stderr)
+    finally:
+        child.terminate()
+        child.wait()
+        upstream.stop()
+    result["upstream_requests"] = upstream.requests
+    if args.baseline:
+        result["baseline"] = compare(result, json.loads(Path(args.baseline).read_text()))
+
+    document = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(document + "\n")
+    else:
+        print(document)
+
+
+if __name__ == "__main__":
+    main()
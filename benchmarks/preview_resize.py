@@ -0,0 +1,140 @@
+"""Micro-benchmark for preview resizing throughput (images per second).
+
+Compares the previous full-resolution decode with the JPEG draft-mode decode
+used by ``_build_preview_bytes``, serially and on a process pool, the way the
+gateway runs with ``--resize-processes``.
+
+Run from the skill root with the gateway requirements installed:
+
+    python benchmarks/preview_resize.py --images 40 --preview-size 320 --processes 4
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+SKILL_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SKILL_ROOT / "scripts"))
+
+spec = importlib.util.spec_from_file_location(
+    "funda_gateway", SKILL_ROOT / "scripts" / "funda_gateway.py"
+)
+funda_gateway = importlib.util.module_from_spec(spec)
+sys.modules["funda_gateway"] = funda_gateway
+spec.loader.exec_module(funda_gateway)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Preview resize micro-benchmark")
+    parser.add_argument("--images", type=int, default=40, help="Images per run")
+    parser.add_argument(
+        "--source-size",
+        default="2048x1365",
+        help="Size of the synthetic source photo, WIDTHxHEIGHT",
+    )
+    parser.add_argument("--preview-size", type=int, default=320)
+    parser.add_argument("--preview-quality", type=int, default=65)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for the process pool runs",
+    )
+    return parser.parse_args()
+
+
+def make_source_jpeg(width, height):
+    # Gradients, shapes and blur approximate the entropy of a real listing photo
+    # better than a flat colour, which would decode unrealistically fast.
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for index in range(0, width, max(1, width // 24)):
+        draw.rectangle(
+            (index, height // 3, index + width // 48, height - 1),
+            fill=(index % 256, (index * 3) % 256, 120),
+        )
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def full_decode_preview(image_bytes, max_size, quality):
+    """The resize path before draft mode: decode every source pixel first."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        img.save(output, format="JPEG", optimize=True, quality=quality)
+        return "image/jpeg", output.getvalue()
+
+
+def run_serial(fn, source, args):
+    started = time.perf_counter()
+    for _ in range(args.images):
+        fn(source, max_size=args.preview_size, quality=args.preview_quality)
+    return args.images / (time.perf_counter() - started)
+
+
+def run_pool(fn, source, args):
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        # Warm the workers up so process start-up is not measured.
+        list(pool.map(_noop, range(args.processes)))
+        started = time.perf_counter()
+        futures = [
+            pool.submit(
+                fn, source, max_size=args.preview_size, quality=args.preview_quality
+            )
+            for _ in range(args.images)
+        ]
+        for future in futures:
+            future.result()
+        return args.images / (time.perf_counter() - started)
+
+
+def _noop(_):
+    return None
+
+
+def main():
+    args = parse_args()
+    width, height = (int(part) for part in args.source_size.lower().split("x"))
+    source = make_source_jpeg(width, height)
+    print(
+        f"source {width}x{height} ({len(source) // 1024} KiB), preview "
+        f"{args.preview_size}px q{args.preview_quality}, {args.images} images, "
+        f"{os.cpu_count()} CPUs"
+    )
+
+    results = [
+        ("full decode, serial", run_serial(full_decode_preview, source, args)),
+        (
+            "draft decode, serial",
+            run_serial(funda_gateway._build_preview_bytes, source, args),
+        ),
+        (
+            f"full decode, {args.processes} processes",
+            run_pool(full_decode_preview, source, args),
+        ),
+        (
+            f"draft decode, {args.processes} processes",
+            run_pool(funda_gateway._build_preview_bytes, source, args),
+        ),
+    ]
+    baseline = results[0][1]
+    for label, images_per_second in results:
+        print(
+            f"{label:<32} {images_per_second:8.1f} images/s"
+            f"  x{images_per_second / baseline:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Throughput of the threaded and async server engines under concurrent clients.
+
+Starts the real gateway once per engine in a child process, with pyfunda
+replaced by a stub whose calls sleep for ``--upstream-latency-ms``, and drives
+it with ``--clients`` concurrent HTTP clients. Two workloads are measured:
+
+- ``upstream``: ``get_listing`` with ``fresh=1``, so every request waits on the stub
+- ``cached``: ``get_listing`` for one id, answered from the listing cache
+
+Run from the skill root with the gateway requirements installed:
+
+    python benchmarks/server_engines.py --clients 50 --requests 1000
+"""
+
+import argparse
+import importlib.util
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SKILL_ROOT = Path(__file__).resolve().parents[1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Server engine benchmark")
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per workload")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50.0)
+    parser.add_argument("--port", type=int, default=9480)
+    parser.add_argument(
+        "--engines", default="threaded,async", help="CSV of engines to compare"
+    )
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def serve(engine, port, upstream_latency):
+    """Child process: run the gateway on ``engine`` against a stub pyfunda."""
+
+    class StubListing(dict):
+        def to_dict(self):
+            return dict(self)
+
+    class StubFunda:
+        def __init__(self, timeout=None):
+            pass
+
+        def get_listing(self, listing_id):
+            time.sleep(upstream_latency)
+            return StubListing(
+                url=f"https://www.funda.nl/detail/koop/amsterdam/huis-stub/{listing_id}/",
+                title=f"Stub {listing_id}",
+                price=450000,
+                photo_urls=[],
+            )
+
+    sys.modules["funda"] = types.SimpleNamespace(Funda=StubFunda)
+    spec = importlib.util.spec_from_file_location(
+        "funda_gateway", SKILL_ROOT / "scripts" / "funda_gateway.py"
+    )
+    funda_gateway = importlib.util.module_from_spec(spec)
+    sys.modules["funda_gateway"] = funda_gateway
+    spec.loader.exec_module(funda_gateway)
+    funda_gateway.SKILL_ROOT = Path(tempfile.mkdtemp(prefix="funda-bench-"))
+    funda_gateway.spin_up_server(port, 10, rate_limit=0, engine=engine)
+
+
+def wait_until_up(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/cache_stats", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"gateway did not start on port {port}")
+
+
+def run_workload(port, paths, clients):
+    def fetch(path):
+        started = time.perf_counter()
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=30) as response:
+            response.read()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = sorted(pool.map(fetch, paths))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": len(paths) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.upstream_latency_ms / 1000)
+        return
+
+    workloads = {
+        "upstream": [f"/get_listing/{index}?fresh=1" for index in range(args.requests)],
+        "cached": ["/get_listing/1"] * args.requests,
+    }
+    print(
+        f"{args.clients} clients, {args.requests} requests per workload, "
+        f"upstream latency {args.upstream_latency_ms:.0f} ms"
+    )
+    for engine in args.engines.split(","):
+        child = subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "--serve",
+                engine,
+                "--port",
+                str(args.port),
+                "--upstream-latency-ms",
+                str(args.upstream_latency_ms),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(args.port)
+            for name, paths in workloads.items():
+                result = run_workload(args.port, paths, args.clients)
+                print(
+                    f"{engine:<9} {name:<9} {result['requests_per_second']:8.1f} req/s"
+                    f"  p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms"
+                )
+        finally:
+            child.terminate()
+            child.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Local stand-ins for the Funda APIs and the image host, for benchmarks.
+
+``StubUpstream`` serves, on one loopback port:
+
+- ``GET  /listing/...``  the listing detail API (``get_listing``)
+- ``POST /search``       the search API (``search_listing``), 15 hits per page
+- ``POST /walter``       the price history API (``get_price_history``)
+- ``GET  /photos/<a>/<b>/<c>.jpg``  listing photos, a synthetic JPEG
+
+Responses follow the shapes pyfunda parses, so the real pyfunda client runs
+unchanged once ``point_pyfunda_at`` has redirected its endpoint constants.
+Latency and payload sizes are configurable; pyfunda's own parsing and the
+gateway's work are what gets measured.
+"""
+
+import io
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_SIZE = 15
+LISTING_ID_BASE = 43000000
+
+
+def make_photo_jpeg(width, height):
+    from PIL import Image, ImageDraw, ImageFilter
+
+    # Shapes and blur give the photo realistic entropy; a flat colour would
+    # decode and resize unrealistically fast.
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for index in range(0, width, max(1, width // 24)):
+        draw.rectangle(
+            (index, height // 3, index + width // 48, height - 1),
+            fill=(index % 256, (index * 3) % 256, 120),
+        )
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class StubUpstream:
+    """Threaded HTTP/1.1 server answering like Funda, on ``127.0.0.1:port``."""
+
+    def __init__(
+        self,
+        port=0,
+        api_latency=0.05,
+        image_latency=0.02,
+        photos_per_listing=50,
+        photo_size=(1440, 960),
+        description_bytes=4000,
+    ):
+        self.api_latency = api_latency
+        self.image_latency = image_latency
+        self.photos_per_listing = photos_per_listing
+        self.description = "Ruime woning met tuin. " * max(1, description_bytes // 23)
+        self.photo = make_photo_jpeg(*photo_size)
+        self.requests = {"listing": 0, "search": 0, "walter": 0, "photo": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.base_url = f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def listing_payload(self, tiny_id):
+        photo_ids = [
+            f"{224 + index // 100}/{802 + index % 100}/{529 + index}"
+            for index in range(self.photos_per_listing)
+        ]
+        return {
+            "Identifiers": {"GlobalId": int(tiny_id) - LISTING_ID_BASE, "TinyId": str(tiny_id)},
+            "AddressDetails": {
+                "Title": f"Stubstraat {int(tiny_id) % 1000}",
+                "City": "Amsterdam",
+                "PostCode": "1012AB",
+                "Province": "Noord-Holland",
+            },
+            "Price": {"NumericSellingPrice": 400000 + int(tiny_id) % 1000 * 1000},
+            "OfferingType": "Sale",
+            "ObjectType": "Woonhuis",
+            "FastView": {"EnergyLabel": "A", "LivingArea": "120 m²", "NumberOfBedrooms": 3},
+            "Advertising": {"TargetingOptions": {"woonoppervlakte": "120", "bouwjaar": "1930"}},
+            "ListingDescription": {"Description": self.description},
+            "Media": {
+                "Photos": {
+                    "MediaBaseUrl": f"{self.base_url}/photos/{{id}}.jpg",
+                    "Items": [{"Id": photo_id} for photo_id in photo_ids],
+                }
+            },
+        }
+
+    def search_payload(self, page):
+        hits = []
+        for index in range(PAGE_SIZE):
+            tiny_id = LISTING_ID_BASE + page * PAGE_SIZE + index
+            hits.append(
+                {
+                    "_id": str(tiny_id - LISTING_ID_BASE),
+                    "_source": {
+                        "address": {
+                            "street_name": "Stubstraat",
+                            "house_number": str(index + 1),
+                            "city": "amsterdam",
+                            "postal_code": "1012AB",
+                        },
+                        "price": {"selling_price": [400000 + index * 1000]},
+                        "offering_type": ["buy"],
+                        "floor_area": [100 + index],
+                        "number_of_bedrooms": 3,
+                        "energy_label": "A",
+                        "object_type": "house",
+                        "publish_date": "2026-01-01T00:00:00",
+                        "object_detail_page_relative_url": (
+                            f"/detail/koop/amsterdam/huis-stubstraat-{index + 1}/{tiny_id}/"
+                        ),
+                    },
+                }
+            )
+        return {"responses": [{"hits": {"hits": hits}}]}
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, payload):
+                self._send(200, json.dumps(payload).encode("utf-8"))
+
+            def do_GET(self):
+                if self.path.startswith("/photos/"):
+                    upstream._count("photo")
+                    time.sleep(upstream.image_latency)
+                    self._send(200, upstream.photo, "image/jpeg")
+                    return
+                match = re.search(r"/(\d+)/?$", self.path)
+                if self.path.startswith("/listing/") and match:
+                    upstream._count("listing")
+                    time.sleep(upstream.api_latency)
+                    tiny_id = int(match.group(1))
+                    if tiny_id < LISTING_ID_BASE:
+                        tiny_id += LISTING_ID_BASE
+                    self._send_json(upstream.listing_payload(tiny_id))
+                    return
+                self._send(404, b"{}")
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                time.sleep(upstream.api_latency)
+                if self.path.startswith("/search"):
+                    upstream._count("search")
+                    query = json.loads(body.decode("utf-8").splitlines()[1])
+                    page = query["params"]["page"]["from"] // PAGE_SIZE
+                    self._send_json(upstream.search_payload(page))
+                    return
+                if self.path.startswith("/walter"):
+                    upstream._count("walter")
+                    self._send_json(
+                        {
+                            "status": "ok",
+                            "changes": [
+                                {"price": 395000, "date": "1 jan, 2026", "status": "Vraagprijs"}
+                            ],
+                        }
+                    )
+                    return
+                self._send(404, b"{}")
+
+        return Handler
+
+
+def point_pyfunda_at(base_url):
+    """Redirect pyfunda's endpoint constants to a ``StubUpstream``."""
+    from funda import funda as pyfunda
+
+    pyfunda.API_BASE = f"{base_url}/listing"
+    pyfunda.API_LISTING = f"{pyfunda.API_BASE}/{{listing_id}}"
+    pyfunda.API_LISTING_TINY = f"{pyfunda.API_BASE}/tinyId/{{tiny_id}}"
+    pyfunda.API_SEARCH = f"{base_url}/search"
+    pyfunda.API_WALTER = f"{base_url}/walter"
+    pyfunda.TEST_URL = f"{pyfunda.API_BASE}/tinyId/{LISTING_ID_BASE + 1}"
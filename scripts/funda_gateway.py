@@ -1,19 +1,136 @@
 import argparse
+import asyncio
 import base64
+import bisect
+import contextvars
+import functools
+import hashlib
+import heapq
+import inspect
 import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import random
+import re
+import signal
 import socket
+import sqlite3
+import sys
+import threading
 import time
-import urllib.error
-import urllib.request
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+    wait,
+)
 from pathlib import Path
 
-from simple_http_server import PathValue, route, server
-from simple_http_server.basic_models import Parameter
+from simple_http_server import Headers, PathValue, Response, route, server
+from simple_http_server.basic_models import Header, ModelDict, Parameter
 
 from funda import Funda
 
-MULTI_PAGE_REQUEST_DELAY_SECONDS = 0.3
+GATEWAY_VERSION = "0.2.0"
+UPSTREAM_RATE_LIMIT = 3.0
+UPSTREAM_RATE_BURST = 3
+UPSTREAM_WORKERS = 8
+PRIORITY_WEIGHTS = {"interactive": 4, "background": 1}
+DEFAULT_PRIORITY = "interactive"
+UPSTREAM_RETRY_BUDGET = 2
+RETRY_BASE_DELAY_SECONDS = 0.25
+RETRY_MAX_DELAY_SECONDS = 4.0
+BREAKER_WINDOW_SECONDS = 30.0
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATIO = 0.5
+BREAKER_THROTTLE_TRIPS = 2
+BREAKER_OPEN_SECONDS = 5.0
+BREAKER_MAX_OPEN_SECONDS = 120.0
+PREFETCH_INTERVAL_SECONDS = 0
+PREFETCH_CONCURRENCY = 2
+EVENT_LOG_SIZE = 1000
+EVENT_MAX_SUBSCRIBERS = 16
+EVENT_KEEPALIVE_SECONDS = 15.0
+EVENT_STREAM_SECONDS = 60.0
+EVENT_RETRY_MS = 3000
+SERVER_ENGINES = ("threaded", "async")
+ASYNC_HANDLER_WORKERS = 64
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LISTING_CACHE_SIZE = 256
+LISTING_CACHE_TTL_SECONDS = 300
+BATCH_MAX_IDS = 50
+SEARCH_CACHE_SIZE = 128
+SEARCH_CACHE_TTL_SECONDS = 120
+SEARCH_CACHE_STALE_SECONDS = 600
+PREVIEW_WORKERS = 8
+RESIZE_PROCESSES = 0
+IMAGE_POOL_SIZE = 0
+IMAGE_CLIENT_IDENTIFIER = "chrome"
+PREVIEW_CACHE_DIR = "state/previews"
+PREVIEW_CACHE_MB = 256
+PREVIEW_FORMAT = "jpeg"
+PREVIEW_CACHE_CONTROL = "public, max-age=604800, immutable"
 SKILL_ROOT = Path(__file__).resolve().parents[1]
+STATE_DB_PATH = "state/funda_gateway.sqlite3"
+SHARED_CACHE_PATH = "state/shared_cache.sqlite3"
+WATCH_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+WATCH_TRACKED_FIELDS = ("price", "status")
+# "<run>-<n>" as sent by /events, or a bare number from a client that has none.
+EVENT_ID_PATTERN = re.compile(r"^(?:[0-9a-f]{1,16}-)?[0-9]{1,18}$")
+LISTING_QUERY_DEFAULT_LIMIT = 50
+LISTING_QUERY_MAX_LIMIT = 500
+LISTING_QUERY_SORTS = {
+    "newest": "updated_at DESC",
+    "price_asc": "price IS NULL, price ASC",
+    "price_desc": "price IS NULL, price DESC",
+    "area_asc": "living_area IS NULL, living_area ASC",
+    "area_desc": "living_area IS NULL, living_area DESC",
+    "year_asc": "construction_year IS NULL, construction_year ASC",
+    "year_desc": "construction_year IS NULL, construction_year DESC",
+}
+FIELD_PATH_PATTERN = re.compile(r"^[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*$")
+FIELD_PRESETS = {
+    "summary": (
+        "public_id",
+        "title",
+        "price",
+        "living_area",
+        "bedrooms",
+        "energy_label",
+        "city",
+        "postcode",
+        "status",
+        "url",
+        "detail_url",
+        "changes",
+        "freshness",
+    ),
+    "full": (),
+}
+SEARCH_PARAM_NAMES = (
+    "location",
+    "offering_type",
+    "availability",
+    "radius_km",
+    "price_min",
+    "price_max",
+    "area_min",
+    "area_max",
+    "plot_min",
+    "plot_max",
+    "object_type",
+    "energy_label",
+    "sort",
+    "page",
+    "pages",
+)
 
 
 class ValidationError(ValueError):
@@ -23,6 +140,1710 @@ class ValidationError(ValueError):
         self.message = message
 
 
+class TokenBucket:
+    """Blocking token-bucket rate limiter; ``rate`` tokens/s refill up to ``burst``."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = max(0.0, float(rate))
+        self.burst = max(1, int(burst))
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take one token if available. Returns 0.0, or the seconds until one is."""
+        if self.rate == 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        """Take one token, sleeping until one is available. Returns seconds waited.
+
+        With ``timeout``, returns ``None`` without taking a token when none
+        would be available within that many seconds.
+        """
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if delay == 0.0:
+                return waited
+            if timeout is not None and waited + delay > timeout:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+
+class UpstreamScheduler:
+    """Hands out rate-limited upstream slots by weighted fair queueing.
+
+    Each call queues in its priority class and gets a virtual finish tag: the
+    later of the scheduler's virtual time and its class's previous tag, plus
+    ``1 / weight``. Tokens from ``limiter`` go to the smallest tag first, so
+    under contention classes share the rate limit in proportion to their
+    weights, and a class that was idle cannot bank credit. Only the waiter at
+    the head of the queue polls the limiter. A wait made for a single flight
+    moves to a more urgent class when a caller of that class joins the flight.
+    """
+
+    def __init__(self, limiter, weights, clock=time.monotonic):
+        self._limiter = limiter
+        self.weights = dict(weights)
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._last_tag = dict.fromkeys(self.weights, 0.0)
+        self._waiting = dict.fromkeys(self.weights, 0)
+        self.granted = dict.fromkeys(self.weights, 0)
+
+    def acquire(self, priority, timeout=None, flight=None):
+        """Wait for a slot in ``priority``'s turn. Returns seconds waited, or ``None``
+        when no slot came within ``timeout`` seconds.
+
+        With ``flight``, the wait follows the flight's priority as it is raised.
+        """
+        if self._limiter.rate == 0:
+            return 0.0
+        started = self._clock()
+        with self._cond:
+            entry = self._enqueue(priority)
+            try:
+                while True:
+                    if flight is not None and (
+                        self.weights[flight.priority] > self.weights[entry[2]]
+                    ):
+                        entry[3] = False
+                        self._waiting[entry[2]] -= 1
+                        entry = self._enqueue(flight.priority)
+                    while self._heap and not self._heap[0][3]:
+                        heapq.heappop(self._heap)
+                    elapsed = self._clock() - started
+                    if timeout is not None and elapsed >= timeout:
+                        entry[3] = False
+                        return None
+                    if self._heap[0] is entry:
+                        delay = self._limiter.try_acquire()
+                        if delay == 0.0:
+                            heapq.heappop(self._heap)
+                            self._virtual_time = entry[0]
+                            self.granted[entry[2]] += 1
+                            return self._clock() - started
+                    else:
+                        delay = None
+                    if timeout is not None:
+                        delay = min(delay or timeout, timeout - elapsed)
+                    self._cond.wait(delay)
+            finally:
+                self._waiting[entry[2]] -= 1
+                self._cond.notify_all()
+
+    def _enqueue(self, priority):
+        tag = max(self._virtual_time, self._last_tag[priority]) + 1 / self.weights[priority]
+        self._last_tag[priority] = tag
+        self._sequence += 1
+        entry = [tag, self._sequence, priority, True]
+        heapq.heappush(self._heap, entry)
+        self._waiting[priority] += 1
+        return entry
+
+    def wake(self):
+        """Make waiters re-check their flights' priorities."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                priority: {
+                    "weight": weight,
+                    "waiting": self._waiting[priority],
+                    "granted": self.granted[priority],
+                }
+                for priority, weight in self.weights.items()
+            }
+
+
+class _Flight(Future):
+    """A call in flight, with the most urgent priority of the callers waiting on it."""
+
+    def __init__(self, priority):
+        super().__init__()
+        self.priority = priority
+
+
+class SingleFlight:
+    """Collapses concurrent calls sharing a key into one execution.
+
+    Callers that arrive while a call is in flight wait for it and get the
+    same result or exception. Each caller waits only as long as its own
+    request deadline allows, and a leader that ran out of *its* deadline does
+    not fail the others: the next caller in line retries as the new leader.
+
+    A caller more urgent than the flight it joins raises the flight's
+    priority, so an interactive request never waits behind a background
+    leader's turn; ``on_promote`` is called after that happens.
+    """
+
+    def __init__(self, on_promote=None):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._on_promote = on_promote
+        self.coalesced = 0
+        self.promoted = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        priority = _current_priority()
+        while True:
+            promoted = False
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Flight(priority)
+                else:
+                    self.coalesced += 1
+                    if PRIORITY_WEIGHTS[priority] > PRIORITY_WEIGHTS[call.priority]:
+                        call.priority = priority
+                        self.promoted += 1
+                        promoted = True
+            if leader:
+                break
+            if promoted and self._on_promote is not None:
+                self._on_promote()
+            try:
+                return call.result(timeout=_deadline_remaining())
+            except FutureTimeoutError:
+                raise DeadlineExceeded("deadline passed while waiting for a shared upstream call")
+            except DeadlineExceeded:
+                continue
+
+        token = _FLIGHT.set(call)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            self._finish(key)
+            call.set_exception(exc)
+            raise
+        finally:
+            _FLIGHT.reset(token)
+        self._finish(key)
+        call.set_result(result)
+        return result
+
+    def _finish(self, key):
+        # Forget the call before waking its followers, so one that retries
+        # after a leader's deadline starts a new call instead of rejoining it.
+        with self._lock:
+            del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "coalesced": self.coalesced,
+                "promoted": self.promoted,
+            }
+
+
+class UpstreamHealth:
+    """Outcome of recent upstream calls, kept for ``/ready``.
+
+    Callers pass the exception only for calls that failed; an answer such as
+    "not found" proves the upstream is reachable and is recorded as a success.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.last_success_at = None
+        self.last_failure_at = None
+        self.last_error = None
+        self.consecutive_failures = 0
+
+    def record(self, exc=None):
+        now = self._clock()
+        with self._lock:
+            if exc is None:
+                self.last_success_at = now
+                self.consecutive_failures = 0
+            else:
+                self.last_failure_at = now
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                self.consecutive_failures += 1
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            return {
+                "last_success_at": self.last_success_at,
+                "last_success_age_seconds": (
+                    None if self.last_success_at is None else round(now - self.last_success_at, 3)
+                ),
+                "last_failure_at": self.last_failure_at,
+                "last_error": self.last_error,
+                "consecutive_failures": self.consecutive_failures,
+            }
+
+
+class RetryBudget:
+    """Upstream retries one incoming request may spend across all its calls."""
+
+    def __init__(self, retries):
+        self._lock = threading.Lock()
+        self.remaining = max(0, int(retries))
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+_RETRY_BUDGET = contextvars.ContextVar("funda_gateway_retry_budget", default=None)
+_PRIORITY = contextvars.ContextVar("funda_gateway_priority", default=DEFAULT_PRIORITY)
+# The single flight the current thread is leading, if any.
+_FLIGHT = contextvars.ContextVar("funda_gateway_flight", default=None)
+
+
+def _current_priority():
+    """Priority upstream calls run at now: the request's, or the flight's once raised."""
+    flight = _FLIGHT.get()
+    return _PRIORITY.get() if flight is None else flight.priority
+
+
+def _in_background(fn, *args, **kwargs):
+    """Run ``fn`` at background priority, outside any request's budget and deadline."""
+    context = contextvars.Context()
+    context.run(_PRIORITY.set, "background")
+    return context.run(fn, *args, **kwargs)
+
+
+class DeadlineExceeded(Exception):
+    """The request deadline passed before an upstream call could finish."""
+
+
+_DEADLINE = contextvars.ContextVar("funda_gateway_deadline", default=None)
+
+
+def _deadline_remaining():
+    """Seconds left before the request deadline, or ``None`` without one."""
+    deadline = _DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _deadline_timeout(timeout):
+    """``timeout`` capped to what is left of the request deadline."""
+    remaining = _deadline_remaining()
+    if remaining is None:
+        return timeout
+    return max(0.001, min(timeout, remaining) if timeout else remaining)
+
+
+class _DeadlineTimeout:
+    """pyfunda's ``timeout`` attribute, capped by the calling request's deadline.
+
+    pyfunda passes ``self.timeout`` to every HTTP call it makes; reading it
+    through this descriptor gives each call only the time its request has left.
+    """
+
+    def __get__(self, funda, owner=None):
+        if funda is None:
+            return self
+        return _deadline_timeout(funda.__dict__.get("timeout"))
+
+    def __set__(self, funda, value):
+        funda.__dict__["timeout"] = value
+
+
+def _start_deadline(deadline_ms):
+    """Set the current request's deadline; returns its length in seconds or ``None``."""
+    if deadline_ms is None:
+        return None
+    timeout = max(0, deadline_ms) / 1000
+    _DEADLINE.set(time.monotonic() + timeout)
+    return timeout
+
+
+class DeadlineFunda(Funda):
+    """The pyfunda client the gateway builds, with calls bounded by the request deadline."""
+
+    timeout = _DeadlineTimeout()
+
+
+class UpstreamError(Exception):
+    """An upstream call failed although pyfunda reported a lookup error."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing or throttling us.
+
+    Call outcomes (``ok``, ``failed``, ``throttled``) from the last
+    ``window_seconds`` are kept. The circuit opens when at least ``min_calls``
+    of them hold ``failure_ratio`` failures, or when ``throttle_trips`` of them
+    were HTTP 429. While open, calls fail fast with ``CircuitOpenError``. After
+    the cooldown one probe call is let through (half-open): success closes the
+    circuit, failure reopens it with the cooldown doubled up to
+    ``max_open_seconds``. Cooldowns are jittered so workers do not probe in
+    lockstep. ``on_change(name, old, new)`` is called on every transition.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    STATES = (CLOSED, OPEN, HALF_OPEN)
+
+    def __init__(
+        self,
+        name,
+        window_seconds=BREAKER_WINDOW_SECONDS,
+        min_calls=BREAKER_MIN_CALLS,
+        failure_ratio=BREAKER_FAILURE_RATIO,
+        throttle_trips=BREAKER_THROTTLE_TRIPS,
+        open_seconds=BREAKER_OPEN_SECONDS,
+        max_open_seconds=BREAKER_MAX_OPEN_SECONDS,
+        on_change=None,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.throttle_trips = throttle_trips
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self._on_change = on_change
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._cooldown = open_seconds
+        self._open_until = 0.0
+        self._probing = False
+        self.state = self.CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self.failures = 0
+        self.throttled = 0
+
+    def before_call(self):
+        """Raise ``CircuitOpenError`` unless a call may go upstream now."""
+        with self._lock:
+            now = self._clock()
+            if self.state == self.OPEN:
+                if now < self._open_until:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self._open_until - now)
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._probing = True
+
+    def record(self, outcome):
+        with self._lock:
+            now = self._clock()
+            if outcome == "cancelled":
+                # Abandoned at the request deadline: says nothing about upstream.
+                self._probing = False
+                return
+            if outcome == "failed":
+                self.failures += 1
+            elif outcome == "throttled":
+                self.throttled += 1
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if outcome == "ok":
+                    self._cooldown = self.open_seconds
+                    self._outcomes.clear()
+                    self._set_state(self.CLOSED)
+                else:
+                    self._cooldown = min(self.max_open_seconds, self._cooldown * 2)
+                    self._open(now)
+                return
+            if self.state == self.OPEN:
+                # A call started before the circuit opened; it changes nothing.
+                return
+
+            self._outcomes.append((now, outcome))
+            while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+                self._outcomes.popleft()
+            failures = sum(1 for _, seen in self._outcomes if seen != "ok")
+            throttled = sum(1 for _, seen in self._outcomes if seen == "throttled")
+            if throttled >= self.throttle_trips or (
+                len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_ratio
+            ):
+                self._open(now)
+
+    def _open(self, now):
+        self._open_until = now + self._cooldown * random.uniform(0.8, 1.2)
+        self.opened += 1
+        self._outcomes.clear()
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        previous, self.state = self.state, state
+        if self._on_change is not None and previous != state:
+            self._on_change(self.name, previous, state)
+
+    def stats(self):
+        with self._lock:
+            now = self._clock()
+            return {
+                "state": self.state,
+                "retry_after_seconds": (
+                    round(self._open_until - now, 3) if self.state == self.OPEN else 0.0
+                ),
+                "cooldown_seconds": self._cooldown,
+                "window_calls": len(self._outcomes),
+                "window_failures": sum(1 for _, seen in self._outcomes if seen != "ok"),
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "failures": self.failures,
+                "throttled": self.throttled,
+            }
+
+
+class Prefetcher:
+    """Runs ``job(pool)`` every ``interval_seconds`` on a daemon thread.
+
+    ``pool`` has ``concurrency`` threads and is kept from run to run; it is
+    only replaced when ``configure`` changes the concurrency.
+
+    The job runs at background priority and returns a summary dict, kept as
+    ``last_run`` with its ``status``: ``ok``, ``partial`` when the summary
+    lists ``errors``, ``failed`` when nothing was ``refreshed`` or the job
+    raised. An interval of 0 pauses the schedule; ``run_now`` still starts a
+    single run. ``configure`` applies to the next run, rescheduled from the
+    start of the last one.
+    """
+
+    def __init__(self, job, interval_seconds=0, concurrency=PREFETCH_CONCURRENCY):
+        self._job = job
+        self.interval_seconds = max(0.0, float(interval_seconds))
+        self.concurrency = max(1, int(concurrency))
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = None
+        self._pool_size = None
+        self._requested = False
+        self._last_started = None
+        self.running = False
+        self.runs = 0
+        self.last_run = None
+
+    def configure(self, interval_seconds=None, concurrency=None):
+        with self._cond:
+            if interval_seconds is not None:
+                self.interval_seconds = max(0.0, float(interval_seconds))
+            if concurrency is not None:
+                self.concurrency = max(1, int(concurrency))
+            self._cond.notify_all()
+        if self.interval_seconds > 0:
+            self.start()
+
+    def run_now(self):
+        with self._cond:
+            self._requested = True
+            self._cond.notify_all()
+        self.start()
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="prefetcher", daemon=True
+                )
+                self._thread.start()
+
+    def _due_in(self):
+        if self._requested:
+            return 0.0
+        if self.interval_seconds == 0:
+            return None
+        if self._last_started is None:
+            return 0.0
+        return self._last_started + self.interval_seconds - time.monotonic()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                delay = self._due_in()
+                while delay is None or delay > 0:
+                    self._cond.wait(delay)
+                    delay = self._due_in()
+                self._requested = False
+                self._last_started = time.monotonic()
+                self.running = True
+                concurrency = self.concurrency
+            if self._pool_size != concurrency:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                self._pool = ThreadPoolExecutor(
+                    max_workers=concurrency, thread_name_prefix="prefetch"
+                )
+                self._pool_size = concurrency
+            started_at = time.time()
+            try:
+                summary = _in_background(self._job, self._pool)
+                if summary["errors"] and not summary.get("refreshed"):
+                    status = "failed"
+                else:
+                    status = "partial" if summary["errors"] else "ok"
+            except Exception as exc:
+                print(f"[funda_gateway] prefetch failed: {exc}")
+                summary = {"errors": [{"message": f"{type(exc).__name__}: {exc}"}]}
+                status = "failed"
+            finished_at = time.time()
+            with self._cond:
+                self.running = False
+                self.runs += 1
+                self.last_run = {
+                    "status": status,
+                    "started_at": started_at,
+                    "finished_at": finished_at,
+                    "duration_seconds": round(finished_at - started_at, 3),
+                    **summary,
+                }
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            due = self._due_in()
+            return {
+                "enabled": self.interval_seconds > 0,
+                "interval_seconds": self.interval_seconds,
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "runs": self.runs,
+                "next_run_in_seconds": (
+                    None if due is None or self.running else round(max(0.0, due), 3)
+                ),
+                "last_run": self.last_run,
+            }
+
+
+class EventLog:
+    """Bounded in-memory log of listing events with increasing ids.
+
+    Ids are ``"<run>-<n>"``: ``run`` is set when the log is created, so an id
+    from before a gateway restart never passes for one of this run's events.
+    Subscribers call ``since`` with the last id they have seen and block until
+    a newer event is appended or the log is closed. When older events were
+    dropped from the log, or the client's id is from another run, ``since``
+    returns the gap so the client knows to resync.
+    """
+
+    def __init__(
+        self, max_events=EVENT_LOG_SIZE, max_subscribers=EVENT_MAX_SUBSCRIBERS, run=None
+    ):
+        self.max_subscribers = max_subscribers
+        self.run = run or format(time.time_ns() // 1_000_000, "x")
+        self._events = deque(maxlen=max(1, max_events))
+        self._cond = threading.Condition()
+        self._next_id = 1
+        self.closed = False
+        self.subscribers = 0
+        self.published = {}
+
+    @property
+    def last_id(self):
+        with self._cond:
+            return self._event_id(self._next_id - 1)
+
+    def _event_id(self, number):
+        return f"{self.run}-{number}"
+
+    def _number(self, event_id):
+        # Position of ``event_id`` in this run, or ``None`` for another run's id.
+        run, _, number = str(event_id).rpartition("-")
+        if run != self.run or not number.isdigit() or int(number) >= self._next_id:
+            return None
+        return int(number)
+
+    def append(self, event_type, data):
+        with self._cond:
+            self._events.append(
+                {
+                    "id": self._event_id(self._next_id),
+                    "number": self._next_id,
+                    "type": event_type,
+                    "time": time.time(),
+                    "data": data,
+                }
+            )
+            self._next_id += 1
+            self.published[event_type] = self.published.get(event_type, 0) + 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def subscribe(self):
+        with self._cond:
+            if self.subscribers >= self.max_subscribers:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def since(self, last_id, timeout=None):
+        """Events after ``last_id``, waiting up to ``timeout`` seconds for one.
+
+        Returns ``(events, gap, cursor)``: ``gap`` is ``None`` or the
+        ``last_event_id`` / ``first_available_id`` pair of missed events, and
+        ``cursor`` is the id to pass next.
+        """
+        with self._cond:
+            number = self._number(last_id)
+            # An id from another run: everything in the log is new to the client.
+            cursor = 0 if number is None else number
+            self._cond.wait_for(lambda: self.closed or self._next_id - 1 > cursor, timeout)
+            events = [event for event in self._events if event["number"] > cursor]
+            first = self._events[0]["number"] if self._events else self._next_id
+            gap = None
+            if number is None or first > cursor + 1:
+                gap = {"last_event_id": last_id, "first_available_id": self._event_id(first)}
+            if events:
+                cursor = events[-1]["number"]
+            elif gap is not None:
+                cursor = first - 1
+            return events, gap, self._event_id(cursor)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "subscribers": self.subscribers,
+                "size": len(self._events),
+                "max_events": self._events.maxlen,
+                "last_event_id": self._event_id(self._next_id - 1),
+                "published": dict(self.published),
+            }
+
+
+class _ShardOwner:
+    """Lives in a thread's local storage, so it is collected when the thread ends."""
+
+
+class Metrics:
+    """Prometheus-style counters, gauges and histograms for ``/metrics``.
+
+    Each thread records into its own shard, so recording takes no lock; a
+    scrape merges the shards. When a thread ends, its shard is folded into a
+    base shard, so short-lived threads do not pile up shards. Gauges that
+    mirror existing state (cache sizes, hit ratios) are callbacks evaluated
+    at scrape time.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._base = ({}, {})
+        self._shards = [self._base]
+        self._shards_lock = threading.Lock()
+        self._help = {}
+        self._callbacks = []
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            self._local.owner = _ShardOwner()
+            weakref.finalize(self._local.owner, self._retire, shard)
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        counters, histograms = self._base
+        with self._shards_lock:
+            for key, value in shard[0].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, entry in shard[1].items():
+                merged = histograms.setdefault(key, [0] * len(entry[:-1]) + [0.0])
+                for index, value in enumerate(entry):
+                    merged[index] += value
+            # By identity: shards with equal counts compare equal.
+            self._shards = [other for other in self._shards if other is not shard]
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            # Per-bucket counts, then +Inf, then the running sum.
+            entry = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, seconds)] += 1
+        entry[-1] += seconds
+
+    @contextmanager
+    def timed(self, name, labels=()):
+        """Observe the block's duration, labelled ``outcome="ok"`` or ``"error"``."""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(name, labels + (("outcome", outcome),), time.perf_counter() - started)
+
+    def callback(self, fn):
+        """Register ``fn() -> [(name, labels, value), ...]`` for scrape time."""
+        self._callbacks.append(fn)
+
+    def counter_value(self, name, labels=()):
+        # Under the lock, so a shard being folded into the base is not counted twice.
+        with self._shards_lock:
+            return sum(shard[0].get((name, labels), 0) for shard in self._shards)
+
+    def render(self):
+        samples = {}
+        histograms = {}
+        with self._shards_lock:
+            for counters, shard_histograms in self._shards:
+                for key, value in list(counters.items()):
+                    samples[key] = samples.get(key, 0) + value
+                for key, entry in list(shard_histograms.items()):
+                    merged = histograms.setdefault(key, [0] * len(entry[:-1]) + [0.0])
+                    for index, value in enumerate(entry):
+                        merged[index] += value
+        for fn in self._callbacks:
+            for name, labels, value in fn():
+                samples[(name, labels)] = value
+
+        series = {}
+        for (name, labels), value in samples.items():
+            series.setdefault(name, []).append((labels, value))
+        for (name, labels), entry in histograms.items():
+            series.setdefault(name, []).append((labels, entry))
+
+        lines = []
+        for name in sorted(series):
+            kind, help_text = self._help.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series[name], key=lambda item: item[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, value[:-1]):
+                    cumulative += count
+                    bucket_labels = labels + (("le", bound),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire ``ttl_seconds`` after being stored.
+
+    With ``stale_ttl_seconds`` set, expired entries are kept that much longer so
+    ``lookup`` can serve them as stale while the caller refreshes them.
+    """
+
+    _MISSING = object()
+
+    def __init__(
+        self, max_entries, ttl_seconds, stale_ttl_seconds=0, clock=time.monotonic, shared=None
+    ):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self.stale_ttl_seconds = max(0.0, float(stale_ttl_seconds))
+        self.shared = shared
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        found = self._lookup(key, allow_stale=False)
+        return default if found is None else found[0]
+
+    def lookup(self, key):
+        """Return ``(value, age_seconds, is_stale)`` or ``None`` on a miss."""
+        return self._lookup(key, allow_stale=True)
+
+    def _lookup(self, key, allow_stale):
+        max_age = self.ttl_seconds + self.stale_ttl_seconds
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            if entry is not self._MISSING and self._clock() - entry[0] >= max_age:
+                del self._entries[key]
+                self.expirations += 1
+                entry = self._MISSING
+        if entry is self._MISSING and self.shared is not None:
+            # Another worker may have fetched it; the shared tier is read outside
+            # the lock so a slow disk never stalls local hits.
+            found = self.shared.load(key, max_age)
+            if found is not None:
+                value, age = found
+                entry = (self._clock() - age, value)
+                with self._lock:
+                    self._store(key, entry)
+                    self.shared_hits += 1
+        with self._lock:
+            if entry is self._MISSING:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            age = self._clock() - stored_at
+            is_stale = age >= self.ttl_seconds
+            if is_stale and not allow_stale:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            if is_stale:
+                self.stale_hits += 1
+            return value, age, is_stale
+
+    def set(self, key, value):
+        if self.max_entries == 0 or self.ttl_seconds == 0:
+            return
+        with self._lock:
+            self._store(key, (self._clock(), value))
+        if self.shared is not None:
+            self.shared.store(key, value)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "stale_ttl_seconds": self.stale_ttl_seconds,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class _SQLiteStore:
+    """Lazily opened SQLite connection shared by the threads of one store.
+
+    The connection is opened on first use so a gateway that never touches the
+    store does not create the database file.
+    """
+
+    _SCHEMA = ""
+
+    # Keeps each IN (...) lookup below SQLite's bound-variable limit.
+    _LOOKUP_CHUNK = 500
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self._SCHEMA)
+            self._conn = conn
+        return self._conn
+
+
+class WatchStore(_SQLiteStore):
+    """SQLite-backed saved searches and the listings already reported for each."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS watches (
+            name TEXT PRIMARY KEY,
+            params TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_checked_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS watch_seen (
+            watch TEXT NOT NULL,
+            public_id TEXT NOT NULL,
+            price INTEGER,
+            status TEXT,
+            first_seen_at REAL NOT NULL,
+            last_seen_at REAL NOT NULL,
+            PRIMARY KEY (watch, public_id)
+        ) WITHOUT ROWID;
+    """
+
+    def save_watch(self, name, params):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO watches (name, params, created_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET params = excluded.params",
+                    (name, json.dumps(params, sort_keys=True), time.time()),
+                )
+
+    def get_watch(self, name):
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT params, created_at, last_checked_at FROM watches WHERE name = ?",
+                    (name,),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        return {
+            "name": name,
+            "params": json.loads(row[0]),
+            "created_at": row[1],
+            "last_checked_at": row[2],
+        }
+
+    def list_watches(self):
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT w.name, w.params, w.created_at, w.last_checked_at, "
+                    "(SELECT COUNT(*) FROM watch_seen s WHERE s.watch = w.name) "
+                    "FROM watches w ORDER BY w.name"
+                )
+                .fetchall()
+            )
+        return [
+            {
+                "name": name,
+                "params": json.loads(params),
+                "created_at": created_at,
+                "last_checked_at": last_checked_at,
+                "seen_count": seen_count,
+            }
+            for name, params, created_at, last_checked_at, seen_count in rows
+        ]
+
+    def delete_watch(self, name):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM watch_seen WHERE watch = ?", (name,))
+                deleted = conn.execute("DELETE FROM watches WHERE name = ?", (name,))
+        return deleted.rowcount > 0
+
+    def _seen(self, conn, name, public_ids):
+        previous = {}
+        for offset in range(0, len(public_ids), self._LOOKUP_CHUNK):
+            chunk = public_ids[offset : offset + self._LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                "SELECT public_id, price, status FROM watch_seen "
+                f"WHERE watch = ? AND public_id IN ({placeholders})",
+                (name, *chunk),
+            )
+            for public_id, price, status in rows:
+                # A NULL status was never known: the listing's details were not loaded.
+                previous[public_id] = {"price": price}
+                if status is not None:
+                    previous[public_id]["status"] = status
+        return previous
+
+    def unreported_ids(self, name, public_ids):
+        """The ids in ``public_ids`` that ``diff_and_update`` has not recorded yet."""
+        public_ids = list(public_ids)
+        with self._lock:
+            previous = self._seen(self._connection(), name, public_ids)
+        return [public_id for public_id in public_ids if public_id not in previous]
+
+    def diff_and_update(self, name, items):
+        """Split ``items`` (keyed by public_id) into new and changed ones and record them.
+
+        Only the ids in ``items`` are looked up, through the primary key, so the
+        cost does not grow with the size of the seen-set.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            previous = self._seen(conn, name, list(items))
+
+            new_items = []
+            changed_items = []
+            for public_id, item in items.items():
+                known = previous.get(public_id)
+                if known is None:
+                    new_items.append(item)
+                    continue
+                changes = _tracked_changes(known, item)
+                if changes:
+                    changed_items.append(dict(item, changes=changes))
+
+            with conn:
+                conn.executemany(
+                    "INSERT INTO watch_seen "
+                    "(watch, public_id, price, status, first_seen_at, last_seen_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(watch, public_id) DO UPDATE SET "
+                    "price = excluded.price, "
+                    "status = COALESCE(excluded.status, watch_seen.status), "
+                    "last_seen_at = excluded.last_seen_at",
+                    [
+                        (name, public_id, item.get("price"), item.get("status"), now, now)
+                        for public_id, item in items.items()
+                    ],
+                )
+                conn.execute(
+                    "UPDATE watches SET last_checked_at = ? WHERE name = ?", (now, name)
+                )
+        return new_items, changed_items
+
+
+class ListingStore(_SQLiteStore):
+    """Every listing the gateway has seen, with the filterable fields indexed.
+
+    Rows merge what search pages and detail lookups returned, so a listing
+    first seen in a search gains ``construction_year`` once its details load.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS listings (
+            public_id TEXT PRIMARY KEY,
+            price INTEGER,
+            living_area INTEGER,
+            bedrooms INTEGER,
+            construction_year INTEGER,
+            energy_label TEXT,
+            city TEXT COLLATE NOCASE,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            details_at REAL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS listings_price ON listings (price);
+        CREATE INDEX IF NOT EXISTS listings_living_area ON listings (living_area);
+        CREATE INDEX IF NOT EXISTS listings_bedrooms ON listings (bedrooms);
+        CREATE INDEX IF NOT EXISTS listings_construction_year
+            ON listings (construction_year);
+        CREATE INDEX IF NOT EXISTS listings_energy_label ON listings (energy_label);
+        CREATE INDEX IF NOT EXISTS listings_city ON listings (city);
+    """
+
+    def upsert(self, items, details=False):
+        """Store ``items`` (public_id -> listing dict); ``details`` marks detail lookups."""
+        if not items:
+            return
+        now = time.time()
+        public_ids = list(items)
+        with self._lock:
+            conn = self._connection()
+            previous = {}
+            for offset in range(0, len(public_ids), self._LOOKUP_CHUNK):
+                chunk = public_ids[offset : offset + self._LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT public_id, data FROM listings "
+                    f"WHERE public_id IN ({placeholders})",
+                    chunk,
+                )
+                for public_id, data in rows:
+                    previous[public_id] = json.loads(data)
+
+            rows = []
+            for public_id, item in items.items():
+                data = previous.get(public_id, {})
+                data.update((key, value) for key, value in item.items() if value is not None)
+                energy_label = _as_optional_str(data.get("energy_label"), lowercase=False)
+                rows.append(
+                    (
+                        public_id,
+                        _as_store_int(data.get("price")),
+                        _as_store_int(data.get("living_area")),
+                        _as_store_int(data.get("bedrooms")),
+                        _as_store_int(data.get("construction_year")),
+                        energy_label.upper() if energy_label else None,
+                        _as_optional_str(data.get("city"), lowercase=False),
+                        json.dumps(data, ensure_ascii=False, default=str),
+                        now,
+                        now if details else None,
+                    )
+                )
+
+            with conn:
+                conn.executemany(
+                    "INSERT INTO listings (public_id, price, living_area, bedrooms, "
+                    "construction_year, energy_label, city, data, updated_at, details_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(public_id) DO UPDATE SET "
+                    "price = excluded.price, living_area = excluded.living_area, "
+                    "bedrooms = excluded.bedrooms, "
+                    "construction_year = excluded.construction_year, "
+                    "energy_label = excluded.energy_label, city = excluded.city, "
+                    "data = excluded.data, updated_at = excluded.updated_at, "
+                    "details_at = COALESCE(excluded.details_at, listings.details_at)",
+                    rows,
+                )
+
+    def statuses(self, public_ids):
+        """``status`` of each of ``public_ids`` as of its latest detail lookup.
+
+        Search results carry no status, so listings never looked up are left out.
+        """
+        public_ids = list(public_ids)
+        statuses = {}
+        with self._lock:
+            conn = self._connection()
+            for offset in range(0, len(public_ids), self._LOOKUP_CHUNK):
+                chunk = public_ids[offset : offset + self._LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT public_id, data FROM listings "
+                    f"WHERE details_at IS NOT NULL AND public_id IN ({placeholders})",
+                    chunk,
+                )
+                for public_id, data in rows:
+                    status = json.loads(data).get("status")
+                    if status is not None:
+                        statuses[public_id] = status
+        return statuses
+
+    def query(self, filters, energy_labels=None, max_age=None, sort="newest", limit=50, offset=0):
+        """Return stored listings matching ``filters`` ({(column, op): value}).
+
+        Each listing carries a ``freshness`` block telling how old the row is
+        and whether full details were ever loaded for it.
+        """
+        clauses = []
+        args = []
+        for (column, op), value in filters.items():
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                args.append(value)
+        if energy_labels:
+            clauses.append(f"energy_label IN ({','.join('?' * len(energy_labels))})")
+            args.extend(energy_labels)
+        now = time.time()
+        if max_age is not None:
+            clauses.append("updated_at >= ?")
+            args.append(now - max_age)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    f"SELECT public_id, data, updated_at, details_at FROM listings {where}"
+                    f"ORDER BY {LISTING_QUERY_SORTS[sort]}, public_id LIMIT ? OFFSET ?",
+                    (*args, limit, offset),
+                )
+                .fetchall()
+            )
+
+        listings = []
+        for public_id, data, updated_at, details_at in rows:
+            listing = json.loads(data)
+            listing.setdefault("public_id", public_id)
+            listing["freshness"] = {
+                "updated_at": updated_at,
+                "age_seconds": round(now - updated_at, 3),
+                "details_age_seconds": (
+                    None if details_at is None else round(now - details_at, 3)
+                ),
+            }
+            listings.append(listing)
+        return listings
+
+    def stats(self):
+        with self._lock:
+            count, oldest, newest = (
+                self._connection()
+                .execute("SELECT COUNT(*), MIN(updated_at), MAX(updated_at) FROM listings")
+                .fetchone()
+            )
+        return {"size": count, "oldest_updated_at": oldest, "newest_updated_at": newest}
+
+
+class SharedCacheTier(_SQLiteStore):
+    """File-backed cache tier shared by the worker processes of one gateway.
+
+    A ``TTLCache`` with ``shared=`` set reads through to it on a local miss and
+    writes through on ``set``, so a listing or search page fetched by one worker
+    is served by all of them. Values are pickled; ages use wall-clock time so
+    every process agrees on them.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            stored_at REAL NOT NULL,
+            value BLOB NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID;
+    """
+
+    # Expired rows are deleted once every this many writes.
+    _PRUNE_EVERY = 200
+
+    def __init__(self, db_path, namespace, max_age_seconds, clock=time.time):
+        super().__init__(db_path)
+        self.namespace = namespace
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self._writes = 0
+
+    def load(self, key, max_age_seconds):
+        """Return ``(value, age_seconds)`` or ``None``."""
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT stored_at, value FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, json.dumps(key)),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        age = max(0.0, self._clock() - row[0])
+        if age >= max_age_seconds:
+            return None
+        return pickle.loads(row[1]), age
+
+    def store(self, key, value):
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as exc:
+            print(f"[funda_gateway] shared cache write skipped: {exc}")
+            return
+        now = self._clock()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, stored_at, value) "
+                    "VALUES (?, ?, ?, ?)",
+                    (self.namespace, json.dumps(key), now, payload),
+                )
+                self._writes += 1
+                if self._writes % self._PRUNE_EVERY == 0:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND stored_at < ?",
+                        (self.namespace, now - self.max_age_seconds),
+                    )
+
+    def stats(self):
+        with self._lock:
+            count = (
+                self._connection()
+                .execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,))
+                .fetchone()[0]
+            )
+        return {"size": count, "path": str(self.db_path)}
+
+
+class SharedPreviewIndex(_SQLiteStore):
+    """Size and last use of every file in a preview cache directory.
+
+    Worker processes sharing the directory keep its index here instead of in
+    memory, so each one serves the previews the others rendered and all of
+    them evict against one quota.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS preview_files (
+            key TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            used_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS preview_files_used_at ON preview_files (used_at);
+    """
+
+    def __init__(self, db_path, clock=time.time):
+        super().__init__(db_path)
+        self._clock = clock
+
+    def seed(self, files):
+        """Record ``files`` (``(mtime, key, size)`` found on disk) unless the index has entries."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if conn.execute("SELECT 1 FROM preview_files LIMIT 1").fetchone() is None:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO preview_files (key, size, used_at) "
+                        "VALUES (?, ?, ?)",
+                        [(key, size, mtime) for mtime, key, size in files],
+                    )
+
+    def touch(self, key):
+        """Mark ``key`` as just used; returns whether it is in the cache."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                updated = conn.execute(
+                    "UPDATE preview_files SET used_at = ? WHERE key = ?", (self._clock(), key)
+                )
+        return updated.rowcount > 0
+
+    def add(self, key, size, max_bytes):
+        """Record ``key``; returns the least recently used keys evicted to fit ``max_bytes``."""
+        evicted = []
+        with self._lock:
+            conn = self._connection()
+            # One write transaction, so concurrent workers never both see room.
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO preview_files (key, size, used_at) VALUES (?, ?, ?)",
+                    (key, size, self._clock()),
+                )
+                total = conn.execute("SELECT SUM(size) FROM preview_files").fetchone()[0]
+                if total > max_bytes:
+                    rows = conn.execute(
+                        "SELECT key, size FROM preview_files WHERE key != ? ORDER BY used_at",
+                        (key,),
+                    )
+                    for old_key, old_size in rows:
+                        evicted.append(old_key)
+                        total -= old_size
+                        if total <= max_bytes:
+                            break
+                    conn.executemany(
+                        "DELETE FROM preview_files WHERE key = ?",
+                        [(old_key,) for old_key in evicted],
+                    )
+        return evicted
+
+    def forget(self, key):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM preview_files WHERE key = ?", (key,))
+
+    def totals(self):
+        """``(files, bytes)`` in the cache."""
+        with self._lock:
+            count, size = (
+                self._connection()
+                .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM preview_files")
+                .fetchone()
+            )
+        return count, size
+
+
+class PhotoDownloadError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _new_image_session():
+    # Imported lazily: the shim needs curl_cffi, which only photo downloads use
+    # directly; pyfunda imports it on its own.
+    import tls_client
+
+    return tls_client.Session(client_identifier=IMAGE_CLIENT_IDENTIFIER)
+
+
+class ImageSessionPool:
+    """Keep-alive HTTP sessions for photo downloads, one per download thread.
+
+    curl_cffi keeps a curl handle (and its connection cache) per thread, so a
+    session shared between threads would not share warm connections. Each
+    thread therefore gets its own session and reuses its TLS connection for
+    every photo it downloads. At most ``size`` downloads run at once. A
+    connection counts as reused when a session sees the same local/remote
+    address pair again.
+    """
+
+    def __init__(self, size, timeout, session_factory=None):
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self._session_factory = session_factory
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._connections = {}
+        self.sessions = 0
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = (self._session_factory or _new_image_session)()
+            with self._lock:
+                self.sessions += 1
+                self._connections[id(session)] = set()
+        return session
+
+    def fetch(self, url, timeout=None):
+        """Download ``url`` and return the body; raises ``PhotoDownloadError``."""
+        session = self._session()
+        with self._slots:
+            try:
+                response = session.get(
+                    url, headers={"User-Agent": "Mozilla/5.0"}, timeout=timeout or self.timeout
+                )
+            except Exception as exc:
+                with self._lock:
+                    self.requests += 1
+                    self.errors += 1
+                raise PhotoDownloadError(str(exc)) from exc
+        self._record(session, response)
+
+        if response.status_code >= 400:
+            raise PhotoDownloadError(
+                f"HTTP {response.status_code} for {url}", status_code=response.status_code
+            )
+        return response.content
+
+    def _record(self, session, response):
+        connection = (
+            getattr(response, "local_ip", None),
+            getattr(response, "local_port", None),
+            getattr(response, "primary_ip", None),
+            getattr(response, "primary_port", None),
+        )
+        with self._lock:
+            self.requests += 1
+            if response.status_code >= 400:
+                self.errors += 1
+            seen = self._connections[id(session)]
+            if connection in seen:
+                self.reused_connections += 1
+            else:
+                seen.add(connection)
+                self.new_connections += 1
+
+    def stats(self):
+        with self._lock:
+            connections = self.new_connections + self.reused_connections
+            return {
+                "size": self.size,
+                "sessions": self.sessions,
+                "requests": self.requests,
+                "errors": self.errors,
+                "new_connections": self.new_connections,
+                "reused_connections": self.reused_connections,
+                "reuse_ratio": (
+                    round(self.reused_connections / connections, 4) if connections else 0.0
+                ),
+            }
+
+
+class PreviewCache:
+    """On-disk store of rendered previews, evicting least recently used files over quota.
+
+    Files are named by a hash of (photo id, size, quality, format), so the same
+    photo rendered with the same settings is stored once and never re-rendered.
+    The index of files is rebuilt from disk (by mtime) on first use. With
+    ``shared`` (a ``SharedPreviewIndex``), the index is kept there instead, for
+    processes that share the directory and its quota.
+    """
+
+    def __init__(self, cache_dir, max_bytes, shared=None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max(0, int(max_bytes))
+        self.shared = shared
+        self._shared_seeded = False
+        self._entries = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(photo_id, max_size, quality, image_format=PREVIEW_FORMAT):
+        raw = f"{photo_id}|{max_size}|{quality}|{image_format}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.{PREVIEW_FORMAT}"
+
+    def _scan(self):
+        # ``(mtime, key, size)`` of the files on disk, least recently used first.
+        files = []
+        if self.cache_dir.is_dir():
+            for path in self.cache_dir.glob(f"*/*.{PREVIEW_FORMAT}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path.stem, stat.st_size))
+        files.sort()
+        return files
+
+    def _index(self):
+        if self._entries is None:
+            self._entries = OrderedDict((key, size) for _, key, size in self._scan())
+            self._total_bytes = sum(self._entries.values())
+        return self._entries
+
+    def _shared_index(self):
+        if not self._shared_seeded:
+            self.shared.seed(self._scan())
+            self._shared_seeded = True
+        return self.shared
+
+    def get(self, key):
+        if self.max_bytes == 0:
+            return None
+        if self.shared is not None:
+            found = self._shared_index().touch(key)
+        else:
+            with self._lock:
+                entries = self._index()
+                found = key in entries
+                if found:
+                    entries.move_to_end(key)
+        if not found:
+            with self._lock:
+                self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            # Evicted or removed between the index lookup and the read.
+            self._forget(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def set(self, key, data):
+        if self.max_bytes == 0 or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{key}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        if self.shared is not None:
+            evicted = self._shared_index().add(key, len(data), self.max_bytes)
+        else:
+            evicted = []
+            with self._lock:
+                entries = self._index()
+                self._forget_locally(key)
+                entries[key] = len(data)
+                self._total_bytes += len(data)
+                while self._total_bytes > self.max_bytes:
+                    old_key, _ = next(iter(entries.items()))
+                    self._forget_locally(old_key)
+                    evicted.append(old_key)
+        with self._lock:
+            self.evictions += len(evicted)
+        for old_key in evicted:
+            try:
+                self._path(old_key).unlink()
+            except OSError:
+                pass
+
+    def _forget(self, key):
+        if self.shared is not None:
+            self.shared.forget(key)
+        else:
+            with self._lock:
+                self._forget_locally(key)
+
+    def _forget_locally(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def stats(self):
+        if self.shared is not None:
+            size, total_bytes = self.shared.totals()
+        else:
+            with self._lock:
+                size, total_bytes = len(self._entries or ()), self._total_bytes
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Funda Gateway")
     parser.add_argument(
@@ -31,6 +1852,118 @@ def parse_args():
     parser.add_argument(
         "--timeout", type=int, default=10, help="Timeout for Funda API calls in seconds"
     )
+    parser.add_argument(
+        "--listing-cache-size",
+        type=int,
+        default=LISTING_CACHE_SIZE,
+        help="Maximum number of listings kept in memory (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--listing-cache-ttl",
+        type=int,
+        default=LISTING_CACHE_TTL_SECONDS,
+        help="Seconds a cached listing stays fresh",
+    )
+    parser.add_argument(
+        "--search-cache-size",
+        type=int,
+        default=SEARCH_CACHE_SIZE,
+        help="Maximum number of search result pages kept in memory (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--search-cache-ttl",
+        type=int,
+        default=SEARCH_CACHE_TTL_SECONDS,
+        help="Seconds a cached search page stays fresh",
+    )
+    parser.add_argument(
+        "--search-cache-stale",
+        type=int,
+        default=SEARCH_CACHE_STALE_SECONDS,
+        help="Seconds past the TTL a stale search page is still served while it refreshes",
+    )
+    parser.add_argument(
+        "--state-db",
+        default=STATE_DB_PATH,
+        help="SQLite file for saved searches, relative to the skill root",
+    )
+    parser.add_argument(
+        "--preview-workers",
+        type=int,
+        default=PREVIEW_WORKERS,
+        help="Photos downloaded and resized concurrently by get_previews",
+    )
+    parser.add_argument(
+        "--image-pool-size",
+        type=int,
+        default=IMAGE_POOL_SIZE,
+        help="Concurrent photo downloads (0 uses --preview-workers)",
+    )
+    parser.add_argument(
+        "--resize-processes",
+        type=int,
+        default=RESIZE_PROCESSES,
+        help="Worker processes for preview resizing (0 resizes in the download threads)",
+    )
+    parser.add_argument(
+        "--preview-cache-dir",
+        default=PREVIEW_CACHE_DIR,
+        help="Directory for rendered previews, relative to the skill root",
+    )
+    parser.add_argument(
+        "--preview-cache-mb",
+        type=int,
+        default=PREVIEW_CACHE_MB,
+        help="Disk quota for rendered previews in MiB (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=UPSTREAM_RATE_LIMIT,
+        help="Funda API requests per second shared by all routes (0 disables)",
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=int,
+        default=UPSTREAM_RATE_BURST,
+        help="Funda API requests allowed back to back before --rate-limit applies",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=SERVER_ENGINES,
+        default="threaded",
+        help="HTTP server engine: a thread per connection, or one asyncio event loop",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Gateway processes sharing the port via SO_REUSEPORT (threaded engine only)",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        type=int,
+        default=UPSTREAM_RETRY_BUDGET,
+        help="Upstream retries one request may spend across all its calls (0 disables)",
+    )
+    parser.add_argument(
+        "--breaker-open-seconds",
+        type=float,
+        default=BREAKER_OPEN_SECONDS,
+        help="First cooldown of an open circuit; doubles while probes keep failing",
+    )
+    parser.add_argument(
+        "--prefetch-interval",
+        type=float,
+        default=PREFETCH_INTERVAL_SECONDS,
+        help="Seconds between background re-runs of saved searches (0 disables)",
+    )
+    parser.add_argument(
+        "--prefetch-concurrency",
+        type=int,
+        default=PREFETCH_CONCURRENCY,
+        help="Upstream calls one prefetch run makes at a time",
+    )
     return parser.parse_args()
 
 
@@ -107,6 +2040,157 @@ def _as_bool_flag(value):
     return text in {"1", "true", "yes", "on"}
 
 
+def _as_store_int(value):
+    # Listing fields are ints for most listings but may be strings or missing.
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalize_search_params(
+    location=None,
+    offering_type=None,
+    availability=None,
+    radius_km=None,
+    price_min=None,
+    price_max=None,
+    area_min=None,
+    area_max=None,
+    plot_min=None,
+    plot_max=None,
+    object_type=None,
+    energy_label=None,
+    sort=None,
+    page=None,
+    pages=None,
+):
+    """Turn raw search query params into ``(search_kwargs, pages)`` for pyfunda.
+
+    ``search_kwargs`` holds everything except the page number. Raises
+    ``ValidationError`` for malformed numeric params.
+    """
+    location = _as_optional_str(location) or "amsterdam"
+    object_type = _as_list_param(object_type) or None
+    energy_label = _as_list_param(energy_label, lowercase=False)
+    energy_label = [item.upper() for item in energy_label] or None
+    availability = _as_list_param(availability) or None
+    pages = _as_list_param(pages)
+    if not pages:
+        single_page = _as_optional_int(page)
+        pages = [str(single_page)] if single_page is not None else ["0"]
+    pages = [_as_optional_int(p, "pages") for p in pages]
+    pages = [p for p in pages if p is not None]
+    if not pages:
+        pages = [0]
+    offering_type = _as_optional_str(offering_type) or "buy"
+    sort = _as_optional_str(sort)
+
+    search_kwargs = {
+        "location": location,
+        "offering_type": offering_type,
+        "availability": availability,
+        "radius_km": _as_optional_int(radius_km, "radius_km"),
+        "price_min": _as_optional_int(price_min, "price_min"),
+        "price_max": _as_optional_int(price_max, "price_max"),
+        "area_min": _as_optional_int(area_min, "area_min"),
+        "area_max": _as_optional_int(area_max, "area_max"),
+        "plot_min": _as_optional_int(plot_min, "plot_min"),
+        "plot_max": _as_optional_int(plot_max, "plot_max"),
+        "object_type": object_type,
+        "energy_label": energy_label,
+        "sort": sort,
+    }
+    return search_kwargs, pages
+
+
+def _tracked_changes(known, item):
+    """``{field: {"old", "new"}}`` for the tracked fields ``item`` changed.
+
+    Only fields both sides carry are compared: ``status`` comes from detail
+    lookups, so a listing whose details were never loaded has none.
+    """
+    return {
+        field: {"old": known[field], "new": item[field]}
+        for field in WATCH_TRACKED_FIELDS
+        if field in item and field in known and known[field] != item[field]
+    }
+
+
+def _listing_events(previous, items):
+    """``(event_type, public_id, change)`` for ``items`` against the ``previous`` snapshot."""
+    events = []
+    for public_id, item in items.items():
+        known = previous.get(public_id)
+        if known is None:
+            events.append(("listing_new", public_id, {}))
+            continue
+        for field, change in _tracked_changes(known, item).items():
+            events.append((f"{field}_changed", public_id, change))
+    return events
+
+
+def _sse_message(event):
+    data = json.dumps(event["data"], ensure_ascii=False)
+    prefix = f"id: {event['id']}\n" if "id" in event else ""
+    return f"{prefix}event: {event['type']}\ndata: {data}\n\n"
+
+
+def _parse_fields(value):
+    """Turn ``fields=`` into a projection tree, or ``None`` for the full payload.
+
+    Accepts comma-separated dotted paths (``price``, ``freshness.age_seconds``)
+    and preset names from ``FIELD_PRESETS``, which can be mixed.
+    """
+    tree = {}
+    for item in _as_list_param(value, lowercase=False):
+        if item == "full":
+            return None
+        if item in FIELD_PRESETS:
+            paths = FIELD_PRESETS[item]
+        elif FIELD_PATH_PATTERN.match(item):
+            paths = (item,)
+        else:
+            raise ValidationError("fields", f"unknown preset or invalid path '{item}'")
+        for path in paths:
+            node = tree
+            *parents, leaf = path.split(".")
+            for part in parents:
+                if part in node and node[part] is None:
+                    break
+                node = node.setdefault(part, {})
+            else:
+                node[leaf] = None
+    return tree or None
+
+
+def _project(value, tree):
+    """Copy only the paths in ``tree`` out of ``value``; lists are projected per item."""
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: _project(value[key], subtree) for key, subtree in tree.items() if key in value}
+
+
+def _search_query_key(search_kwargs):
+    """Canonical key for normalized search kwargs, independent of page and list order."""
+    canonical = {}
+    for name, value in search_kwargs.items():
+        if name == "page":
+            continue
+        if isinstance(value, list):
+            value = sorted(set(value))
+        canonical[name] = value
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+
+
 def _error_response(status_code, code, message, details=None):
     body = {"error": {"code": code, "message": message}}
     if details is not None:
@@ -114,7 +2198,42 @@ def _error_response(status_code, code, message, details=None):
     return (status_code, body)
 
 
-def _build_preview_base64(image_bytes, max_size=320, quality=65):
+def _write_chunk(http_response, data):
+    http_response.write_bytes(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+def _finish_streamed_response(http_response):
+    # ResponseWrapper only flags a response as sent from close(), which also
+    # closes the socket writer that the threading server flushes once the
+    # handler returns. Flag it directly and leave flushing and keep-alive to the
+    # server; the chunked body is already terminated.
+    http_response._ResponseWrapper__is_sent = True
+
+
+def _upstream_error_response(exc):
+    if isinstance(exc, DeadlineExceeded):
+        return _error_response(504, "deadline_exceeded", str(exc))
+    if isinstance(exc, CircuitOpenError):
+        return _error_response(
+            503,
+            "circuit_open",
+            str(exc),
+            {"circuit": exc.name, "retry_after_seconds": round(exc.retry_after, 3)},
+        )
+    return _error_response(502, "upstream_error", str(exc))
+
+
+def _listing_error_response(listing_id, exc):
+    if isinstance(exc, LookupError):
+        return _error_response(
+            404, "listing_not_found", f"Listing '{listing_id}' was not found"
+        )
+    if isinstance(exc, ValueError):
+        return _error_response(400, "invalid_listing_id", str(exc))
+    return _upstream_error_response(exc)
+
+
+def _build_preview_bytes(image_bytes, max_size=320, quality=65):
     try:
         from PIL import Image
     except ImportError as exc:
@@ -122,66 +2241,940 @@ def _build_preview_base64(image_bytes, max_size=320, quality=65):
             "Pillow is required for preview generation. Install package 'Pillow'."
         ) from exc
 
-    with Image.open(io.BytesIO(image_bytes)) as img:
-        img = img.convert("RGB")
-        img.thumbnail((max_size, max_size))
-        output = io.BytesIO()
-        img.save(output, format="JPEG", optimize=True, quality=quality)
-        preview_bytes = output.getvalue()
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale. Asking for twice the
+        # preview size keeps thumbnail's resampling quality while skipping most
+        # of the full-resolution decode; other formats ignore the hint.
+        img.draft("RGB", (max_size * 2, max_size * 2))
+        img = img.convert("RGB")
+        img.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        img.save(output, format="JPEG", optimize=True, quality=quality)
+        preview_bytes = output.getvalue()
+
+    return "image/jpeg", preview_bytes
+
+
+def _extract_photo_id(url):
+    # example URL: https://images.funda.nl/hdp/224/802/529/jpeg/224_802_529.jpeg
+    # returns: "224/802/529"
+    return "/".join(url.split("/")[-3:]).split(".")[0]
+
+
+def _preview_settings(preview_size, preview_quality):
+    """Parse and clamp ``(max_size, quality)``; raises ``ValidationError``."""
+    max_size = _as_optional_int(preview_size, "preview_size") or 320
+    max_size = _ensure_boundries(max_size, 64, 1024)
+
+    quality = _as_optional_int(preview_quality, "preview_quality") or 65
+    quality = _ensure_boundries(quality, 30, 90)
+    return max_size, quality
+
+
+def _resolve_output_base_dir(dir_value):
+    relative = _as_optional_str(dir_value, lowercase=False) or "previews"
+    relative_path = Path(relative)
+    if relative_path.is_absolute():
+        raise ValueError("dir must be a relative path")
+
+    base_dir = (SKILL_ROOT / relative_path).resolve()
+    skill_root_resolved = SKILL_ROOT.resolve()
+    if skill_root_resolved not in base_dir.parents and base_dir != skill_root_resolved:
+        raise ValueError("dir must stay inside skill root")
+
+    return base_dir
+
+
+def is_port_listening(port, host="127.0.0.1", timeout=0.5):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        return sock.connect_ex((host, int(port))) == 0
+
+
+def _response_status(result, http_response=None):
+    if isinstance(result, tuple) and result and isinstance(result[0], int):
+        return result[0]
+    if result is None and isinstance(getattr(http_response, "status_code", None), int):
+        return http_response.status_code
+    return 200
+
+
+def _instrumented(fn, route_path, metrics):
+    """Wrap a route handler to record its latency, status and in-flight count."""
+    labels = (("route", route_path),)
+
+    @functools.wraps(fn)
+    def handler(*args, **kwargs):
+        metrics.inc("funda_gateway_requests_started_total", labels)
+        started = time.perf_counter()
+        status = 500
+        try:
+            result = fn(*args, **kwargs)
+            status = _response_status(result, kwargs.get("http_response"))
+            return result
+        finally:
+            metrics.inc("funda_gateway_requests_finished_total", labels)
+            metrics.observe(
+                "funda_gateway_request_duration_seconds",
+                labels + (("status", str(status)),),
+                time.perf_counter() - started,
+            )
+
+    handler.__signature__ = inspect.signature(fn)
+    return handler
+
+
+def _request_context(fn, retries):
+    """Wrap a route handler so each request gets its own upstream retry budget
+    and priority class.
+
+    The priority comes from the ``priority`` query parameter or the
+    ``X-Funda-Priority`` header; both are added to the handler signature so
+    every route accepts them. The deadline starts unset; routes taking
+    ``deadline_ms`` set it, and it is cleared with the rest when the request ends.
+    """
+    signature = inspect.signature(fn)
+    extra = [
+        inspect.Parameter(
+            name,
+            inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            default=default,
+        )
+        for name, default in (
+            ("priority", Parameter("priority", default="")),
+            ("priority_header", Header("X-Funda-Priority", default="")),
+        )
+    ]
+
+    @functools.wraps(fn)
+    def handler(*args, priority="", priority_header="", **kwargs):
+        name = _as_optional_str(priority) or _as_optional_str(priority_header) or DEFAULT_PRIORITY
+        if name not in PRIORITY_WEIGHTS:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid priority parameter",
+                {"field": "priority", "reason": f"must be one of {', '.join(PRIORITY_WEIGHTS)}"},
+            )
+        budget_token = _RETRY_BUDGET.set(RetryBudget(retries))
+        deadline_token = _DEADLINE.set(None)
+        priority_token = _PRIORITY.set(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _PRIORITY.reset(priority_token)
+            _DEADLINE.reset(deadline_token)
+            _RETRY_BUDGET.reset(budget_token)
+
+    handler.__signature__ = signature.replace(
+        parameters=list(signature.parameters.values()) + extra
+    )
+    return handler
+
+
+def _submit_in_context(executor, fn, *args, **kwargs):
+    # Fan-out work keeps the retry budget and deadline of the request it serves.
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _upstream_outcome(exc, status_codes=()):
+    """Classify a finished upstream call as ``ok``, ``throttled`` or ``failed``."""
+    if exc is None:
+        return "ok"
+    codes = {code for code in status_codes if isinstance(code, int)}
+    if isinstance(getattr(exc, "status_code", None), int):
+        codes.add(exc.status_code)
+    match = re.search(r"\bstatus (\d{3})\b", str(exc))
+    if match:
+        codes.add(int(match.group(1)))
+    if 429 in codes:
+        return "throttled"
+    if any(code >= 500 for code in codes):
+        return "failed"
+    # The upstream answered (unknown listing, bad id, missing photo).
+    if isinstance(exc, (LookupError, ValueError)) or codes:
+        return "ok"
+    return "failed"
+
+
+def _backoff_delay(attempt, base=RETRY_BASE_DELAY_SECONDS, cap=RETRY_MAX_DELAY_SECONDS):
+    # Full jitter: concurrent retries spread out instead of arriving together.
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def _record_response_statuses(funda, statuses):
+    """Append the HTTP status of every pyfunda request to ``statuses.codes``.
+
+    pyfunda reports a throttled listing lookup (429) as "not found"; the
+    circuit breaker needs the real status to tell the two apart. ``statuses``
+    is a ``threading.local``; callers reset ``codes`` before each call.
+    """
+    for name in ("_get", "_post"):
+        request = getattr(funda, name, None)
+        if request is None:
+            continue
+
+        def recording(*args, _request=request, **kwargs):
+            response = _request(*args, **kwargs)
+            codes = getattr(statuses, "codes", None)
+            if codes is not None:
+                codes.append(getattr(response, "status_code", None))
+            return response
+
+        setattr(funda, name, recording)
+
+
+class _LoopResponse:
+    """Hands a ResponseWrapper to a handler running off the event loop.
+
+    asyncio transports may only be used from the loop thread, so attribute
+    writes and method calls are queued on the loop in the order they are made.
+    """
+
+    def __init__(self, response, loop):
+        object.__setattr__(self, "_response", response)
+        object.__setattr__(self, "_loop", loop)
+
+    def __getattr__(self, name):
+        value = getattr(self._response, name)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            self._loop.call_soon_threadsafe(functools.partial(value, *args, **kwargs))
+
+        return call
+
+    def __setattr__(self, name, value):
+        self._loop.call_soon_threadsafe(setattr, self._response, name, value)
+
+
+def _ignore_client_disconnects(loop, context):
+    # The coroutine server half-closes every connection after a response; when
+    # the client has already hung up that fails and is logged as an unhandled
+    # exception, although nothing was lost.
+    if isinstance(context.get("exception"), OSError) and "client_connected_cb" in context.get(
+        "message", ""
+    ):
+        return
+    loop.default_exception_handler(context)
+
+
+def _async_route(path, method=None, executor=None):
+    """Like ``route``, but registers a coroutine that runs the handler on ``executor``.
+
+    Handlers and pyfunda are synchronous; running them on worker threads keeps
+    the event loop free to accept and parse other requests while they wait on
+    Funda. The handler signature is kept so parameter binding is unchanged.
+    """
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def handler(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            if loop.get_exception_handler() is None:
+                loop.set_exception_handler(_ignore_client_disconnects)
+            if "http_response" in kwargs:
+                kwargs["http_response"] = _LoopResponse(kwargs["http_response"], loop)
+            return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+        handler.__signature__ = signature
+        route(path, method=method)(handler)
+        return fn
+
+    return decorator
+
+
+def _split_evenly(total, parts):
+    """Split ``total`` into ``parts`` integers that differ by at most one."""
+    share, remainder = divmod(total, parts)
+    return [share + (index < remainder) for index in range(parts)]
+
+
+def _run_workers(workers, server_kwargs, worker_kwargs=None):
+    """Run ``workers`` gateway processes on one port; stop all when one exits.
+
+    ``worker_kwargs`` optionally holds one dict per worker, overriding
+    ``server_kwargs`` for that worker.
+    """
+    context = multiprocessing.get_context("spawn")
+    worker_kwargs = worker_kwargs or [{}] * workers
+    processes = [
+        context.Process(
+            target=spin_up_server,
+            kwargs=dict(server_kwargs, **worker_kwargs[index], worker_index=index),
+            name=f"funda-gateway-{index}",
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Turn SIGTERM into SystemExit so the workers are stopped with the parent.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    try:
+        multiprocessing.connection.wait([process.sentinel for process in processes])
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    exit_codes = [process.exitcode for process in processes]
+    print(f"[funda_gateway] worker exited, stopped all workers (exit codes {exit_codes})")
+
+
+def spin_up_server(
+    server_port,
+    funda_timeout,
+    listing_cache_size=LISTING_CACHE_SIZE,
+    listing_cache_ttl=LISTING_CACHE_TTL_SECONDS,
+    search_cache_size=SEARCH_CACHE_SIZE,
+    search_cache_ttl=SEARCH_CACHE_TTL_SECONDS,
+    search_cache_stale=SEARCH_CACHE_STALE_SECONDS,
+    preview_workers=PREVIEW_WORKERS,
+    image_pool_size=IMAGE_POOL_SIZE,
+    resize_processes=RESIZE_PROCESSES,
+    preview_cache_dir=PREVIEW_CACHE_DIR,
+    preview_cache_mb=PREVIEW_CACHE_MB,
+    rate_limit=UPSTREAM_RATE_LIMIT,
+    rate_burst=UPSTREAM_RATE_BURST,
+    state_db=STATE_DB_PATH,
+    engine="threaded",
+    workers=1,
+    shared_cache_db=None,
+    reuse_port=False,
+    retry_budget=UPSTREAM_RETRY_BUDGET,
+    breaker_open_seconds=BREAKER_OPEN_SECONDS,
+    prefetch_interval=PREFETCH_INTERVAL_SECONDS,
+    prefetch_concurrency=PREFETCH_CONCURRENCY,
+    worker_index=0,
+):
+    if engine not in SERVER_ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(SERVER_ENGINES)}")
+    if workers > 1 and engine != "threaded":
+        raise ValueError("workers > 1 requires the threaded engine")
+    # Workers share the port on purpose, so only the parent checks it.
+    if not reuse_port and is_port_listening(server_port):
+        raise RuntimeError(f"Gateway already running on 127.0.0.1:{server_port}")
+
+    if workers > 1:
+        # The Funda rate limit is gateway-wide, so each worker gets its share;
+        # the burst is split in whole tokens, the remainder going to the first workers.
+        _run_workers(
+            workers,
+            dict(
+                server_port=server_port,
+                funda_timeout=funda_timeout,
+                listing_cache_size=listing_cache_size,
+                listing_cache_ttl=listing_cache_ttl,
+                search_cache_size=search_cache_size,
+                search_cache_ttl=search_cache_ttl,
+                search_cache_stale=search_cache_stale,
+                preview_workers=preview_workers,
+                image_pool_size=image_pool_size,
+                resize_processes=resize_processes,
+                preview_cache_dir=preview_cache_dir,
+                preview_cache_mb=preview_cache_mb,
+                rate_limit=rate_limit / workers,
+                state_db=state_db,
+                engine=engine,
+                shared_cache_db=shared_cache_db or SHARED_CACHE_PATH,
+                reuse_port=True,
+                retry_budget=retry_budget,
+                breaker_open_seconds=breaker_open_seconds,
+                prefetch_interval=prefetch_interval,
+                prefetch_concurrency=prefetch_concurrency,
+            ),
+            [{"rate_burst": max(1, burst)} for burst in _split_evenly(rate_burst, workers)],
+        )
+        return
+
+    f = DeadlineFunda(timeout=funda_timeout)
+    response_statuses = threading.local()
+    _record_response_statuses(f, response_statuses)
+    shared_listings = shared_searches = None
+    if shared_cache_db:
+        shared_listings = SharedCacheTier(
+            SKILL_ROOT / shared_cache_db, "listings", listing_cache_ttl
+        )
+        shared_searches = SharedCacheTier(
+            SKILL_ROOT / shared_cache_db, "searches", search_cache_ttl + search_cache_stale
+        )
+    listing_cache = TTLCache(listing_cache_size, listing_cache_ttl, shared=shared_listings)
+    search_cache = TTLCache(
+        search_cache_size, search_cache_ttl, search_cache_stale, shared=shared_searches
+    )
+    refreshing_pages = set()
+    refreshing_lock = threading.Lock()
+    preview_executor = ThreadPoolExecutor(
+        max_workers=max(1, preview_workers), thread_name_prefix="preview"
+    )
+    # One pool per priority class, so a background crawl cannot hold every
+    # thread interactive fan-out needs.
+    upstream_executors = {
+        priority: ThreadPoolExecutor(
+            max_workers=UPSTREAM_WORKERS, thread_name_prefix=f"upstream-{priority}"
+        )
+        for priority in PRIORITY_WEIGHTS
+    }
+    image_sessions = ImageSessionPool(
+        image_pool_size if image_pool_size > 0 else preview_workers, funda_timeout
+    )
+    # Pillow holds the GIL while decoding and encoding, so resizing in threads
+    # uses one core; a process pool spreads it over several. Workers start on
+    # first use, after the server socket is open, so they are spawned rather
+    # than forked to avoid inheriting it.
+    resize_pool = (
+        ProcessPoolExecutor(
+            max_workers=resize_processes, mp_context=multiprocessing.get_context("spawn")
+        )
+        if resize_processes > 0
+        else None
+    )
+    # Workers share the preview directory, so they keep its index (and quota) together.
+    preview_cache_path = SKILL_ROOT / preview_cache_dir
+    shared_previews = None
+    if shared_cache_db:
+        shared_previews = SharedPreviewIndex(preview_cache_path / "index.sqlite3")
+    preview_cache = PreviewCache(
+        preview_cache_path, preview_cache_mb * 1024 * 1024, shared=shared_previews
+    )
+    rate_limiter = TokenBucket(rate_limit, rate_burst)
+    scheduler = UpstreamScheduler(rate_limiter, PRIORITY_WEIGHTS)
+    watch_store = WatchStore(SKILL_ROOT / state_db)
+    listing_store = ListingStore(SKILL_ROOT / state_db)
+    flights = SingleFlight(on_promote=scheduler.wake)
+    event_log = EventLog()
+    metrics = Metrics()
+    upstream_health = UpstreamHealth()
+    image_health = UpstreamHealth()
+    started_at = time.time()
+
+    def circuit_changed(name, previous, state):
+        print(f"[funda_gateway] {name} circuit {previous} -> {state}")
+        metrics.inc("funda_gateway_circuit_transitions_total", (("circuit", name), ("to", state)))
+
+    funda_breaker = CircuitBreaker(
+        "funda", open_seconds=breaker_open_seconds, on_change=circuit_changed
+    )
+    image_breaker = CircuitBreaker(
+        "images", open_seconds=breaker_open_seconds, on_change=circuit_changed
+    )
+    route_paths = []
+    if engine == "async":
+        engine_route = functools.partial(
+            _async_route,
+            executor=ThreadPoolExecutor(
+                max_workers=ASYNC_HANDLER_WORKERS, thread_name_prefix="handler"
+            ),
+        )
+    else:
+        engine_route = route
+
+    def register_route(path, method=None):
+        def decorator(fn):
+            if path not in route_paths:
+                route_paths.append(path)
+            engine_route(path, method=method)(
+                _instrumented(_request_context(fn, retry_budget), path, metrics)
+            )
+            return fn
+
+        return decorator
+
+    for name, kind, help_text in (
+        ("funda_gateway_request_duration_seconds", "histogram", "Route latency by status code"),
+        ("funda_gateway_requests_started_total", "counter", "Requests started per route"),
+        ("funda_gateway_requests_finished_total", "counter", "Requests finished per route"),
+        ("funda_gateway_requests_in_flight", "gauge", "Requests being handled per route"),
+        ("funda_gateway_upstream_duration_seconds", "histogram", "pyfunda call latency"),
+        ("funda_gateway_upstream_started_total", "counter", "pyfunda calls started"),
+        ("funda_gateway_upstream_finished_total", "counter", "pyfunda calls finished"),
+        ("funda_gateway_upstream_in_flight", "gauge", "pyfunda calls in progress"),
+        ("funda_gateway_photo_download_seconds", "histogram", "Photo download latency"),
+        ("funda_gateway_photo_resize_seconds", "histogram", "Preview resize latency"),
+        ("funda_gateway_cache_hits_total", "counter", "Cache hits"),
+        ("funda_gateway_cache_misses_total", "counter", "Cache misses"),
+        ("funda_gateway_cache_hit_ratio", "gauge", "Cache hits / lookups"),
+        ("funda_gateway_cache_entries", "gauge", "Entries held by each cache"),
+        ("funda_gateway_single_flight_coalesced_total", "counter", "Upstream calls coalesced"),
+        (
+            "funda_gateway_single_flight_promoted_total",
+            "counter",
+            "Coalesced calls raised to a joining caller's priority",
+        ),
+        ("funda_gateway_image_connections_total", "counter", "Photo downloads by connection reuse"),
+        ("funda_gateway_uptime_seconds", "gauge", "Seconds since the gateway started"),
+        ("funda_gateway_upstream_outcomes_total", "counter", "Upstream calls by outcome"),
+        ("funda_gateway_upstream_retries_total", "counter", "Upstream calls retried"),
+        ("funda_gateway_circuit_state", "gauge", "1 for the current state of each circuit"),
+        ("funda_gateway_circuit_transitions_total", "counter", "Circuit state changes"),
+        ("funda_gateway_circuit_rejected_total", "counter", "Calls failed fast by an open circuit"),
+        ("funda_gateway_upstream_queue_wait_seconds", "histogram", "Wait for a rate-limited slot"),
+        ("funda_gateway_upstream_queue_depth", "gauge", "Calls waiting for a slot per priority"),
+        ("funda_gateway_upstream_granted_total", "counter", "Rate-limited slots granted"),
+        ("funda_gateway_events_published_total", "counter", "Listing events by type"),
+        ("funda_gateway_event_subscribers", "gauge", "Open /events streams"),
+    ):
+        metrics.describe(name, kind, help_text)
+
+    def scrape_samples():
+        samples = [("funda_gateway_uptime_seconds", (), time.time() - started_at)]
+        for path in route_paths:
+            labels = (("route", path),)
+            in_flight = metrics.counter_value(
+                "funda_gateway_requests_started_total", labels
+            ) - metrics.counter_value("funda_gateway_requests_finished_total", labels)
+            samples.append(("funda_gateway_requests_in_flight", labels, in_flight))
+        samples.append(
+            (
+                "funda_gateway_upstream_in_flight",
+                (),
+                metrics.counter_value("funda_gateway_upstream_started_total")
+                - metrics.counter_value("funda_gateway_upstream_finished_total"),
+            )
+        )
+        for cache_name, cache in (
+            ("listings", listing_cache),
+            ("searches", search_cache),
+            ("previews", preview_cache),
+        ):
+            stats = cache.stats()
+            labels = (("cache", cache_name),)
+            samples.append(("funda_gateway_cache_hits_total", labels, stats["hits"]))
+            samples.append(("funda_gateway_cache_misses_total", labels, stats["misses"]))
+            samples.append(("funda_gateway_cache_hit_ratio", labels, stats["hit_ratio"]))
+            samples.append(("funda_gateway_cache_entries", labels, stats["size"]))
+        flight_stats = flights.stats()
+        samples.append(
+            ("funda_gateway_single_flight_coalesced_total", (), flight_stats["coalesced"])
+        )
+        samples.append(
+            ("funda_gateway_single_flight_promoted_total", (), flight_stats["promoted"])
+        )
+        image_stats = image_sessions.stats()
+        for reuse in ("new", "reused"):
+            samples.append(
+                (
+                    "funda_gateway_image_connections_total",
+                    (("connection", reuse),),
+                    image_stats[f"{reuse}_connections"],
+                )
+            )
+        for breaker in (funda_breaker, image_breaker):
+            stats = breaker.stats()
+            labels = (("circuit", breaker.name),)
+            for state in CircuitBreaker.STATES:
+                samples.append(
+                    (
+                        "funda_gateway_circuit_state",
+                        labels + (("state", state),),
+                        1 if stats["state"] == state else 0,
+                    )
+                )
+            samples.append(("funda_gateway_circuit_rejected_total", labels, stats["rejected"]))
+        for priority, stats in scheduler.stats().items():
+            labels = (("priority", priority),)
+            samples.append(("funda_gateway_upstream_queue_depth", labels, stats["waiting"]))
+            samples.append(("funda_gateway_upstream_granted_total", labels, stats["granted"]))
+        events_stats = event_log.stats()
+        samples.append(("funda_gateway_event_subscribers", (), events_stats["subscribers"]))
+        for event_type, count in events_stats["published"].items():
+            samples.append(
+                ("funda_gateway_events_published_total", (("type", event_type),), count)
+            )
+        return samples
+
+    metrics.callback(scrape_samples)
+
+    def call_guarded(breaker, health, method, *args, **kwargs):
+        # Transient failures are retried with jittered exponential backoff while
+        # the request's retry budget lasts; an open circuit fails fast instead.
+        budget = _RETRY_BUDGET.get() or RetryBudget(retry_budget)
+        labels = (("circuit", breaker.name),)
+        attempt = 0
+        while True:
+            remaining = _deadline_remaining()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded(f"deadline passed before the {breaker.name} call")
+            breaker.before_call()
+            response_statuses.codes = []
+            error = None
+            try:
+                result = method(*args, **kwargs)
+            except Exception as exc:
+                error = exc
+            outcome = _upstream_outcome(error, response_statuses.codes)
+            remaining = _deadline_remaining()
+            if outcome != "ok" and (
+                isinstance(error, DeadlineExceeded) or (remaining is not None and remaining <= 0)
+            ):
+                # Abandoned at the deadline (likely the capped timeout), not an upstream fault.
+                outcome = "cancelled"
+            breaker.record(outcome)
+            if outcome != "cancelled":
+                health.record(None if outcome == "ok" else error)
+            metrics.inc("funda_gateway_upstream_outcomes_total", labels + (("outcome", outcome),))
+            if error is None:
+                return result
+            if outcome == "ok":
+                raise error
+            if outcome == "cancelled":
+                if isinstance(error, DeadlineExceeded):
+                    raise error
+                raise DeadlineExceeded(f"deadline passed during the {breaker.name} call") from error
+            delay = _backoff_delay(attempt)
+            if (remaining is not None and delay >= remaining) or not budget.take():
+                if isinstance(error, (LookupError, ValueError)):
+                    # pyfunda reports throttling and server errors as "not found".
+                    codes = ", ".join(
+                        str(code) for code in response_statuses.codes if isinstance(code, int)
+                    )
+                    raise UpstreamError(f"{breaker.name} call {outcome} (HTTP {codes})") from error
+                raise error
+            metrics.inc("funda_gateway_upstream_retries_total", labels)
+            time.sleep(delay)
+            attempt += 1
+
+    def submit_upstream(fn, *args, **kwargs):
+        return _submit_in_context(upstream_executors[_PRIORITY.get()], fn, *args, **kwargs)
+
+    def rate_limited_call(method, *args, **kwargs):
+        waited = scheduler.acquire(
+            _current_priority(), timeout=_deadline_remaining(), flight=_FLIGHT.get()
+        )
+        if waited is None:
+            raise DeadlineExceeded("deadline passed while waiting for the rate limit")
+        metrics.observe(
+            "funda_gateway_upstream_queue_wait_seconds",
+            (("priority", _current_priority()),),
+            waited,
+        )
+        labels = (("call", getattr(method, "__name__", "call")),)
+        metrics.inc("funda_gateway_upstream_started_total")
+        try:
+            with metrics.timed("funda_gateway_upstream_duration_seconds", labels):
+                return method(*args, **kwargs)
+        finally:
+            metrics.inc("funda_gateway_upstream_finished_total")
+
+    def call_upstream(method, *args, **kwargs):
+        # Every pyfunda call goes through here so politeness towards Funda is
+        # enforced gateway-wide, not per request.
+        return call_guarded(
+            funda_breaker, upstream_health, rate_limited_call, method, *args, **kwargs
+        )
+
+    def record_listings(items, details=False):
+        # The store only backs /query; failing to write it must not fail the
+        # request that fetched the listings.
+        try:
+            listing_store.upsert(items, details=details)
+        except Exception as exc:
+            print(f"[funda_gateway] listing store write failed: {exc}")
+
+    def record_listing_details(listing_id, listing):
+        try:
+            data = listing.to_dict()
+        except Exception as exc:
+            print(f"[funda_gateway] listing store write failed: {exc}")
+            return
+        record_listings({fetch_public_id(data.get("url") or listing_id): data}, details=True)
+
+    def load_listing(listing_id, fresh=False):
+        # One agent turn typically asks for a listing, its history and its photos;
+        # all three routes share this cache so only the first one goes upstream.
+        key = str(listing_id)
+        if not fresh:
+            listing = listing_cache.get(key)
+            if listing is not None:
+                return listing
+        listing = flights.do(
+            ("get_listing", key), call_upstream, f.get_listing, listing_id
+        )
+        listing_cache.set(key, listing)
+        record_listing_details(key, listing)
+        return listing
+
+    def fetch_search_page(query_key, search_kwargs):
+        return flights.do(
+            ("search_listing", query_key, search_kwargs["page"]),
+            search_page_upstream,
+            query_key,
+            search_kwargs,
+        )
 
-    return "image/jpeg", base64.b64encode(preview_bytes).decode("ascii")
+    def search_page_upstream(query_key, search_kwargs):
+        print(f"[funda_gateway] search_listing kwargs: {search_kwargs}")
+        results = call_upstream(f.search_listing, **search_kwargs)
+        page_items = {}
+        for result in results:
+            public_id = fetch_public_id(result["detail_url"])
+            item = result.to_dict()
+            item.setdefault("public_id", public_id)
+            page_items[public_id] = item
+        search_cache.set((query_key, search_kwargs["page"]), page_items)
+        record_listings(page_items)
+        return page_items
 
+    def refresh_search_page(query_key, search_kwargs):
+        # Stale-while-revalidate: the caller already got the stale page, refresh
+        # it once in the background no matter how many requests hit it meanwhile.
+        cache_key = (query_key, search_kwargs["page"])
+        with refreshing_lock:
+            if cache_key in refreshing_pages:
+                return
+            refreshing_pages.add(cache_key)
 
-def _resolve_output_base_dir(dir_value):
-    relative = _as_optional_str(dir_value, lowercase=False) or "previews"
-    relative_path = Path(relative)
-    if relative_path.is_absolute():
-        raise ValueError("dir must be a relative path")
+        def run():
+            try:
+                fetch_search_page(query_key, search_kwargs)
+            except Exception as exc:
+                print(f"[funda_gateway] background refresh failed: {exc}")
+            finally:
+                with refreshing_lock:
+                    refreshing_pages.discard(cache_key)
 
-    base_dir = (SKILL_ROOT / relative_path).resolve()
-    skill_root_resolved = SKILL_ROOT.resolve()
-    if skill_root_resolved not in base_dir.parents and base_dir != skill_root_resolved:
-        raise ValueError("dir must stay inside skill root")
+        upstream_executors["background"].submit(_in_background, run)
 
-    return base_dir
+    def start_search(base_kwargs, pages, bypass_cache=False):
+        # Cached pages are served directly (stale ones refresh in the background);
+        # the rest are fetched concurrently within the shared rate limit. Returns
+        # one source per page, either the page items or a Future for them.
+        query_key = _search_query_key(base_kwargs)
+        sources = []
+        page_meta = []
+        for page in pages:
+            search_kwargs = dict(base_kwargs, page=page)
+            cached = None if bypass_cache else search_cache.lookup((query_key, page))
+            if cached is None:
+                sources.append(
+                    submit_upstream(fetch_search_page, query_key, search_kwargs)
+                )
+                page_meta.append(
+                    {"page": page, "hit": False, "stale": False, "age_seconds": 0.0}
+                )
+                continue
+            page_items, age, is_stale = cached
+            if is_stale:
+                refresh_search_page(query_key, search_kwargs)
+            sources.append(page_items)
+            page_meta.append(
+                {"page": page, "hit": True, "stale": is_stale, "age_seconds": round(age, 3)}
+            )
 
+        hits = sum(1 for meta in page_meta if meta["hit"])
+        cache_meta = {"hit_ratio": round(hits / len(page_meta), 4), "pages": page_meta}
+        return sources, cache_meta
 
-def is_port_listening(port, host="127.0.0.1", timeout=0.5):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.settimeout(timeout)
-        return sock.connect_ex((host, int(port))) == 0
+    def merge_search_pages(sources, pages, timeout=None):
+        # Merge in page order and keep the first occurrence of a listing, the
+        # same way the NDJSON stream resolves duplicates. Pages not fetched
+        # within ``timeout`` seconds are skipped; returns (items, skipped pages).
+        futures = [source for source in sources if isinstance(source, Future)]
+        if timeout is not None:
+            wait(futures, timeout=timeout)
+        response = {}
+        skipped = []
+        try:
+            for source, page in zip(sources, pages):
+                if isinstance(source, Future):
+                    if not source.done() and timeout is not None:
+                        skipped.append(page)
+                        continue
+                    try:
+                        source = source.result()
+                    except DeadlineExceeded:
+                        skipped.append(page)
+                        continue
+                for public_id, item in source.items():
+                    response.setdefault(public_id, item)
+        finally:
+            for future in futures:
+                future.cancel()
+        return response, skipped
 
+    def fetch_photo(url):
+        return image_sessions.fetch(url, timeout=_deadline_timeout(funda_timeout))
 
-def spin_up_server(server_port, funda_timeout):
-    if is_port_listening(server_port):
-        raise RuntimeError(f"Gateway already running on 127.0.0.1:{server_port}")
+    def render_preview(url, photo_id, max_size, quality):
+        # A cached rendering skips both the download and the Pillow work.
+        # Returns the JPEG bytes; base64 is only applied for JSON responses.
+        cache_key = PreviewCache.key(photo_id, max_size, quality)
+        preview_bytes = preview_cache.get(cache_key)
+        if preview_bytes is None:
+            with metrics.timed("funda_gateway_photo_download_seconds"):
+                content = call_guarded(image_breaker, image_health, fetch_photo, url)
+            with metrics.timed("funda_gateway_photo_resize_seconds"):
+                if resize_pool is None:
+                    _, preview_bytes = _build_preview_bytes(
+                        content, max_size=max_size, quality=quality
+                    )
+                else:
+                    _, preview_bytes = resize_pool.submit(
+                        _build_preview_bytes, content, max_size=max_size, quality=quality
+                    ).result()
+            try:
+                preview_cache.set(cache_key, preview_bytes)
+            except OSError as exc:
+                print(f"[funda_gateway] preview cache write failed: {exc}")
+        return "image/jpeg", preview_bytes
+
+    @register_route("/cache_stats", method=["GET"])
+    def cache_stats():
+        return {
+            "listings": listing_cache.stats(),
+            "searches": search_cache.stats(),
+            "single_flight": flights.stats(),
+            "store": listing_store.stats(),
+            "previews": preview_cache.stats(),
+            "image_sessions": image_sessions.stats(),
+            "worker": {
+                "pid": os.getpid(),
+                "shared_listings": shared_listings.stats() if shared_listings else None,
+                "shared_searches": shared_searches.stats() if shared_searches else None,
+            },
+        }
 
-    f = Funda(timeout=funda_timeout)
+    @register_route("/metrics", method=["GET"])
+    def metrics_endpoint():
+        return (
+            200,
+            Headers({"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}),
+            metrics.render().encode("utf-8"),
+        )
 
-    @route("/get_listing/{id}", method=["GET"])
-    def get_listing(id=PathValue()):
+    def process_status():
+        # In-memory state only: probes must never cost a Funda call or a disk read.
+        return {
+            "version": GATEWAY_VERSION,
+            "pid": os.getpid(),
+            "engine": engine,
+            "uptime_seconds": round(time.time() - started_at, 3),
+            "caches": {
+                "listings": listing_cache.stats()["size"],
+                "searches": search_cache.stats()["size"],
+                "previews": preview_cache.stats()["size"],
+            },
+        }
+
+    @register_route("/health", method=["GET"])
+    def health():
+        return {"status": "ok", **process_status()}
+
+    @register_route("/ready", method=["GET"])
+    def ready():
+        # Not ready only while the Funda circuit is open; a photo host outage
+        # degrades previews but not the rest of the API.
+        upstream = {**upstream_health.stats(), "circuit": funda_breaker.stats()}
+        images = {**image_health.stats(), "circuit": image_breaker.stats()}
+        is_ready = upstream["circuit"]["state"] != CircuitBreaker.OPEN
+        body = {"ready": is_ready, **process_status(), "upstream": upstream, "images": images}
+        return (200, body) if is_ready else (503, body)
+
+    @register_route("/get_listing/{id}", method=["GET"])
+    def get_listing(
+        id=PathValue(),
+        fresh=Parameter("fresh", default="0"),  # Bypass the listing cache
+        fields=Parameter("fields", default=""),  # Dotted paths or preset (summary, full)
+    ):
+        try:
+            field_tree = _parse_fields(fields)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid fields parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
         try:
-            return f.get_listing(id).to_dict()
-        except LookupError:
-            return _error_response(404, "listing_not_found", f"Listing '{id}' was not found")
-        except ValueError as exc:
-            return _error_response(400, "invalid_listing_id", str(exc))
+            listing = load_listing(id, fresh=_as_bool_flag(fresh))
+            return _project(listing.to_dict(), field_tree)
         except Exception as exc:
-            return _error_response(502, "upstream_error", str(exc))
+            return _listing_error_response(id, exc)
+
+    @register_route("/get_listings", method=["GET"])
+    def get_listings(
+        ids=Parameter("ids", default=""),  # Comma-separated listing IDs
+        deadline_ms=Parameter("deadline_ms", default=""),  # Partial results after N ms
+        fresh=Parameter("fresh", default="0"),  # Bypass the listing cache
+        fields=Parameter("fields", default=""),  # Dotted paths or preset (summary, full)
+    ):
+        try:
+            field_tree = _parse_fields(fields)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid fields parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        listing_ids = list(dict.fromkeys(_as_list_param(ids)))
+        if not listing_ids or len(listing_ids) > BATCH_MAX_IDS:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid ids parameter",
+                {
+                    "field": "ids",
+                    "reason": f"must contain between 1 and {BATCH_MAX_IDS} listing ids",
+                },
+            )
+        try:
+            deadline = _as_optional_int(deadline_ms, "deadline_ms")
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+
+        should_refresh = _as_bool_flag(fresh)
+        timeout = _start_deadline(deadline)
+        futures = {
+            listing_id: submit_upstream(load_listing, listing_id, should_refresh)
+            for listing_id in listing_ids
+        }
+        wait(futures.values(), timeout=timeout)
+
+        listings = {}
+        pending = []
+        for listing_id, future in futures.items():
+            if not future.done():
+                future.cancel()
+                pending.append(listing_id)
+                continue
+            try:
+                listings[listing_id] = _project(future.result().to_dict(), field_tree)
+            except DeadlineExceeded:
+                pending.append(listing_id)
+            except Exception as exc:
+                listings[listing_id] = _listing_error_response(listing_id, exc)[1]
 
-    @route("/get_price_history/{id}", method=["GET"])
-    def get_price_history(id=PathValue()):
+        return {
+            "count": len(listings),
+            "listings": listings,
+            "partial": bool(pending),
+            "pending": pending,
+        }
+
+    @register_route("/get_price_history/{id}", method=["GET"])
+    def get_price_history(
+        id=PathValue(),
+        fresh=Parameter("fresh", default="0"),  # Bypass the listing cache
+    ):
         try:
-            listing = f.get_listing(id)
-            return {item["date"]: item for item in f.get_price_history(listing)}
-        except LookupError:
-            return _error_response(404, "listing_not_found", f"Listing '{id}' was not found")
-        except ValueError as exc:
-            return _error_response(400, "invalid_listing_id", str(exc))
+            listing = load_listing(id, fresh=_as_bool_flag(fresh))
+            history = flights.do(
+                ("get_price_history", str(id)), call_upstream, f.get_price_history, listing
+            )
+            return {item["date"]: item for item in history}
         except Exception as exc:
-            return _error_response(502, "upstream_error", str(exc))
+            return _listing_error_response(id, exc)
 
-    @route("/get_previews/{id}", method=["GET"])
+    @register_route("/get_previews/{id}", method=["GET"])
     def get_previews(
         id=PathValue(),
         limit=Parameter("limit", default="5"),  # Maximum number of previews to return
@@ -190,28 +3183,31 @@ def spin_up_server(server_port, funda_timeout):
         save=Parameter("save", default="0"),  # Save resized previews to disk
         dir=Parameter("dir", default=""),  # Relative output directory inside skill root
         filename_pattern=Parameter("filename_pattern", default=""),  # e.g. {id}_{index}
-        ids=Parameter("ids", default=""),
-    ):  # Comma-separated photo IDs (like 224/802/529). If omitted, take first N photos.
-
-        def extract_id(url):
-            # example URL: https://images.funda.nl/hdp/224/802/529/jpeg/224_802_529.jpeg
-            # returns: "224/802/529"
-            return "/".join(url.split("/")[-3:]).split(".")[0]
+        ids=Parameter("ids", default=""),  # Comma-separated photo IDs (like 224/802/529).
+        fresh=Parameter("fresh", default="0"),  # Bypass the listing cache
+        deadline_ms=Parameter("deadline_ms", default=""),  # Partial results after N ms
+    ):  # If ids is omitted, take first N photos.
+        try:
+            deadline = _as_optional_int(deadline_ms, "deadline_ms")
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        _start_deadline(deadline)
 
         try:
-            listing = f.get_listing(id)
-        except LookupError:
-            return _error_response(404, "listing_not_found", f"Listing '{id}' was not found")
-        except ValueError as exc:
-            return _error_response(400, "invalid_listing_id", str(exc))
+            listing = load_listing(id, fresh=_as_bool_flag(fresh))
         except Exception as exc:
-            return _error_response(502, "upstream_error", str(exc))
+            return _listing_error_response(id, exc)
 
         photo_urls = sorted(listing.get("photo_urls") or [])
         if not photo_urls:
-            return {"id": id, "count": 0, "previews": []}
+            return {"id": id, "count": 0, "previews": [], "partial": False, "skipped": []}
 
-        photo_ids_to_urls = {extract_id(url): url for url in photo_urls}
+        photo_ids_to_urls = {_extract_photo_id(url): url for url in photo_urls}
 
         ids = _as_list_param(ids)
 
@@ -219,11 +3215,7 @@ def spin_up_server(server_port, funda_timeout):
             max_items = _as_optional_int(limit, "limit") or 5
             max_items = _ensure_boundries(max_items, 1, 50)
 
-            max_size = _as_optional_int(preview_size, "preview_size") or 320
-            max_size = _ensure_boundries(max_size, 64, 1024)
-
-            quality = _as_optional_int(preview_quality, "preview_quality") or 65
-            quality = _ensure_boundries(quality, 30, 90)
+            max_size, quality = _preview_settings(preview_size, preview_quality)
         except ValidationError as exc:
             return _error_response(
                 400,
@@ -258,18 +3250,40 @@ def spin_up_server(server_port, funda_timeout):
 
         urls_to_download = urls_to_download[:max_items]
         previews = []
+        skipped = []
+
+        # Download and resize concurrently; results are consumed in submission
+        # order so the response keeps the same index order as before.
+        futures = [
+            _submit_in_context(
+                preview_executor, render_preview, url, _extract_photo_id(url), max_size, quality
+            )
+            for url in urls_to_download
+        ]
+        remaining = _deadline_remaining()
+        if remaining is not None:
+            wait(futures, timeout=max(0, remaining))
+        try:
+            for index, (url, future) in enumerate(zip(urls_to_download, futures), start=1):
+                photo_id = _extract_photo_id(url)
+                if remaining is not None and not future.done():
+                    skipped.append(photo_id)
+                    continue
+                try:
+                    content_type, preview_bytes = future.result()
+                except DeadlineExceeded:
+                    skipped.append(photo_id)
+                    continue
+                except (PhotoDownloadError, CircuitOpenError) as exc:
+                    previews.append(
+                        {
+                            "id": photo_id,
+                            "url": url,
+                            "error": str(exc),
+                        }
+                    )
+                    continue
 
-        for index, url in enumerate(urls_to_download, start=1):
-            photo_id = extract_id(url)
-            try:
-                request = urllib.request.Request(
-                    url, headers={"User-Agent": "Mozilla/5.0"}
-                )
-                with urllib.request.urlopen(request, timeout=funda_timeout) as response:
-                    content = response.read()
-                content_type, encoded = _build_preview_base64(
-                    content, max_size=max_size, quality=quality
-                )
                 previews.append(
                     {
                         "id": photo_id,
@@ -279,7 +3293,7 @@ def spin_up_server(server_port, funda_timeout):
                 )
 
                 if not should_save:
-                    previews[-1]["base64"] = encoded
+                    previews[-1]["base64"] = base64.b64encode(preview_bytes).decode("ascii")
 
                 if should_save and output_base_dir is not None:
                     safe_photo_id = photo_id.replace("/", "-")
@@ -311,23 +3325,73 @@ def spin_up_server(server_port, funda_timeout):
                     target_dir.mkdir(parents=True, exist_ok=True)
 
                     output_path = target_dir / filename
-                    output_path.write_bytes(base64.b64decode(encoded))
+                    output_path.write_bytes(preview_bytes)
                     previews[-1]["saved_path"] = str(output_path.resolve())
                     previews[-1]["relative_path"] = str(
                         output_path.resolve().relative_to(SKILL_ROOT.resolve())
                     )
-            except urllib.error.URLError as exc:
-                previews.append(
-                    {
-                        "id": photo_id,
-                        "url": url,
-                        "error": str(exc),
-                    }
-                )
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return {
+            "id": id,
+            "count": len(previews),
+            "previews": previews,
+            "partial": bool(skipped),
+            "skipped": skipped,
+        }
+
+    @register_route("/preview/{listing_id}/{photo_id}.jpg", method=["GET"])
+    def get_preview_image(
+        listing_id=PathValue(),
+        photo_id=PathValue(),  # Photo id with "-" separators, e.g. 224-802-529
+        preview_size=Parameter("preview_size", default="320"),  # Max preview side in px
+        preview_quality=Parameter("preview_quality", default="65"),  # JPEG quality
+        fresh=Parameter("fresh", default="0"),  # Bypass the listing cache
+        if_none_match=Header("If-None-Match", default=""),
+    ):
+        try:
+            max_size, quality = _preview_settings(preview_size, preview_quality)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+
+        photo_id = (photo_id or "").replace("-", "/")
+        # The listing (usually cached) is checked before the ETag, so a 304
+        # never vouches for a photo that is not in the listing.
+        try:
+            listing = load_listing(listing_id, fresh=_as_bool_flag(fresh))
+        except Exception as exc:
+            return _listing_error_response(listing_id, exc)
+        urls = {_extract_photo_id(url): url for url in listing.get("photo_urls") or []}
+        if photo_id not in urls:
+            return _error_response(
+                404,
+                "photo_not_found",
+                f"Photo '{photo_id}' was not found in listing '{listing_id}'",
+            )
 
-        return {"id": id, "count": len(previews), "previews": previews}
+        etag = f'"{PreviewCache.key(photo_id, max_size, quality)}"'
+        headers = Headers({"Cache-Control": PREVIEW_CACHE_CONTROL, "ETag": etag})
+        if if_none_match and etag in if_none_match:
+            return 304, headers
+
+        try:
+            # Rendered on the preview threads so downloads reuse their sessions.
+            content_type, preview_bytes = _submit_in_context(
+                preview_executor, render_preview, urls[photo_id], photo_id, max_size, quality
+            ).result()
+        except (PhotoDownloadError, CircuitOpenError) as exc:
+            return _upstream_error_response(exc)
+        headers["Content-Type"] = content_type
+        return 200, headers, preview_bytes
 
-    @route("/search_listings", method=["GET", "POST"])
+    @register_route("/search_listings", method=["GET", "POST"])
     def search_listings(
         location=Parameter("location", default="Amsterdam"),  # City or area name
         offering_type=Parameter("offering_type", default=""),  # "buy" or "rent"
@@ -346,19 +3410,176 @@ def spin_up_server(server_port, funda_timeout):
         sort=Parameter("sort", default="newest"),  # Sort order
         page=Parameter("page", default=""),  # Backward-compatible single page alias
         pages=Parameter("pages", default="0"),  # Page numbers (15 results per page)
+        fresh=Parameter("fresh", default="0"),  # Bypass the search cache
+        format=Parameter("format", default="json"),  # "json" or "ndjson" (streamed)
+        fields=Parameter("fields", default=""),  # Dotted paths or preset (summary, full)
+        deadline_ms=Parameter("deadline_ms", default=""),  # Partial results after N ms
+        http_response=Response(),
+    ):
+        try:
+            base_kwargs, pages = _normalize_search_params(
+                location=location,
+                offering_type=offering_type,
+                availability=availability,
+                radius_km=radius_km,
+                price_min=price_min,
+                price_max=price_max,
+                area_min=area_min,
+                area_max=area_max,
+                plot_min=plot_min,
+                plot_max=plot_max,
+                object_type=object_type,
+                energy_label=energy_label,
+                sort=sort,
+                page=page,
+                pages=pages,
+            )
+            deadline = _as_optional_int(deadline_ms, "deadline_ms")
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        try:
+            field_tree = _parse_fields(fields)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid fields parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        output_format = _as_optional_str(format) or "json"
+        if output_format not in ("json", "ndjson"):
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid format parameter",
+                {"field": "format", "reason": "must be 'json' or 'ndjson'"},
+            )
+
+        timeout = _start_deadline(deadline)
+        sources, cache_meta = start_search(base_kwargs, pages, _as_bool_flag(fresh))
+        if output_format == "ndjson":
+            return stream_search_items(
+                http_response, sources, pages, cache_meta, field_tree, timeout
+            )
+
+        try:
+            response, skipped = merge_search_pages(sources, pages, timeout)
+        except Exception as exc:
+            return _upstream_error_response(exc)
+
+        items = _project(list(response.values()), field_tree)
+        return {
+            "count": len(items),
+            "items": items,
+            "cache": cache_meta,
+            "partial": bool(skipped),
+            "skipped": skipped,
+        }
+
+    @register_route("/query", method=["GET"])
+    def query_listings(
+        city=Parameter("city", default=""),  # City name (case-insensitive)
+        price_min=Parameter("price_min", default=""),  # Minimum price
+        price_max=Parameter("price_max", default=""),  # Maximum price
+        area_min=Parameter("area_min", default=""),  # Minimum living area (m²)
+        area_max=Parameter("area_max", default=""),  # Maximum living area (m²)
+        bedrooms_min=Parameter("bedrooms_min", default=""),  # Minimum bedrooms
+        bedrooms_max=Parameter("bedrooms_max", default=""),  # Maximum bedrooms
+        year_min=Parameter("year_min", default=""),  # Minimum construction year
+        year_max=Parameter("year_max", default=""),  # Maximum construction year
+        energy_label=Parameter("energy_label", default=""),  # Energy labels
+        max_age=Parameter("max_age", default=""),  # Only rows updated in the last N s
+        sort=Parameter("sort", default="newest"),  # newest|price_asc|price_desc|...
+        limit=Parameter("limit", default=""),  # Maximum rows (1-500)
+        offset=Parameter("offset", default="0"),  # Rows to skip
+        fields=Parameter("fields", default=""),  # Dotted paths or preset (summary, full)
+    ):
+        try:
+            filters = {
+                ("price", ">="): _as_optional_int(price_min, "price_min"),
+                ("price", "<="): _as_optional_int(price_max, "price_max"),
+                ("living_area", ">="): _as_optional_int(area_min, "area_min"),
+                ("living_area", "<="): _as_optional_int(area_max, "area_max"),
+                ("bedrooms", ">="): _as_optional_int(bedrooms_min, "bedrooms_min"),
+                ("bedrooms", "<="): _as_optional_int(bedrooms_max, "bedrooms_max"),
+                ("construction_year", ">="): _as_optional_int(year_min, "year_min"),
+                ("construction_year", "<="): _as_optional_int(year_max, "year_max"),
+                ("city", "="): _as_optional_str(city, lowercase=False),
+            }
+            max_age_seconds = _as_optional_int(max_age, "max_age")
+            row_limit = _as_optional_int(limit, "limit") or LISTING_QUERY_DEFAULT_LIMIT
+            row_limit = _ensure_boundries(row_limit, 1, LISTING_QUERY_MAX_LIMIT)
+            row_offset = max(0, _as_optional_int(offset, "offset") or 0)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        sort_order = _as_optional_str(sort) or "newest"
+        if sort_order not in LISTING_QUERY_SORTS:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid sort parameter",
+                {"field": "sort", "reason": f"must be one of {', '.join(LISTING_QUERY_SORTS)}"},
+            )
+        energy_labels = [item.upper() for item in _as_list_param(energy_label, lowercase=False)]
+        try:
+            field_tree = _parse_fields(fields)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid fields parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+
+        items = listing_store.query(
+            filters,
+            energy_labels=energy_labels,
+            max_age=max_age_seconds,
+            sort=sort_order,
+            limit=row_limit,
+            offset=row_offset,
+        )
+        return {"count": len(items), "items": _project(items, field_tree)}
+
+    def invalid_watch_name(name):
+        return _error_response(
+            400,
+            "invalid_parameter",
+            "Invalid watch name",
+            {"field": "name", "reason": "must match [A-Za-z0-9_.-]{1,64}"},
+        )
+
+    def watch_not_found(name):
+        return _error_response(404, "watch_not_found", f"Watch '{name}' was not found")
+
+    @register_route("/watches", method=["GET"])
+    def list_watches():
+        watches = watch_store.list_watches()
+        return {"count": len(watches), "watches": watches}
+
+    @register_route("/watch/{name}", method=["POST", "PUT"])
+    def save_watch(
+        name=PathValue(),
+        params=ModelDict(),  # Search params, same as /search_listings
     ):
-        location = _as_optional_str(location) or "amsterdam"
-        object_type = _as_list_param(object_type) or None
-        energy_label = _as_list_param(energy_label, lowercase=False)
-        energy_label = [item.upper() for item in energy_label] or None
-        availability = _as_list_param(availability) or None
-        pages = _as_list_param(pages)
-        if not pages:
-            single_page = _as_optional_int(page)
-            pages = [str(single_page)] if single_page is not None else ["0"]
-        try:
-            pages = [_as_optional_int(p, "pages") for p in pages]
-            pages = [p for p in pages if p is not None]
+        if not WATCH_NAME_PATTERN.match(name or ""):
+            return invalid_watch_name(name)
+
+        search_params = {
+            key: value for key, value in (params or {}).items() if key in SEARCH_PARAM_NAMES
+        }
+        try:
+            _normalize_search_params(**search_params)
         except ValidationError as exc:
             return _error_response(
                 400,
@@ -366,62 +3587,405 @@ def spin_up_server(server_port, funda_timeout):
                 "Invalid numeric query parameter",
                 {"field": exc.field, "reason": exc.message},
             )
-        if not pages:
-            pages = [0]
-        offering_type = _as_optional_str(offering_type) or "buy"
-        sort = _as_optional_str(sort)
+        watch_store.save_watch(name, search_params)
+        return watch_store.get_watch(name)
 
-        response = {}
+    @register_route("/watch/{name}", method=["GET"])
+    def get_watch(name=PathValue()):
+        if not WATCH_NAME_PATTERN.match(name or ""):
+            return invalid_watch_name(name)
+        saved = watch_store.get_watch(name)
+        return saved if saved is not None else watch_not_found(name)
 
-        for index, page in enumerate(pages):
-            try:
-                search_kwargs = {
-                    "location": location,
-                    "offering_type": offering_type,
-                    "availability": availability,
-                    "radius_km": _as_optional_int(radius_km, "radius_km"),
-                    "price_min": _as_optional_int(price_min, "price_min"),
-                    "price_max": _as_optional_int(price_max, "price_max"),
-                    "area_min": _as_optional_int(area_min, "area_min"),
-                    "area_max": _as_optional_int(area_max, "area_max"),
-                    "plot_min": _as_optional_int(plot_min, "plot_min"),
-                    "plot_max": _as_optional_int(plot_max, "plot_max"),
-                    "object_type": object_type,
-                    "energy_label": energy_label,
-                    "sort": sort,
-                    "page": page,
-                }
-            except ValidationError as exc:
-                return _error_response(
-                    400,
-                    "invalid_parameter",
-                    "Invalid numeric query parameter",
-                    {"field": exc.field, "reason": exc.message},
+    @register_route("/watch/{name}", method=["DELETE"])
+    def delete_watch(name=PathValue()):
+        if not WATCH_NAME_PATTERN.match(name or ""):
+            return invalid_watch_name(name)
+        if not watch_store.delete_watch(name):
+            return watch_not_found(name)
+        return {"name": name, "deleted": True}
+
+    def with_detail_status(items):
+        # Search results carry no status; take it from each listing's latest
+        # detail lookup, which the listing store keeps.
+        try:
+            statuses = listing_store.statuses(items)
+        except Exception as exc:
+            print(f"[funda_gateway] listing store read failed: {exc}")
+            return items
+        return {
+            public_id: dict(item, status=statuses[public_id]) if public_id in statuses else item
+            for public_id, item in items.items()
+        }
+
+    @register_route("/watch/{name}/new", method=["GET"])
+    def watch_new(
+        name=PathValue(),
+        fresh=Parameter("fresh", default="0"),  # Bypass the search cache
+        fields=Parameter("fields", default=""),  # Dotted paths or preset (summary, full)
+    ):
+        if not WATCH_NAME_PATTERN.match(name or ""):
+            return invalid_watch_name(name)
+        try:
+            field_tree = _parse_fields(fields)
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid fields parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        saved = watch_store.get_watch(name)
+        if saved is None:
+            return watch_not_found(name)
+
+        base_kwargs, pages = _normalize_search_params(**saved["params"])
+        sources, cache_meta = start_search(base_kwargs, pages, _as_bool_flag(fresh))
+        try:
+            items, _ = merge_search_pages(sources, pages)
+        except Exception as exc:
+            return _upstream_error_response(exc)
+
+        new_items, changed_items = watch_store.diff_and_update(name, with_detail_status(items))
+        return {
+            "name": name,
+            "checked": len(items),
+            "count": len(new_items) + len(changed_items),
+            "new": _project(new_items, field_tree),
+            "changed": _project(changed_items, field_tree),
+            "cache": cache_meta,
+        }
+
+    event_snapshots = {}
+    event_fields = _parse_fields("summary")
+
+    def publish_listing_events(snapshot_key, name, items):
+        # The first complete result of a search is its baseline. Later ones are
+        # diffed against everything seen since, so a listing that drops off the
+        # watched pages and comes back is not new again.
+        snapshot = event_snapshots.get(snapshot_key)
+        events = [] if snapshot is None else _listing_events(snapshot, items)
+        snapshot = event_snapshots.setdefault(snapshot_key, {})
+        for public_id, item in items.items():
+            snapshot.setdefault(public_id, {}).update(
+                (field, item[field]) for field in WATCH_TRACKED_FIELDS if field in item
+            )
+        for event_type, public_id, change in events:
+            event_log.append(
+                event_type,
+                {
+                    "watch": name,
+                    "public_id": public_id,
+                    **change,
+                    "listing": _project(items[public_id], event_fields),
+                },
+            )
+        return len(events)
+
+    def prefetch_watches(pool):
+        # Re-run every saved search past the cache and load the details of its
+        # listings through the listing cache, so the next /watch/{name}/new and
+        # the get_listing calls that follow it are answered locally. Then
+        # publish what changed since the previous run to /events; status comes
+        # from those details, as search results have none. Every call goes
+        # through the upstream scheduler at background priority.
+        summary = {
+            "watches": 0,
+            "refreshed": 0,
+            "pages": 0,
+            "listings": 0,
+            "events": 0,
+            "new_ids": 0,
+            "details_loaded": 0,
+            "errors": [],
+        }
+        searches = []
+        for watch in watch_store.list_watches():
+            base_kwargs, pages = _normalize_search_params(**watch["params"])
+            query_key = _search_query_key(base_kwargs)
+            # Keyed by the search too, so saving new params under the same
+            # name starts a new baseline instead of reporting every listing.
+            snapshot_key = (watch["name"], query_key, tuple(pages))
+            futures = [
+                pool.submit(
+                    _in_background,
+                    fetch_search_page,
+                    query_key,
+                    dict(base_kwargs, page=page),
                 )
-            print(f"[funda_gateway] search_listing kwargs: {search_kwargs}")
+                for page in pages
+            ]
+            searches.append((watch["name"], snapshot_key, futures))
+        summary["watches"] = len(searches)
+        for snapshot_key in set(event_snapshots) - {key for _, key, _ in searches}:
+            del event_snapshots[snapshot_key]
+
+        details = {}
+        new_ids = set()
+        results = []
+        for name, snapshot_key, futures in searches:
+            items = {}
+            failed = False
+            for future in futures:
+                try:
+                    page_items = future.result()
+                except Exception as exc:
+                    error = _upstream_error_response(exc)[1]["error"]
+                    summary["errors"].append({"watch": name, **error})
+                    failed = True
+                    continue
+                summary["pages"] += 1
+                for public_id, item in page_items.items():
+                    items.setdefault(public_id, item)
+            results.append((name, snapshot_key, items, failed))
+            summary["listings"] += len(items)
+            new_ids.update(watch_store.unreported_ids(name, items))
+            for public_id in items:
+                if public_id not in details:
+                    details[public_id] = pool.submit(_in_background, load_listing, public_id)
+        summary["new_ids"] = len(new_ids)
+
+        for public_id, future in details.items():
             try:
-                results = f.search_listing(**search_kwargs)
+                future.result()
             except Exception as exc:
-                return _error_response(502, "upstream_error", str(exc))
-            response.update(
-                {
-                    fetch_public_id(item["detail_url"]): item.to_dict()
-                    for item in results
-                }
+                error = _upstream_error_response(exc)[1]["error"]
+                summary["errors"].append({"public_id": public_id, **error})
+                continue
+            summary["details_loaded"] += 1
+
+        for name, snapshot_key, items, failed in results:
+            if failed:
+                # A partial result would report the missing pages' listings
+                # as new once they are back.
+                continue
+            summary["refreshed"] += 1
+            summary["events"] += publish_listing_events(
+                snapshot_key, name, with_detail_status(items)
             )
-            if index < len(pages) - 1:
-                time.sleep(MULTI_PAGE_REQUEST_DELAY_SECONDS)
+        return summary
 
-        items = []
-        for public_id, listing in response.items():
-            item = dict(listing)
-            item.setdefault("public_id", public_id)
-            items.append(item)
-        return {"count": len(items), "items": items}
+    # Background jobs that call Funda run in the first worker only, so adding
+    # workers does not multiply their upstream traffic. The events they
+    # publish live in that worker's memory as well.
+    polling_worker = worker_index == 0
+    prefetcher = Prefetcher(
+        prefetch_watches, prefetch_interval if polling_worker else 0, prefetch_concurrency
+    )
+
+    def not_polling_worker(route_name):
+        return _error_response(
+            503,
+            "not_polling_worker",
+            f"{route_name} is served by the first of the gateway's --workers only; "
+            "run a gateway with --workers 1 for it",
+            {"worker": worker_index},
+        )
+
+    @register_route("/prefetch", method=["GET"])
+    def prefetch_status():
+        return prefetcher.stats()
+
+    @register_route("/prefetch", method=["POST", "PUT"])
+    def configure_prefetch(
+        interval_seconds=Parameter("interval_seconds", default=""),  # 0 pauses the schedule
+        concurrency=Parameter("concurrency", default=""),  # Upstream calls at a time
+        run=Parameter("run", default="0"),  # Start a run now
+    ):
+        if not polling_worker:
+            return not_polling_worker("POST /prefetch")
+        try:
+            interval = _as_optional_int(interval_seconds, "interval_seconds")
+            workers = _as_optional_int(concurrency, "concurrency")
+        except ValidationError as exc:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": exc.field, "reason": exc.message},
+            )
+        if interval is not None and interval < 0:
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid numeric query parameter",
+                {"field": "interval_seconds", "reason": "must be 0 or greater"},
+            )
+        if workers is not None:
+            workers = _ensure_boundries(workers, 1, UPSTREAM_WORKERS)
+        prefetcher.configure(interval_seconds=interval, concurrency=workers)
+        if _as_bool_flag(run):
+            prefetcher.run_now()
+        return prefetcher.stats()
+
+    @register_route("/events", method=["GET"])
+    def events(
+        last_event_id=Parameter("last_event_id", default=""),  # Resume after this event id
+        last_event_id_header=Header("Last-Event-ID", default=""),  # Sent by EventSource
+        watch=Parameter("watch", default=""),  # Only events of these saved searches
+        http_response=Response(),
+    ):
+        # One poller (the prefetch schedule) feeds the event log; subscribers
+        # only read it, so they add no upstream traffic. Streams end after
+        # EVENT_STREAM_SECONDS and clients reconnect with Last-Event-ID: the
+        # async engine cannot see a client hang up, so this bounds how long a
+        # dead subscriber holds a handler thread.
+        resume_from = _as_optional_str(last_event_id_header, lowercase=False) or (
+            _as_optional_str(last_event_id, lowercase=False)
+        )
+        if resume_from is not None and not EVENT_ID_PATTERN.match(resume_from):
+            return _error_response(
+                400,
+                "invalid_parameter",
+                "Invalid event id",
+                {"field": "last_event_id", "reason": "must be an id sent by /events"},
+            )
+        if not polling_worker:
+            return not_polling_worker("/events")
+        watch_names = set(_as_list_param(watch, lowercase=False))
+        if not event_log.subscribe():
+            return _error_response(
+                503,
+                "too_many_subscribers",
+                f"At most {event_log.max_subscribers} /events streams may be open",
+            )
+
+        http_response.status_code = 200
+        http_response.set_header("Content-Type", "text/event-stream")
+        http_response.set_header("Cache-Control", "no-cache")
+        http_response.set_header("Transfer-Encoding", "chunked")
+        cursor = event_log.last_id if resume_from is None else resume_from
+        schedule = prefetcher.stats()
+        if schedule["enabled"]:
+            note = f"polling saved searches every {schedule['interval_seconds']:g}s"
+        else:
+            note = "polling paused: set --prefetch-interval or POST /prefetch?interval_seconds=N"
+        try:
+            _write_chunk(http_response, f"retry: {EVENT_RETRY_MS}\n: {note}\n\n".encode("utf-8"))
+            ends_at = time.monotonic() + EVENT_STREAM_SECONDS
+            while not event_log.closed:
+                remaining = ends_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                found, gap, cursor = event_log.since(
+                    cursor, timeout=min(EVENT_KEEPALIVE_SECONDS, remaining)
+                )
+                messages = []
+                if gap is not None:
+                    messages.append(_sse_message({"type": "gap", "data": gap}))
+                for event in found:
+                    if not watch_names or event["data"]["watch"] in watch_names:
+                        messages.append(_sse_message(event))
+                # A comment keeps idle connections open through proxies.
+                body = "".join(messages) or ": keep-alive\n\n"
+                _write_chunk(http_response, body.encode("utf-8"))
+            http_response.write_bytes(b"0\r\n\r\n")
+        except (OSError, ValueError):
+            pass  # The subscriber hung up.
+        finally:
+            event_log.unsubscribe()
+            _finish_streamed_response(http_response)
+
+    def stream_search_items(
+        http_response, sources, pages, cache_meta, field_tree=None, timeout=None
+    ):
+        # Pages are written in page order as soon as each one is available, so a
+        # listing that appears on several pages keeps its first occurrence, as in
+        # the JSON response. Upstream errors can no longer change the status code,
+        # so they are reported per page in the summary line that ends the stream,
+        # next to the pages skipped at the deadline.
+        http_response.status_code = 200
+        http_response.set_header("Content-Type", "application/x-ndjson")
+        http_response.set_header("Transfer-Encoding", "chunked")
 
-    server.start(host="127.0.0.1", port=server_port)
+        seen = set()
+        errors = []
+        skipped = []
+        ends_at = None if timeout is None else time.monotonic() + timeout
+
+        def write_page(page_items):
+            lines = []
+            for public_id, item in page_items.items():
+                if public_id in seen:
+                    continue
+                seen.add(public_id)
+                lines.append(json.dumps(_project(item, field_tree), ensure_ascii=False))
+            if lines:
+                _write_chunk(http_response, ("\n".join(lines) + "\n").encode("utf-8"))
+
+        try:
+            for source, page in zip(sources, pages):
+                if isinstance(source, Future):
+                    if ends_at is not None:
+                        wait([source], timeout=max(0, ends_at - time.monotonic()))
+                        if not source.done():
+                            skipped.append(page)
+                            continue
+                    try:
+                        source = source.result()
+                    except DeadlineExceeded:
+                        skipped.append(page)
+                        continue
+                    except Exception as exc:
+                        errors.append({"page": page, **_upstream_error_response(exc)[1]["error"]})
+                        continue
+                write_page(source)
+            summary = {
+                "count": len(seen),
+                "cache": cache_meta,
+                "errors": errors,
+                "partial": bool(skipped),
+                "skipped": skipped,
+            }
+            summary_line = json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+            _write_chunk(http_response, summary_line.encode("utf-8"))
+            http_response.write_bytes(b"0\r\n\r\n")
+        finally:
+            for source in sources:
+                if isinstance(source, Future):
+                    source.cancel()
+            _finish_streamed_response(http_response)
+
+    if reuse_port:
+        # Every worker binds the same port; the kernel spreads connections.
+        from simple_http_server.http_server import ThreadingHTTPServer
+
+        ThreadingHTTPServer.allow_reuse_port = True
+    if prefetch_interval > 0:
+        prefetcher.start()
+    start_kwargs = {"host": "127.0.0.1", "port": server_port}
+    if engine == "async":
+        start_kwargs["prefer_coroutine"] = True
+    try:
+        server.start(**start_kwargs)
+    except BaseException:
+        # Request threads are joined at exit (Ctrl+C); end open /events streams first.
+        event_log.close()
+        raise
 
 
 if __name__ == "__main__":
     args = parse_args()
-    spin_up_server(args.port, args.timeout)
+    spin_up_server(
+        args.port,
+        args.timeout,
+        listing_cache_size=args.listing_cache_size,
+        listing_cache_ttl=args.listing_cache_ttl,
+        search_cache_size=args.search_cache_size,
+        search_cache_ttl=args.search_cache_ttl,
+        search_cache_stale=args.search_cache_stale,
+        preview_workers=args.preview_workers,
+        image_pool_size=args.image_pool_size,
+        resize_processes=args.resize_processes,
+        preview_cache_dir=args.preview_cache_dir,
+        preview_cache_mb=args.preview_cache_mb,
+        rate_limit=args.rate_limit,
+        rate_burst=args.rate_burst,
+        state_db=args.state_db,
+        engine=args.engine,
+        workers=args.workers,
+        retry_budget=args.retry_budget,
+        breaker_open_seconds=args.breaker_open_seconds,
+        prefetch_interval=args.prefetch_interval,
+        prefetch_concurrency=args.prefetch_concurrency,
+    )
@@ -1,5 +1,10 @@
+import asyncio
 import importlib.util
+import inspect
+import json
 import sys
+import threading
+import time
 import types
 import unittest
 import base64
@@ -22,12 +27,16 @@ def load_module(module_name: str, file_path: Path):
 class TestFundaGateway(unittest.TestCase):
     def setUp(self):
         simple_http_server = types.ModuleType("simple_http_server")
+        simple_http_server.Headers = dict
         simple_http_server.PathValue = object
+        simple_http_server.Response = object
         simple_http_server.route = lambda *args, **kwargs: (lambda fn: fn)
         simple_http_server.server = types.SimpleNamespace(start=lambda **kwargs: None)
 
         basic_models = types.ModuleType("simple_http_server.basic_models")
+        basic_models.Header = lambda *args, **kwargs: None
         basic_models.Parameter = lambda *args, **kwargs: None
+        basic_models.ModelDict = dict
 
         funda_mod = types.ModuleType("funda")
 
@@ -52,6 +61,13 @@ class TestFundaGateway(unittest.TestCase):
             "funda_gateway_under_test", ROOT / "scripts" / "funda_gateway.py"
         )
 
+        # Keep the gateway's state database and default preview dir out of the repo.
+        state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(state_dir.cleanup)
+        root_patcher = mock.patch.object(self.module, "SKILL_ROOT", Path(state_dir.name))
+        self.addCleanup(root_patcher.stop)
+        root_patcher.start()
+
     def test_fetch_public_id_extracts_last_path_segment(self):
         url = "https://www.funda.nl/detail/koop/amsterdam/appartement-aragohof-11-1/43242669/"
         self.assertEqual(self.module.fetch_public_id(url), "43242669")
@@ -100,7 +116,7 @@ class TestFundaGateway(unittest.TestCase):
 
     def test_spin_up_server_refuses_to_start_if_port_is_listening(self):
         with mock.patch.object(self.module, "is_port_listening", return_value=True), mock.patch.object(
-            self.module, "Funda"
+            self.module, "DeadlineFunda"
         ) as mock_funda:
             with self.assertRaises(RuntimeError):
                 self.module.spin_up_server(server_port=9090, funda_timeout=10)
@@ -155,7 +171,7 @@ class TestFundaGateway(unittest.TestCase):
             types.SimpleNamespace(
                 start=lambda host, port: started.update({"host": host, "port": port})
             ),
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -232,36 +248,31 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
 
-        with mock.patch.object(self.module.time, "sleep") as mock_sleep:
-            response = routes["/search_listings"](
-                location="Amsterdam",
-                offering_type="buy",
-                radius_km="5",
-                price_min="0",
-                price_max="500000",
-                area_min="40",
-                area_max="100",
-                plot_min="100",
-                plot_max="150",
-                object_type="house",
-                energy_label="A",
-                sort="newest",
-                pages="0,1,2",
-            )
+        response = routes["/search_listings"](
+            location="Amsterdam",
+            offering_type="buy",
+            radius_km="5",
+            price_min="0",
+            price_max="500000",
+            area_min="40",
+            area_max="100",
+            plot_min="100",
+            plot_max="150",
+            object_type="house",
+            energy_label="A",
+            sort="newest",
+            pages="0,1,2",
+        )
 
-            self.assertEqual(mock_sleep.call_count, 2)
-            mock_sleep.assert_called_with(
-                self.module.MULTI_PAGE_REQUEST_DELAY_SECONDS
-            )
-        self.assertEqual(funda_instance["value"].calls, [0, 1, 2])
+        self.assertEqual(sorted(funda_instance["value"].calls), [0, 1, 2])
         self.assertEqual(response["count"], 3)
         self.assertEqual(
-            sorted(item["public_id"] for item in response["items"]),
+            [item["public_id"] for item in response["items"]],
             ["01111111", "11111111", "21111111"],
         )
 
@@ -298,7 +309,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -345,7 +356,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -389,7 +400,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -439,7 +450,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -489,7 +500,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -556,34 +567,28 @@ class TestFundaGateway(unittest.TestCase):
             def search_listing(self, **kwargs):
                 raise AssertionError("not used in this test")
 
-        class FakeHTTPResponse:
+        class FakeImageSession:
             def __init__(self, payload):
                 self._payload = payload
 
-            def read(self):
-                return self._payload
-
-            def __enter__(self):
-                return self
-
-            def __exit__(self, exc_type, exc_val, exc_tb):
-                return False
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=self._payload)
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
 
         with mock.patch.object(
-            self.module.urllib.request,
-            "urlopen",
-            return_value=FakeHTTPResponse(b"thumb-bytes"),
+            self.module,
+            "_new_image_session",
+            return_value=FakeImageSession(b"thumb-bytes"),
         ), mock.patch.object(
             self.module,
-            "_build_preview_base64",
-            return_value=("image/jpeg", base64.b64encode(b"tiny").decode("ascii")),
+            "_build_preview_bytes",
+            return_value=("image/jpeg", b"tiny"),
         ) as mock_build_preview:
             response = routes["/get_previews/{id}"](
                 id="43242669",
@@ -633,36 +638,30 @@ class TestFundaGateway(unittest.TestCase):
             def search_listing(self, **kwargs):
                 raise AssertionError("not used in this test")
 
-        class FakeHTTPResponse:
+        class FakeImageSession:
             def __init__(self, payload):
                 self._payload = payload
 
-            def read(self):
-                return self._payload
-
-            def __enter__(self):
-                return self
-
-            def __exit__(self, exc_type, exc_val, exc_tb):
-                return False
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=self._payload)
 
         with tempfile.TemporaryDirectory() as tmpdir:
             skill_root = Path(tmpdir)
             with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
                 self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-            ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+            ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
                 self.module, "is_port_listening", return_value=False
             ), mock.patch.object(self.module, "SKILL_ROOT", skill_root):
                 self.module.spin_up_server(server_port=9001, funda_timeout=7)
 
             with mock.patch.object(
-                self.module.urllib.request,
-                "urlopen",
-                return_value=FakeHTTPResponse(b"thumb-bytes"),
+                self.module,
+                "_new_image_session",
+                return_value=FakeImageSession(b"thumb-bytes"),
             ), mock.patch.object(
                 self.module,
-                "_build_preview_base64",
-                return_value=("image/jpeg", base64.b64encode(b"tiny").decode("ascii")),
+                "_build_preview_bytes",
+                return_value=("image/jpeg", b"tiny"),
             ):
                 response = routes["/get_previews/{id}"](
                     id="43242669",
@@ -684,13 +683,13 @@ class TestFundaGateway(unittest.TestCase):
             )
 
             with mock.patch.object(
-                self.module.urllib.request,
-                "urlopen",
-                return_value=FakeHTTPResponse(b"thumb-bytes"),
+                self.module,
+                "_new_image_session",
+                return_value=FakeImageSession(b"thumb-bytes"),
             ), mock.patch.object(
                 self.module,
-                "_build_preview_base64",
-                return_value=("image/jpeg", base64.b64encode(b"tiny").decode("ascii")),
+                "_build_preview_bytes",
+                return_value=("image/jpeg", b"tiny"),
             ):
                 response_default = routes["/get_previews/{id}"](
                     id="43242669",
@@ -737,36 +736,30 @@ class TestFundaGateway(unittest.TestCase):
             def search_listing(self, **kwargs):
                 raise AssertionError("not used in this test")
 
-        class FakeHTTPResponse:
+        class FakeImageSession:
             def __init__(self, payload):
                 self._payload = payload
 
-            def read(self):
-                return self._payload
-
-            def __enter__(self):
-                return self
-
-            def __exit__(self, exc_type, exc_val, exc_tb):
-                return False
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=self._payload)
 
         with tempfile.TemporaryDirectory() as tmpdir:
             skill_root = Path(tmpdir)
             with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
                 self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-            ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+            ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
                 self.module, "is_port_listening", return_value=False
             ), mock.patch.object(self.module, "SKILL_ROOT", skill_root):
                 self.module.spin_up_server(server_port=9001, funda_timeout=7)
 
             with mock.patch.object(
-                self.module.urllib.request,
-                "urlopen",
-                return_value=FakeHTTPResponse(b"thumb-bytes"),
+                self.module,
+                "_new_image_session",
+                return_value=FakeImageSession(b"thumb-bytes"),
             ), mock.patch.object(
                 self.module,
-                "_build_preview_base64",
-                return_value=("image/jpeg", base64.b64encode(b"tiny").decode("ascii")),
+                "_build_preview_bytes",
+                return_value=("image/jpeg", b"tiny"),
             ):
                 response = routes["/get_previews/{id}"](
                     id="43242669",
@@ -806,7 +799,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -846,7 +839,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -880,7 +873,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", FakeFunda), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -929,7 +922,7 @@ class TestFundaGateway(unittest.TestCase):
 
         with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
             self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
-        ), mock.patch.object(self.module, "Funda", fake_funda_factory), mock.patch.object(
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
             self.module, "is_port_listening", return_value=False
         ):
             self.module.spin_up_server(server_port=9001, funda_timeout=7)
@@ -945,5 +938,2174 @@ class TestFundaGateway(unittest.TestCase):
             },
         )
 
+    def test_ttl_cache_expires_entries_and_evicts_least_recently_used(self):
+        now = {"value": 0.0}
+        cache = self.module.TTLCache(2, 10, clock=lambda: now["value"])
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+        now["value"] = 10.0
+        self.assertIsNone(cache.get("a"))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_listing_routes_share_listing_cache_and_support_fresh_bypass(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.listing_calls = 0
+
+            def get_listing(self, path_part):
+                self.listing_calls += 1
+                return FakeListing(title="Teststraat 1", photo_urls=[])
+
+            def get_price_history(self, listing):
+                return [{"date": "2024-01-01", "price": 500000}]
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        funda_instance = {}
+
+        def fake_funda_factory(timeout):
+            instance = FakeFunda(timeout)
+            funda_instance["value"] = instance
+            return instance
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        routes["/get_listing/{id}"](id="43242669")
+        routes["/get_price_history/{id}"](id="43242669")
+        previews = routes["/get_previews/{id}"](id="43242669")
+
+        self.assertEqual(funda_instance["value"].listing_calls, 1)
+        self.assertEqual(
+            previews,
+            {"id": "43242669", "count": 0, "previews": [], "partial": False, "skipped": []},
+        )
+
+        routes["/get_listing/{id}"](id="43242669", fresh="1")
+        self.assertEqual(funda_instance["value"].listing_calls, 2)
+
+        stats = routes["/cache_stats"]()
+        self.assertEqual(stats["listings"]["hits"], 2)
+        self.assertEqual(stats["listings"]["misses"], 1)
+        self.assertEqual(stats["listings"]["size"], 1)
+
+    def test_get_previews_downloads_concurrently_and_keeps_index_order(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            pass
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    photo_urls=[
+                        "https://cloud.funda.nl/valentina_media/224/802/529.jpg",
+                        "https://cloud.funda.nl/valentina_media/224/802/530.jpg",
+                        "https://cloud.funda.nl/valentina_media/224/802/531.jpg",
+                    ]
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        class FakeImageSession:
+            def __init__(self, payload):
+                self._payload = payload
+
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=self._payload)
+
+        barrier = threading.Barrier(3, timeout=5)
+
+        class FakeBarrierSession:
+            def get(self, url, **kwargs):
+                # All three downloads must be in flight at once to pass the barrier.
+                barrier.wait()
+                if url.endswith("530.jpg"):
+                    raise ConnectionError("boom")
+                if url.endswith("529.jpg"):
+                    time.sleep(0.05)
+                return types.SimpleNamespace(status_code=200, content=url.encode("ascii"))
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            # A retried download would wait on the barrier alone.
+            self.module.spin_up_server(
+                server_port=9001, funda_timeout=7, preview_workers=3, retry_budget=0
+            )
+
+        with mock.patch.object(
+            self.module, "_new_image_session", side_effect=FakeBarrierSession
+        ), mock.patch.object(
+            self.module,
+            "_build_preview_bytes",
+            side_effect=lambda content, max_size, quality: ("image/jpeg", content),
+        ):
+            response = routes["/get_previews/{id}"](id="43242669", limit="3")
+
+        self.assertEqual(response["count"], 3)
+        self.assertEqual(
+            [preview["id"] for preview in response["previews"]],
+            ["224/802/529", "224/802/530", "224/802/531"],
+        )
+        self.assertIn("base64", response["previews"][0])
+        self.assertEqual(
+            response["previews"][1],
+            {
+                "id": "224/802/530",
+                "url": "https://cloud.funda.nl/valentina_media/224/802/530.jpg",
+                "error": "boom",
+            },
+        )
+        self.assertIn("base64", response["previews"][2])
+
+    def test_token_bucket_allows_burst_then_waits_for_refill(self):
+        now = {"value": 0.0}
+        bucket = self.module.TokenBucket(rate=2, burst=2, clock=lambda: now["value"])
+
+        def fake_sleep(seconds):
+            now["value"] += seconds
+
+        with mock.patch.object(self.module.time, "sleep", side_effect=fake_sleep) as mock_sleep:
+            self.assertEqual(bucket.acquire(), 0.0)
+            self.assertEqual(bucket.acquire(), 0.0)
+            self.assertAlmostEqual(bucket.acquire(), 0.5)
+
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_search_query_key_ignores_page_and_list_order(self):
+        first = self.module._search_query_key(
+            {"location": "amsterdam", "object_type": ["house", "apartment"], "page": 0}
+        )
+        second = self.module._search_query_key(
+            {"object_type": ["apartment", "house"], "page": 3, "location": "amsterdam"}
+        )
+        self.assertEqual(first, second)
+
+    def test_ttl_cache_lookup_serves_stale_entries_within_stale_window(self):
+        now = {"value": 0.0}
+        cache = self.module.TTLCache(4, 10, stale_ttl_seconds=5, clock=lambda: now["value"])
+        cache.set("page", ["item"])
+
+        now["value"] = 12.0
+        self.assertIsNone(cache.get("page"))
+        self.assertEqual(cache.lookup("page"), (["item"], 12.0, True))
+
+        now["value"] = 15.0
+        self.assertIsNone(cache.lookup("page"))
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+    def test_search_listings_serves_cached_pages_and_refreshes_stale_ones(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return {"detail_url": self["detail_url"]}
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.calls = 0
+
+            def get_listing(self, path_part):
+                raise AssertionError("not used in this test")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                self.calls += 1
+                return [
+                    FakeListing(
+                        detail_url="https://www.funda.nl/detail/koop/amsterdam/huis/43242669/"
+                    )
+                ]
+
+        funda_instance = {}
+
+        def fake_funda_factory(timeout):
+            instance = FakeFunda(timeout)
+            funda_instance["value"] = instance
+            return instance
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(
+                server_port=9001, funda_timeout=7, search_cache_ttl=0.2
+            )
+
+        first = routes["/search_listings"](
+            location="Amsterdam", object_type="house,apartment", pages="0"
+        )
+        second = routes["/search_listings"](
+            location="AMSTERDAM", object_type=["Apartment", "house"], pages="0"
+        )
+
+        self.assertEqual(funda_instance["value"].calls, 1)
+        self.assertEqual(first["cache"]["hit_ratio"], 0.0)
+        self.assertEqual(second["cache"]["hit_ratio"], 1.0)
+        self.assertFalse(second["cache"]["pages"][0]["stale"])
+        self.assertEqual(second["items"], first["items"])
+
+        time.sleep(0.25)
+        stale = routes["/search_listings"](
+            location="amsterdam", object_type="house,apartment", pages="0"
+        )
+        self.assertTrue(stale["cache"]["pages"][0]["stale"])
+        self.assertEqual(stale["count"], 1)
+
+        deadline = time.monotonic() + 2
+        while funda_instance["value"].calls < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(funda_instance["value"].calls, 2)
+
+    def test_single_flight_coalesces_concurrent_calls_and_shares_errors(self):
+        flights = self.module.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_upstream(value):
+            calls.append(value)
+            started.set()
+            release.wait(5)
+            if value == "bad":
+                raise LookupError("not found")
+            return value.upper()
+
+        for value, expected in (("ok", "OK"), ("bad", LookupError)):
+            started.clear()
+            release.clear()
+            results = []
+
+            def caller():
+                try:
+                    results.append(flights.do(("key", value), slow_upstream, value))
+                except LookupError as exc:
+                    results.append(type(exc))
+
+            leader = threading.Thread(target=caller)
+            leader.start()
+            self.assertTrue(started.wait(5))
+            followers = [threading.Thread(target=caller) for _ in range(2)]
+            for thread in followers:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while flights.coalesced < (2 if value == "ok" else 4) and time.monotonic() < deadline:
+                time.sleep(0.005)
+            release.set()
+            for thread in [leader] + followers:
+                thread.join(5)
+
+            self.assertEqual(results, [expected] * 3)
+
+        self.assertEqual(calls, ["ok", "bad"])
+        self.assertEqual(flights.stats(), {"in_flight": 0, "coalesced": 4, "promoted": 0})
+
+    def test_get_listings_returns_map_with_error_envelopes_and_partial_results(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                if path_part == "404":
+                    raise LookupError("not found")
+                if path_part == "slow":
+                    release.wait(5)
+                return FakeListing(id=path_part)
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        response = routes["/get_listings"](ids="1,404,1")
+        self.assertEqual(response["count"], 2)
+        self.assertFalse(response["partial"])
+        self.assertEqual(response["listings"]["1"], {"id": "1"})
+        self.assertEqual(
+            response["listings"]["404"]["error"]["code"], "listing_not_found"
+        )
+
+        partial = routes["/get_listings"](ids="2,slow", deadline_ms="100")
+        self.assertTrue(partial["partial"])
+        self.assertEqual(partial["pending"], ["slow"])
+        self.assertEqual(partial["listings"], {"2": {"id": "2"}})
+
+        invalid = routes["/get_listings"](ids="")
+        self.assertEqual(invalid[0], 400)
+        self.assertEqual(invalid[1]["error"]["details"]["field"], "ids")
+
+    def test_search_listings_streams_ndjson_items_and_summary(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return {"detail_url": self["detail_url"]}
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                raise AssertionError("not used in this test")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                if kwargs["page"] == 2:
+                    raise RuntimeError("throttled")
+                # Both pages return the same listing plus one of their own.
+                return [
+                    FakeListing(detail_url="https://www.funda.nl/detail/koop/a/huis/100/"),
+                    FakeListing(
+                        detail_url=f"https://www.funda.nl/detail/koop/a/huis/{kwargs['page']}/"
+                    ),
+                ]
+
+        class FakeWriter:
+            def __init__(self):
+                self.body = b""
+                self.closed = False
+
+            def write(self, data):
+                if self.closed:
+                    raise ValueError("I/O operation on closed file.")
+                self.body += data
+
+            def write_eof(self):
+                if self.closed:
+                    raise ValueError("I/O operation on closed file.")
+
+            def close(self):
+                self.closed = True
+
+        # Mirrors simple_http_server's ResponseWrapper: headers go out with the
+        # first write, close() closes the writer, and the server flushes the
+        # writer after the handler returns.
+        class ResponseWrapper:
+            def __init__(self):
+                self.status_code = None
+                self.headers = {}
+                self.writer = FakeWriter()
+                self.__header_sent = False
+                self.__is_sent = False
+
+            @property
+            def is_sent(self):
+                return self.__is_sent
+
+            def set_header(self, key, value):
+                self.headers[key] = value
+
+            def send_response(self):
+                assert not self.__header_sent, "headers already sent"
+                self.__is_sent = True
+
+            def write_bytes(self, data):
+                self.__header_sent = True
+                self.writer.write(data)
+
+            def close(self):
+                self.__is_sent = True
+                self.writer.write_eof()
+                self.writer.close()
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        http_response = ResponseWrapper()
+        result = routes["/search_listings"](
+            location="Amsterdam", pages="0,1,2", format="ndjson", http_response=http_response
+        )
+
+        self.assertIsNone(result)
+        self.assertTrue(http_response.is_sent)
+        http_response.writer.write_eof()
+        self.assertFalse(http_response.writer.closed)
+        self.assertEqual(http_response.headers["Transfer-Encoding"], "chunked")
+        self.assertTrue(http_response.writer.body.endswith(b"0\r\n\r\n"))
+
+        payload = b""
+        rest = http_response.writer.body
+        while True:
+            size_line, rest = rest.split(b"\r\n", 1)
+            size = int(size_line, 16)
+            if size == 0:
+                break
+            payload += rest[:size]
+            rest = rest[size + 2 :]
+        lines = [json.loads(line) for line in payload.decode("utf-8").splitlines()]
+
+        items, summary = lines[:-1], lines[-1]["summary"]
+        self.assertEqual([item["public_id"] for item in items], ["100", "0", "1"])
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["errors"][0]["page"], 2)
+        self.assertEqual(summary["errors"][0]["message"], "throttled")
+
+        merged = routes["/search_listings"](location="Amsterdam", pages="0,1")
+        self.assertEqual(
+            [item["public_id"] for item in merged["items"]],
+            [item["public_id"] for item in items],
+        )
+
+        invalid = routes["/search_listings"](location="Amsterdam", format="xml")
+        self.assertEqual(invalid[0], 400)
+        self.assertEqual(invalid[1]["error"]["details"]["field"], "format")
+
+    def test_watch_new_returns_only_new_and_changed_listings(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[(path, tuple(method or ()))] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.prices = {"100": 400000, "200": 500000}
+                self.statuses = {"200": "available"}
+                self.last_kwargs = None
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    url=f"https://www.funda.nl/detail/koop/a/huis/{path_part}/",
+                    price=self.prices[path_part],
+                    status=self.statuses[path_part],
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                self.last_kwargs = kwargs
+                return [
+                    FakeListing(
+                        detail_url=f"https://www.funda.nl/detail/koop/a/huis/{public_id}/",
+                        price=price,
+                    )
+                    for public_id, price in self.prices.items()
+                ]
+
+        funda_instance = {}
+
+        def fake_funda_factory(timeout):
+            instance = FakeFunda(timeout)
+            funda_instance["value"] = instance
+            return instance
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+                self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+            ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
+                self.module, "is_port_listening", return_value=False
+            ):
+                self.module.spin_up_server(
+                    server_port=9001,
+                    funda_timeout=7,
+                    search_cache_size=0,
+                    state_db=str(Path(tmpdir) / "state.sqlite3"),
+                )
+
+            saved = routes[("/watch/{name}", ("POST", "PUT"))](
+                name="utrecht-houses",
+                params={"location": "Utrecht", "object_type": "house", "ignored": "x"},
+            )
+            self.assertEqual(saved["params"], {"location": "Utrecht", "object_type": "house"})
+
+            check = routes[("/watch/{name}/new", ("GET",))]
+            first = check(name="utrecht-houses")
+            self.assertEqual(first["count"], 2)
+            self.assertEqual(funda_instance["value"].last_kwargs["location"], "utrecht")
+
+            self.assertEqual(check(name="utrecht-houses")["count"], 0)
+
+            funda_instance["value"].prices = {"100": 390000, "200": 500000, "300": 250000}
+            third = check(name="utrecht-houses")
+            self.assertEqual([item["public_id"] for item in third["new"]], ["300"])
+            self.assertEqual(
+                third["changed"][0]["changes"],
+                {"price": {"old": 400000, "new": 390000}},
+            )
+
+            # Search results carry no status; it comes from detail lookups, and
+            # the first one known is a baseline rather than a change.
+            get_listing = routes[("/get_listing/{id}", ("GET",))]
+            get_listing(id="200")
+            self.assertEqual(check(name="utrecht-houses")["count"], 0)
+            funda_instance["value"].statuses["200"] = "sold"
+            get_listing(id="200", fresh="1")
+            fourth = check(name="utrecht-houses")
+            self.assertEqual(
+                fourth["changed"][0]["changes"],
+                {"status": {"old": "available", "new": "sold"}},
+            )
+            self.assertEqual(fourth["changed"][0]["status"], "sold")
+
+            listed = routes[("/watches", ("GET",))]()
+            self.assertEqual(listed["watches"][0]["seen_count"], 3)
+
+            missing = check(name="unknown")
+            self.assertEqual(missing[0], 404)
+            self.assertEqual(missing[1]["error"]["code"], "watch_not_found")
+            self.assertEqual(check(name="../etc")[0], 400)
+
+            deleted = routes[("/watch/{name}", ("DELETE",))](name="utrecht-houses")
+            self.assertTrue(deleted["deleted"])
+
+    def test_query_filters_listings_recorded_by_search_and_detail_routes(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                pass
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    url=f"https://www.funda.nl/detail/koop/utrecht/huis/{path_part}/",
+                    construction_year=1930,
+                    bedrooms=3,
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                return [
+                    FakeListing(
+                        detail_url=f"https://www.funda.nl/detail/koop/utrecht/huis/{public_id}/",
+                        city="Utrecht",
+                        price=price,
+                        bedrooms=bedrooms,
+                        energy_label="a",
+                    )
+                    for public_id, price, bedrooms in (
+                        ("100", 400000, 2),
+                        ("200", 500000, 4),
+                        ("300", 600000, None),
+                    )
+                ]
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        routes["/search_listings"](location="utrecht", pages="0")
+        routes["/get_listing/{id}"](id="300")
+
+        query = routes["/query"]
+        by_bedrooms = query(city="UTRECHT", bedrooms_min="3", sort="price_asc")
+        self.assertEqual([item["public_id"] for item in by_bedrooms["items"]], ["200", "300"])
+
+        by_year = query(year_min="1900", energy_label="A")
+        self.assertEqual(by_year["count"], 1)
+        item = by_year["items"][0]
+        self.assertEqual((item["price"], item["construction_year"]), (600000, 1930))
+        self.assertIsNotNone(item["freshness"]["details_age_seconds"])
+        self.assertLess(item["freshness"]["age_seconds"], 60)
+
+        self.assertEqual(query(price_max="450000", limit="1")["count"], 1)
+        self.assertEqual(query(sort="cheapest")[0], 400)
+        self.assertEqual(query(year_min="old")[1]["error"]["details"]["field"], "year_min")
+
+    def test_parse_fields_builds_projection_tree_from_paths_and_presets(self):
+        parse_fields = self.module._parse_fields
+        project = self.module._project
+
+        self.assertIsNone(parse_fields(""))
+        self.assertIsNone(parse_fields("price,full"))
+        tree = parse_fields("price,freshness.age_seconds,photos_360.url,price.ignored")
+        self.assertEqual(
+            tree, {"price": None, "freshness": {"age_seconds": None}, "photos_360": {"url": None}}
+        )
+        listing = {
+            "price": 500000,
+            "title": "Straat 1",
+            "freshness": {"age_seconds": 3.0, "updated_at": 1.0},
+            "photos_360": [{"name": "Living", "url": "u1"}, {"name": "Hall", "url": "u2"}],
+        }
+        self.assertEqual(
+            project(listing, tree),
+            {
+                "price": 500000,
+                "freshness": {"age_seconds": 3.0},
+                "photos_360": [{"url": "u1"}, {"url": "u2"}],
+            },
+        )
+        self.assertIn("detail_url", parse_fields("summary"))
+        with self.assertRaises(self.module.ValidationError):
+            parse_fields("price;drop")
+
+    def test_listing_routes_apply_fields_projection(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                pass
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    price=500000, description="long text", city="Utrecht", tiny_id=path_part
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                return [
+                    FakeListing(
+                        detail_url="https://www.funda.nl/detail/koop/utrecht/huis/100/",
+                        price=400000,
+                        photos=["a", "b"],
+                    )
+                ]
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        self.assertEqual(
+            routes["/get_listing/{id}"](id="100", fields="summary"),
+            {"price": 500000, "city": "Utrecht"},
+        )
+        batch = routes["/get_listings"](ids="100", fields="price")
+        self.assertEqual(batch["listings"]["100"], {"price": 500000})
+
+        search = routes["/search_listings"](location="utrecht", pages="0", fields="summary")
+        self.assertEqual(
+            search["items"],
+            [
+                {
+                    "public_id": "100",
+                    "price": 400000,
+                    "detail_url": "https://www.funda.nl/detail/koop/utrecht/huis/100/",
+                }
+            ],
+        )
+        invalid = routes["/get_listing/{id}"](id="100", fields="price,../x")
+        self.assertEqual(invalid[0], 400)
+        self.assertEqual(invalid[1]["error"]["details"]["field"], "fields")
+
+    def test_preview_cache_evicts_least_recently_used_files_over_quota(self):
+        PreviewCache = self.module.PreviewCache
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = PreviewCache(tmpdir, max_bytes=10)
+            first = PreviewCache.key("224/802/529", 320, 65)
+            second = PreviewCache.key("224/802/530", 320, 65)
+            third = PreviewCache.key("224/802/531", 320, 65)
+            self.assertNotEqual(first, PreviewCache.key("224/802/529", 320, 70))
+
+            cache.set(first, b"aaaa")
+            cache.set(second, b"bbbb")
+            self.assertEqual(cache.get(first), b"aaaa")
+            cache.set(third, b"cccc")
+
+            self.assertIsNone(cache.get(second))
+            self.assertEqual(cache.get(third), b"cccc")
+            self.assertEqual(cache.stats()["evictions"], 1)
+            self.assertEqual(cache.stats()["bytes"], 8)
+            self.assertEqual(len(list(Path(tmpdir).glob("*/*.jpeg"))), 2)
+
+            reopened = PreviewCache(tmpdir, max_bytes=10)
+            self.assertEqual(reopened.get(first), b"aaaa")
+            self.assertEqual(reopened.stats()["size"], 2)
+            self.assertIsNone(PreviewCache(tmpdir, max_bytes=0).get(first))
+
+    def test_preview_cache_workers_share_one_quota(self):
+        PreviewCache = self.module.PreviewCache
+        ticks = iter(range(100))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            PreviewCache(tmpdir, max_bytes=10).set(PreviewCache.key("224/802/528", 320, 65), b"zz")
+            index = self.module.SharedPreviewIndex(
+                Path(tmpdir) / "index.sqlite3", clock=lambda: 1e9 + next(ticks)
+            )
+            # Separate indexes, as each worker process opens its own connection.
+            other_index = self.module.SharedPreviewIndex(
+                Path(tmpdir) / "index.sqlite3", clock=lambda: 1e9 + next(ticks)
+            )
+            one = PreviewCache(tmpdir, max_bytes=10, shared=index)
+            other = PreviewCache(tmpdir, max_bytes=10, shared=other_index)
+            keys = [PreviewCache.key(f"224/802/{n}", 320, 65) for n in (529, 530, 531)]
+
+            one.set(keys[0], b"aaaa")
+            other.set(keys[1], b"bbbb")
+            self.assertEqual(other.get(keys[0]), b"aaaa")
+            one.set(keys[2], b"cccc")
+
+            # Only the least recently used file is evicted; the one found on disk stays.
+            self.assertIsNone(one.get(keys[1]))
+            self.assertEqual(one.get(keys[0]), b"aaaa")
+            self.assertEqual(other.get(keys[2]), b"cccc")
+            self.assertEqual(other.get(PreviewCache.key("224/802/528", 320, 65)), b"zz")
+            self.assertEqual((one.stats()["size"], other.stats()["bytes"]), (3, 10))
+            self.assertEqual((one.stats()["evictions"], other.stats()["evictions"]), (1, 0))
+            self.assertEqual(len(list(Path(tmpdir).glob("*/*.jpeg"))), 3)
+
+    def test_get_previews_serves_repeated_renderings_from_preview_cache(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            pass
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                pass
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    photo_urls=["https://cloud.funda.nl/valentina_media/224/802/529.jpg"]
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        class FakeImageSession:
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=b"full-size")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        with mock.patch.object(
+            self.module, "_new_image_session", return_value=FakeImageSession()
+        ), mock.patch.object(
+            FakeImageSession, "get", autospec=True, side_effect=FakeImageSession.get
+        ) as mock_download, mock.patch.object(
+            self.module, "_build_preview_bytes", return_value=("image/jpeg", b"tiny")
+        ) as mock_build_preview:
+            first = routes["/get_previews/{id}"](id="43242669", limit="1")
+            second = routes["/get_previews/{id}"](id="43242669", limit="1")
+            resized = routes["/get_previews/{id}"](id="43242669", limit="1", preview_size="640")
+
+        self.assertEqual(first["previews"], second["previews"])
+        self.assertEqual(second["previews"][0]["base64"], base64.b64encode(b"tiny").decode("ascii"))
+        self.assertEqual(resized["count"], 1)
+        self.assertEqual(mock_download.call_count, 2)
+        self.assertEqual(mock_build_preview.call_count, 2)
+        stats = routes["/cache_stats"]()["previews"]
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_preview_image_route_returns_jpeg_bytes_with_cache_headers(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            pass
+
+        detail_calls = []
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                pass
+
+            def get_listing(self, path_part):
+                detail_calls.append(path_part)
+                if path_part == "404":
+                    raise LookupError("Listing 404 not found")
+                return FakeListing(
+                    photo_urls=["https://cloud.funda.nl/valentina_media/224/802/529.jpg"]
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        class FakeImageSession:
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=b"full-size")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        preview = routes["/preview/{listing_id}/{photo_id}.jpg"]
+        with mock.patch.object(
+            self.module, "_new_image_session", return_value=FakeImageSession()
+        ), mock.patch.object(
+            self.module, "_build_preview_bytes", return_value=("image/jpeg", b"tiny")
+        ) as mock_build_preview:
+            status, headers, body = preview(
+                listing_id="43242669", photo_id="224-802-529", preview_size="256"
+            )
+            same_photo = preview(listing_id="43242669", photo_id="224/802/529", preview_size="256")
+
+        self.assertEqual((status, body), (200, b"tiny"))
+        self.assertEqual(headers["Content-Type"], "image/jpeg")
+        self.assertIn("max-age", headers["Cache-Control"])
+        self.assertEqual(same_photo[1]["ETag"], headers["ETag"])
+        mock_build_preview.assert_called_once_with(b"full-size", max_size=256, quality=65)
+
+        not_modified = preview(
+            listing_id="43242669",
+            photo_id="224-802-529",
+            preview_size="256",
+            if_none_match=headers["ETag"],
+        )
+        self.assertEqual(not_modified[0], 304)
+        # The listing was checked from the cache, without another upstream call.
+        self.assertEqual(detail_calls, ["43242669"])
+
+        missing = preview(listing_id="43242669", photo_id="1-2-3")
+        self.assertEqual(missing[0], 404)
+        self.assertEqual(missing[1]["error"]["code"], "photo_not_found")
+
+        # A matching ETag does not turn an unknown listing or photo into a 304.
+        def etag(photo_id):
+            return f'"{self.module.PreviewCache.key(photo_id, 320, 65)}"'
+
+        foreign_photo = preview(
+            listing_id="43242669", photo_id="1-2-3", if_none_match=etag("1/2/3")
+        )
+        self.assertEqual(foreign_photo[1]["error"]["code"], "photo_not_found")
+        gone = preview(
+            listing_id="404", photo_id="224-802-529", if_none_match=etag("224/802/529")
+        )
+        self.assertEqual(gone[0], 404)
+        self.assertEqual(gone[1]["error"]["code"], "listing_not_found")
+
+    def test_get_previews_resizes_in_process_pool_when_configured(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            pass
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                pass
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    photo_urls=["https://cloud.funda.nl/valentina_media/224/802/529.jpg"]
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        class FakeImageSession:
+            def get(self, url, **kwargs):
+                return types.SimpleNamespace(status_code=200, content=b"full-size")
+
+        pools = []
+
+        class FakeProcessPool:
+            def __init__(self, max_workers, mp_context=None):
+                self.max_workers = max_workers
+                self.calls = []
+                pools.append(self)
+
+            def submit(self, fn, *args, **kwargs):
+                self.calls.append((fn, args, kwargs))
+                future = self_module.Future()
+                future.set_result(("image/jpeg", b"tiny"))
+                return future
+
+        self_module = self.module
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ), mock.patch.object(self.module, "ProcessPoolExecutor", FakeProcessPool):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7, resize_processes=2)
+
+        with mock.patch.object(
+            self.module, "_new_image_session", return_value=FakeImageSession()
+        ):
+            response = routes["/get_previews/{id}"](id="43242669", limit="1")
+
+        self.assertEqual(response["previews"][0]["base64"], base64.b64encode(b"tiny").decode("ascii"))
+        self.assertEqual(pools[0].max_workers, 2)
+        self.assertEqual(
+            pools[0].calls,
+            [(self.module._build_preview_bytes, (b"full-size",), {"max_size": 320, "quality": 65})],
+        )
+
+    def test_image_session_pool_reuses_sessions_and_counts_connection_reuse(self):
+        created = []
+
+        class FakeSession:
+            def __init__(self):
+                self.local_port = 40000 + len(created)
+                self.requests = 0
+                created.append(self)
+
+            def get(self, url, **kwargs):
+                self.requests += 1
+                if url.endswith("missing.jpg"):
+                    status_code = 404
+                else:
+                    status_code = 200
+                return types.SimpleNamespace(
+                    status_code=status_code,
+                    content=url.encode("ascii"),
+                    local_ip="127.0.0.1",
+                    local_port=self.local_port,
+                    primary_ip="10.0.0.1",
+                    primary_port=443,
+                )
+
+        pool = self.module.ImageSessionPool(size=2, timeout=7, session_factory=FakeSession)
+        self.assertEqual(pool.fetch("https://img/1.jpg"), b"https://img/1.jpg")
+        self.assertEqual(pool.fetch("https://img/2.jpg"), b"https://img/2.jpg")
+        with self.assertRaises(self.module.PhotoDownloadError):
+            pool.fetch("https://img/missing.jpg")
+
+        self.assertEqual(len(created), 1)
+        stats = pool.stats()
+        self.assertEqual(stats["sessions"], 1)
+        self.assertEqual((stats["new_connections"], stats["reused_connections"]), (1, 2))
+        self.assertEqual(stats["errors"], 1)
+
+        barrier = threading.Barrier(3, timeout=5)
+        in_flight = {"now": 0, "max": 0}
+        lock = threading.Lock()
+
+        class SlowSession(FakeSession):
+            def get(self, url, **kwargs):
+                with lock:
+                    in_flight["now"] += 1
+                    in_flight["max"] = max(in_flight["max"], in_flight["now"])
+                time.sleep(0.05)
+                with lock:
+                    in_flight["now"] -= 1
+                return super().get(url, **kwargs)
+
+        slow_pool = self.module.ImageSessionPool(size=2, timeout=7, session_factory=SlowSession)
+
+        def download(index):
+            barrier.wait()
+            slow_pool.fetch(f"https://img/{index}.jpg")
+
+        threads = [threading.Thread(target=download, args=(index,)) for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(in_flight["max"], 2)
+        # One session per downloading thread, so curl's per-thread handles stay warm.
+        self.assertEqual(slow_pool.stats()["sessions"], 3)
+
+    def test_async_engine_runs_handlers_off_the_event_loop(self):
+        routes = {}
+        started = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return {"detail_url": self["detail_url"]}
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                raise LookupError("not found")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                return [FakeListing(detail_url="https://www.funda.nl/detail/koop/a/huis/100/")]
+
+        class RecordingResponse:
+            def __init__(self):
+                self.status_code = None
+                self.headers = {}
+                self.body = b""
+                self.write_threads = set()
+
+            def set_header(self, key, value):
+                self.headers[key] = value
+
+            def write_bytes(self, data):
+                self.write_threads.add(threading.get_ident())
+                self.body += data
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module,
+            "server",
+            types.SimpleNamespace(start=lambda **kwargs: started.update(kwargs)),
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7, engine="async")
+            with self.assertRaises(ValueError):
+                self.module.spin_up_server(server_port=9001, funda_timeout=7, engine="gevent")
+
+        self.assertTrue(started["prefer_coroutine"])
+        get_listing = routes["/get_listing/{id}"]
+        self.assertTrue(asyncio.iscoroutinefunction(get_listing))
+        self.assertEqual(
+            list(inspect.signature(get_listing).parameters),
+            ["id", "fresh", "fields", "priority", "priority_header"],
+        )
+
+        response = asyncio.run(get_listing(id="99999999"))
+        self.assertEqual(response[0], 404)
+        self.assertEqual(response[1]["error"]["code"], "listing_not_found")
+
+        http_response = RecordingResponse()
+        asyncio.run(
+            routes["/search_listings"](
+                location="Amsterdam", format="ndjson", http_response=http_response
+            )
+        )
+        # Writes reach the response on the loop thread, in order.
+        self.assertEqual(http_response.write_threads, {threading.get_ident()})
+        self.assertEqual(http_response.status_code, 200)
+        self.assertTrue(http_response._ResponseWrapper__is_sent)
+        self.assertIn(b'"public_id": "100"', http_response.body)
+        self.assertTrue(http_response.body.endswith(b"0\r\n\r\n"))
+
+    def test_ttl_cache_reads_through_to_shared_tier_written_by_another_worker(self):
+        now = {"value": 1000.0}
+        db_path = self.module.SKILL_ROOT / "state" / "shared.sqlite3"
+
+        def make_cache():
+            shared = self.module.SharedCacheTier(
+                db_path, "listings", 60, clock=lambda: now["value"]
+            )
+            return self.module.TTLCache(10, 60, shared=shared)
+
+        first, second = make_cache(), make_cache()
+        first.set(("amsterdam", 0), {"42": {"price": 1}})
+
+        now["value"] += 10
+        value, age, is_stale = second.lookup(("amsterdam", 0))
+        self.assertEqual(value, {"42": {"price": 1}})
+        self.assertFalse(is_stale)
+        self.assertGreaterEqual(age, 10)
+        self.assertEqual(second.stats()["shared_hits"], 1)
+        # Now held locally, so the next read does not touch the shared tier.
+        self.assertIsNotNone(second.get(("amsterdam", 0)))
+        self.assertEqual(second.stats()["shared_hits"], 1)
+
+        now["value"] += 60
+        self.assertIsNone(make_cache().get(("amsterdam", 0)))
+        self.assertEqual(second.shared.stats()["size"], 1)
+
+    def test_workers_mode_splits_rate_limit_and_keeps_port_guard(self):
+        with mock.patch.object(self.module, "_run_workers") as run_workers, mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(
+                server_port=9001, funda_timeout=7, workers=3, rate_limit=3.0, rate_burst=5
+            )
+
+        workers, kwargs, worker_kwargs = run_workers.call_args[0]
+        self.assertEqual(workers, 3)
+        self.assertEqual(kwargs["rate_limit"], 1.0)
+        self.assertNotIn("rate_burst", kwargs)
+        self.assertEqual([extra["rate_burst"] for extra in worker_kwargs], [2, 2, 1])
+        self.assertEqual(self.module._split_evenly(2, 3), [1, 1, 0])
+        self.assertTrue(kwargs["reuse_port"])
+        self.assertEqual(kwargs["shared_cache_db"], self.module.SHARED_CACHE_PATH)
+        self.assertNotIn("workers", kwargs)
+
+        with mock.patch.object(self.module, "_run_workers") as run_workers, mock.patch.object(
+            self.module, "is_port_listening", return_value=True
+        ):
+            with self.assertRaises(RuntimeError):
+                self.module.spin_up_server(server_port=9001, funda_timeout=7, workers=3)
+            with self.assertRaises(ValueError):
+                self.module.spin_up_server(
+                    server_port=9001, funda_timeout=7, workers=3, engine="async"
+                )
+        run_workers.assert_not_called()
+
+    def test_metrics_merges_thread_shards_into_prometheus_text(self):
+        metrics = self.module.Metrics(buckets=(0.1, 1.0))
+        metrics.describe("demo_seconds", "histogram", "Demo latency")
+        metrics.describe("demo_total", "counter", "Demo count")
+        metrics.callback(lambda: [("demo_ratio", (("cache", 'a"b'),), 0.5)])
+
+        def record(seconds):
+            metrics.inc("demo_total", (("route", "/x"),))
+            metrics.observe("demo_seconds", (("route", "/x"),), seconds)
+
+        threads = [threading.Thread(target=record, args=(value,)) for value in (0.05, 0.5, 5.0)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        text = metrics.render()
+        self.assertIn("# TYPE demo_seconds histogram", text)
+        self.assertIn('demo_seconds_bucket{route="/x",le="0.1"} 1', text)
+        self.assertIn('demo_seconds_bucket{route="/x",le="1.0"} 2', text)
+        self.assertIn('demo_seconds_bucket{route="/x",le="+Inf"} 3', text)
+        self.assertIn('demo_seconds_count{route="/x"} 3', text)
+        self.assertIn('demo_seconds_sum{route="/x"} 5.55', text)
+        self.assertIn('demo_total{route="/x"} 3', text)
+        self.assertIn('demo_ratio{cache="a\\"b"} 0.5', text)
+        self.assertEqual(metrics.counter_value("demo_total", (("route", "/x"),)), 3)
+        # The threads have ended: their shards were folded into the base one.
+        self.assertEqual(len(metrics._shards), 1)
+
+        record(0.05)
+        self.assertEqual(len(metrics._shards), 2)
+        self.assertIn('demo_seconds_count{route="/x"} 4', metrics.render())
+
+    def test_metrics_route_reports_route_status_and_upstream_latency(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                raise LookupError("not found")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7)
+
+        self.assertEqual(routes["/get_listing/{id}"](id="99999999")[0], 404)
+        status, headers, body = routes["/metrics"]()
+        text = body.decode("utf-8")
+
+        self.assertEqual(status, 200)
+        self.assertTrue(headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn(
+            'funda_gateway_request_duration_seconds_count{route="/get_listing/{id}",status="404"} 1',
+            text,
+        )
+        self.assertIn(
+            'funda_gateway_upstream_duration_seconds_count{call="get_listing",outcome="error"} 1',
+            text,
+        )
+        self.assertIn('funda_gateway_requests_in_flight{route="/metrics"} 1', text)
+        self.assertIn('funda_gateway_requests_in_flight{route="/get_listing/{id}"} 0', text)
+        self.assertIn('funda_gateway_cache_misses_total{cache="listings"} 1', text)
+        self.assertIn("funda_gateway_upstream_in_flight 0", text)
+
+    def test_health_and_ready_answer_from_process_state(self):
+        routes = {}
+        calls = []
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                calls.append(path_part)
+                if path_part == "99999999":
+                    raise LookupError("not found")
+                raise RuntimeError("upstream down")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(
+                server_port=9001,
+                funda_timeout=7,
+                rate_limit=0,
+                retry_budget=0,
+                breaker_open_seconds=0.05,
+            )
+
+        health = routes["/health"]()
+        self.assertEqual(health["status"], "ok")
+        self.assertEqual(health["version"], self.module.GATEWAY_VERSION)
+        self.assertEqual(health["caches"], {"listings": 0, "searches": 0, "previews": 0})
+        status, body = routes["/ready"]()
+        self.assertEqual(status, 200)
+        self.assertTrue(body["ready"])
+        self.assertIsNone(body["upstream"]["last_success_at"])
+        self.assertEqual(body["upstream"]["circuit"]["state"], "closed")
+        self.assertEqual(calls, [])
+
+        for index in range(self.module.BREAKER_MIN_CALLS):
+            self.assertEqual(routes["/get_listing/{id}"](id=f"4300000{index}")[0], 502)
+        status, body = routes["/ready"]()
+        self.assertEqual(status, 503)
+        self.assertFalse(body["ready"])
+        self.assertEqual(body["upstream"]["circuit"]["state"], "open")
+        self.assertEqual(body["upstream"]["consecutive_failures"], 5)
+        self.assertEqual(body["upstream"]["last_error"], "RuntimeError: upstream down")
+        self.assertEqual(body["images"]["circuit"]["state"], "closed")
+
+        # A not-found answer to the half-open probe proves Funda is reachable.
+        time.sleep(0.1)
+        self.assertEqual(routes["/get_listing/{id}"](id="99999999")[0], 404)
+        status, body = routes["/ready"]()
+        self.assertEqual(status, 200)
+        self.assertEqual(body["upstream"]["circuit"]["state"], "closed")
+        self.assertIsNotNone(body["upstream"]["last_success_at"])
+        self.assertEqual(len(calls), 6)
+
+    def test_circuit_breaker_retries_within_budget_then_fails_fast(self):
+        routes = {}
+        attempts = []
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def _get(self, url, headers):
+                return types.SimpleNamespace(status_code=429)
+
+            def get_listing(self, path_part):
+                attempts.append(path_part)
+                if path_part == "43000001":
+                    # pyfunda reports a throttled lookup as "not found".
+                    self._get("listing", [])
+                    raise LookupError(f"Listing {path_part} not found")
+                raise RuntimeError("connection reset")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ), mock.patch.object(self.module, "_backoff_delay", return_value=0):
+            self.module.spin_up_server(
+                server_port=9001, funda_timeout=7, rate_limit=0, retry_budget=1
+            )
+
+            # One retry from the request's budget, then the error is returned.
+            self.assertEqual(routes["/get_listing/{id}"](id="43000002")[0], 502)
+            self.assertEqual(attempts, ["43000002", "43000002"])
+
+            # Two 429s open the circuit, although pyfunda raised LookupError.
+            attempts.clear()
+            status, body = routes["/get_listing/{id}"](id="43000001")
+            self.assertEqual(attempts, ["43000001", "43000001"])
+            self.assertEqual(status, 502)
+            self.assertEqual(body["error"]["message"], "funda call throttled (HTTP 429)")
+
+            attempts.clear()
+            status, body = routes["/get_listing/{id}"](id="43000003")
+            self.assertEqual(attempts, [])
+            self.assertEqual(status, 503)
+            self.assertEqual(body["error"]["code"], "circuit_open")
+            self.assertEqual(body["error"]["details"]["circuit"], "funda")
+            self.assertGreater(body["error"]["details"]["retry_after_seconds"], 0)
+
+        text = routes["/metrics"]()[2].decode("utf-8")
+        self.assertIn('funda_gateway_circuit_state{circuit="funda",state="open"} 1', text)
+        self.assertIn(
+            'funda_gateway_circuit_transitions_total{circuit="funda",to="open"} 1', text
+        )
+        self.assertIn('funda_gateway_circuit_rejected_total{circuit="funda"} 1', text)
+        self.assertIn('funda_gateway_upstream_retries_total{circuit="funda"} 2', text)
+        self.assertIn(
+            'funda_gateway_upstream_outcomes_total{circuit="funda",outcome="throttled"} 2', text
+        )
+
+    def test_deadline_returns_completed_pages_and_previews_as_partial(self):
+        routes = {}
+        release = threading.Event()
+        seen_timeouts = []
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            # Same timeout attribute as the gateway's pyfunda subclass.
+            timeout = self.module.DeadlineFunda.timeout
+
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                return FakeListing(
+                    url=f"https://www.funda.nl/detail/koop/a/huis/{path_part}/",
+                    photo_urls=[
+                        "https://cloud.funda.nl/valentina_media/224/802/529.jpg",
+                        "https://cloud.funda.nl/valentina_media/224/802/530.jpg",
+                    ],
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                # pyfunda passes self.timeout to each HTTP call it makes.
+                seen_timeouts.append(self.timeout)
+                if kwargs["page"] == 1:
+                    release.wait(5)
+                return [
+                    FakeListing(
+                        detail_url=f"https://www.funda.nl/detail/koop/a/huis/{kwargs['page']}/"
+                    )
+                ]
+
+        class FakeImageSession:
+            def get(self, url, timeout=None, **kwargs):
+                seen_timeouts.append(timeout)
+                if url.endswith("530.jpg"):
+                    release.wait(5)
+                return types.SimpleNamespace(status_code=200, content=url.encode("ascii"))
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(
+                server_port=9001, funda_timeout=7, rate_limit=0, preview_cache_mb=0
+            )
+
+        try:
+            started = time.monotonic()
+            result = routes["/search_listings"](
+                location="Amsterdam", pages="0,1", deadline_ms="200"
+            )
+            self.assertLess(time.monotonic() - started, 2)
+            self.assertEqual([item["public_id"] for item in result["items"]], ["0"])
+            self.assertTrue(result["partial"])
+            self.assertEqual(result["skipped"], [1])
+            self.assertTrue(all(timeout <= 0.2 for timeout in seen_timeouts))
+
+            seen_timeouts.clear()
+            with mock.patch.object(
+                self.module, "_new_image_session", side_effect=FakeImageSession
+            ), mock.patch.object(
+                self.module,
+                "_build_preview_bytes",
+                side_effect=lambda content, max_size, quality: ("image/jpeg", content),
+            ):
+                previews = routes["/get_previews/{id}"](id="43242669", limit="2", deadline_ms="200")
+            self.assertEqual([preview["id"] for preview in previews["previews"]], ["224/802/529"])
+            self.assertTrue(previews["partial"])
+            self.assertEqual(previews["skipped"], ["224/802/530"])
+            self.assertTrue(all(0 < timeout <= 0.2 for timeout in seen_timeouts))
+
+            status, body = routes["/search_listings"](location="Amsterdam", deadline_ms="x")
+            self.assertEqual(status, 400)
+            self.assertEqual(body["error"]["details"]["field"], "deadline_ms")
+        finally:
+            release.set()
+
+        # Without a deadline nothing is skipped, and calls get the full timeout.
+        seen_timeouts.clear()
+        result = routes["/search_listings"](location="Amsterdam", pages="2")
+        self.assertFalse(result["partial"])
+        self.assertEqual(result["skipped"], [])
+        self.assertEqual(seen_timeouts, [7])
+
+    def test_upstream_scheduler_serves_classes_by_weighted_fair_queueing(self):
+        class ManualLimiter:
+            rate = 1.0
+
+            def __init__(self):
+                self.tokens = 0
+                self.lock = threading.Lock()
+
+            def try_acquire(self):
+                with self.lock:
+                    if self.tokens:
+                        self.tokens -= 1
+                        return 0.0
+                return 0.01
+
+        limiter = ManualLimiter()
+        scheduler = self.module.UpstreamScheduler(limiter, {"interactive": 4, "background": 1})
+        order = []
+
+        def call(priority):
+            scheduler.acquire(priority)
+            order.append(priority)
+
+        def wait_for(predicate):
+            deadline = time.monotonic() + 5
+            while not predicate():
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.005)
+
+        threads = []
+        # A background crawl queues first; interactive calls arrive behind it.
+        for priority in ["background"] * 6 + ["interactive"] * 3:
+            thread = threading.Thread(target=call, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            wait_for(lambda: sum(item["waiting"] for item in scheduler.stats().values()) == len(threads))
+
+        for granted in range(1, len(threads) + 1):
+            with limiter.lock:
+                limiter.tokens += 1
+            wait_for(lambda: len(order) == granted)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["interactive"] * 3 + ["background"] * 6)
+        self.assertEqual(scheduler.stats()["background"]["granted"], 6)
+        self.assertIsNone(scheduler.acquire("background", timeout=0.02))
+        self.assertEqual(scheduler.stats()["background"]["waiting"], 0)
+
+    def test_interactive_caller_raises_priority_of_background_flight_it_joins(self):
+        class ManualLimiter:
+            rate = 1.0
+
+            def __init__(self):
+                self.tokens = 0
+                self.lock = threading.Lock()
+
+            def try_acquire(self):
+                with self.lock:
+                    if self.tokens:
+                        self.tokens -= 1
+                        return 0.0
+                return 0.01
+
+        module = self.module
+        limiter = ManualLimiter()
+        scheduler = module.UpstreamScheduler(limiter, {"interactive": 4, "background": 1})
+        flights = module.SingleFlight(on_promote=scheduler.wake)
+        order = []
+        results = []
+
+        def wait_for(predicate):
+            deadline = time.monotonic() + 5
+            while not predicate():
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.005)
+
+        def waiting():
+            return sum(item["waiting"] for item in scheduler.stats().values())
+
+        def crawl(name):
+            scheduler.acquire(module._current_priority(), flight=module._FLIGHT.get())
+            order.append(name)
+            return name
+
+        threads = []
+        for name in ["crawl-1", "crawl-2", "crawl-3"]:
+            threads.append(
+                threading.Thread(target=module._in_background, args=(crawl, name))
+            )
+            threads[-1].start()
+            wait_for(lambda: waiting() == len(threads))
+        # A background prefetch of the listing starts the flight...
+        threads.append(
+            threading.Thread(
+                target=module._in_background, args=(flights.do, "listing", crawl, "listing")
+            )
+        )
+        threads[-1].start()
+        wait_for(lambda: waiting() == 4)
+        # ...and an interactive request for the same listing joins it.
+        threads.append(
+            threading.Thread(
+                target=lambda: results.append(flights.do("listing", crawl, "duplicate"))
+            )
+        )
+        threads[-1].start()
+        wait_for(lambda: scheduler.stats()["interactive"]["waiting"] == 1)
+
+        for granted in range(1, 5):
+            with limiter.lock:
+                limiter.tokens += 1
+            wait_for(lambda: len(order) == granted)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["listing", "crawl-1", "crawl-2", "crawl-3"])
+        self.assertEqual(results, ["listing"])
+        self.assertEqual(flights.stats()["promoted"], 1)
+        self.assertEqual(scheduler.stats()["interactive"]["granted"], 1)
+
+    def test_priority_is_chosen_by_parameter_or_header(self):
+        routes = {}
+        seen = []
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        module = self.module
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                seen.append(module._PRIORITY.get())
+                return FakeListing(url=f"https://www.funda.nl/detail/koop/a/huis/{path_part}/")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7, rate_limit=100)
+
+        get_listing = routes["/get_listing/{id}"]
+        get_listing(id="43000001")
+        get_listing(id="43000002", priority="background")
+        get_listing(id="43000003", priority_header="Background")
+        routes["/get_listings"](ids="43000004,43000005", priority="background")
+        self.assertEqual(seen, ["interactive"] + ["background"] * 4)
+        self.assertEqual(self.module._PRIORITY.get(), "interactive")
+
+        status, body = get_listing(id="43000006", priority="urgent")
+        self.assertEqual(status, 400)
+        self.assertEqual(body["error"]["details"]["field"], "priority")
+
+        text = routes["/metrics"]()[2].decode("utf-8")
+        self.assertIn('funda_gateway_upstream_granted_total{priority="background"} 4', text)
+        self.assertIn('funda_gateway_upstream_queue_depth{priority="interactive"} 0', text)
+        self.assertIn(
+            'funda_gateway_upstream_queue_wait_seconds_count{priority="interactive"} 1', text
+        )
+
+    def test_prefetcher_warms_saved_searches_and_unreported_listing_details(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[(path, tuple(method or ()))] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+                self.search_calls = 0
+                self.detail_calls = []
+                self.search_error = None
+
+            def get_listing(self, path_part):
+                self.detail_calls.append(path_part)
+                return FakeListing(url=f"https://www.funda.nl/detail/koop/a/huis/{path_part}/")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                self.search_calls += 1
+                if self.search_error is not None:
+                    raise self.search_error
+                return [
+                    FakeListing(detail_url=f"https://www.funda.nl/detail/koop/a/huis/{public_id}/")
+                    for public_id in ("100", "200")
+                ]
+
+        funda_instance = {}
+
+        def fake_funda_factory(timeout):
+            funda_instance["value"] = FakeFunda(timeout)
+            return funda_instance["value"]
+
+        def run_prefetch(**params):
+            runs = routes[("/prefetch", ("GET",))]()["runs"]
+            routes[("/prefetch", ("POST", "PUT"))](run="1", **params)
+            deadline = time.monotonic() + 5
+            while routes[("/prefetch", ("GET",))]()["runs"] == runs:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            return routes[("/prefetch", ("GET",))]()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+                self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+            ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
+                self.module, "is_port_listening", return_value=False
+            ):
+                self.module.spin_up_server(
+                    server_port=9001,
+                    funda_timeout=7,
+                    rate_limit=0,
+                    retry_budget=0,
+                    state_db=str(Path(tmpdir) / "state.sqlite3"),
+                )
+            funda = funda_instance["value"]
+
+            status = routes[("/prefetch", ("GET",))]()
+            self.assertFalse(status["enabled"])
+            self.assertIsNone(status["last_run"])
+            routes[("/watch/{name}", ("POST", "PUT"))](
+                name="utrecht", params={"location": "Utrecht"}
+            )
+
+            status = run_prefetch(concurrency="3")
+            self.assertEqual(status["concurrency"], 3)
+            self.assertEqual(
+                {key: status["last_run"][key] for key in ("status", "watches", "pages", "new_ids")},
+                {"status": "ok", "watches": 1, "pages": 1, "new_ids": 2},
+            )
+            self.assertEqual(sorted(funda.detail_calls), ["100", "200"])
+
+            # The heartbeat check and the detail lookups after it stay local.
+            check = routes[("/watch/{name}/new", ("GET",))](name="utrecht")
+            self.assertEqual(check["count"], 2)
+            self.assertEqual(check["cache"]["hit_ratio"], 1.0)
+            routes[("/get_listing/{id}", ("GET",))](id="100")
+            self.assertEqual(funda.search_calls, 1)
+            self.assertEqual(len(funda.detail_calls), 2)
+
+            # Runs share one thread pool until the concurrency changes.
+            with mock.patch.object(
+                self.module, "ThreadPoolExecutor", side_effect=self.module.ThreadPoolExecutor
+            ) as pools:
+                # Reported listings are not prefetched again.
+                status = run_prefetch()
+                self.assertEqual((status["last_run"]["new_ids"], funda.search_calls), (0, 2))
+
+                funda.search_error = RuntimeError("Search failed (status 500)")
+                status = run_prefetch()
+                self.assertEqual(status["last_run"]["status"], "failed")
+                self.assertEqual(status["last_run"]["errors"][0]["watch"], "utrecht")
+                self.assertEqual(pools.call_count, 0)
+
+                run_prefetch(concurrency="1")
+                self.assertEqual(pools.call_count, 1)
+
+            invalid = routes[("/prefetch", ("POST", "PUT"))](interval_seconds="-1")
+            self.assertEqual(invalid[0], 400)
+            self.assertEqual(invalid[1]["error"]["details"]["field"], "interval_seconds")
+
+    def test_event_log_resumes_after_last_id_and_reports_gaps(self):
+        log = self.module.EventLog(max_events=3, max_subscribers=1, run="b")
+        for index in range(1, 5):
+            log.append("listing_new", {"public_id": str(index)})
+        self.assertEqual(log.last_id, "b-4")
+
+        events, gap, cursor = log.since("b-2")
+        self.assertEqual([event["id"] for event in events], ["b-3", "b-4"])
+        self.assertIsNone(gap)
+        self.assertEqual(cursor, "b-4")
+
+        # Event 1 fell out of the bounded log.
+        events, gap, _ = log.since("b-0")
+        self.assertEqual([event["id"] for event in events], ["b-2", "b-3", "b-4"])
+        self.assertEqual(gap, {"last_event_id": "b-0", "first_available_id": "b-2"})
+
+        # Ids from before a gateway restart replay the whole log, whether the
+        # old run got further than this one or not.
+        for last_id in ("a-40", "a-3", "3"):
+            events, gap, cursor = log.since(last_id)
+            self.assertEqual(len(events), 3)
+            self.assertEqual(gap, {"last_event_id": last_id, "first_available_id": "b-2"})
+            self.assertEqual(cursor, "b-4")
+        _, gap, cursor = self.module.EventLog(run="c").since("b-4", timeout=0)
+        self.assertEqual((gap["first_available_id"], cursor), ("c-1", "c-0"))
+
+        started = time.monotonic()
+        self.assertEqual(log.since("b-4", timeout=0.05), ([], None, "b-4"))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        threading.Timer(0.05, log.append, ("price_changed", {})).start()
+        events, _, _ = log.since("b-4", timeout=5)
+        self.assertEqual([event["type"] for event in events], ["price_changed"])
+
+        self.assertTrue(log.subscribe())
+        self.assertFalse(log.subscribe())
+        log.unsubscribe()
+        self.assertEqual(log.stats()["published"], {"listing_new": 4, "price_changed": 1})
+
+    def test_events_stream_listing_changes_found_by_the_poller(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[(path, tuple(method or ()))] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+                self.listings = {"100": (400000, "available"), "200": (500000, "available")}
+                self.search_calls = 0
+
+            def get_listing(self, path_part):
+                price, status = self.listings[path_part]
+                return FakeListing(
+                    url=f"https://www.funda.nl/detail/koop/a/huis/{path_part}/",
+                    price=price,
+                    status=status,
+                )
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                # Like pyfunda, search results have a price but no status.
+                self.search_calls += 1
+                return [
+                    FakeListing(
+                        detail_url=f"https://www.funda.nl/detail/koop/a/huis/{public_id}/",
+                        price=price,
+                    )
+                    for public_id, (price, _) in self.listings.items()
+                ]
+
+        class Response:
+            def __init__(self, fail=False):
+                self.fail = fail
+                self.status_code = None
+                self.headers = {}
+                self.body = b""
+
+            def set_header(self, key, value):
+                self.headers[key] = value
+
+            def write_bytes(self, data):
+                if self.fail:
+                    raise BrokenPipeError("client went away")
+                self.body += data
+
+        def sse_events(body):
+            payload = b""
+            rest = body
+            while True:
+                size_line, rest = rest.split(b"\r\n", 1)
+                size = int(size_line, 16)
+                if size == 0:
+                    break
+                payload += rest[:size]
+                rest = rest[size + 2 :]
+            events = []
+            for block in payload.decode("utf-8").split("\n\n"):
+                fields = dict(
+                    line.split(": ", 1) for line in block.splitlines() if not line.startswith(":")
+                )
+                if "event" in fields:
+                    events.append(
+                        (fields.get("id"), fields["event"], json.loads(fields["data"]))
+                    )
+            return events
+
+        funda_instance = {}
+
+        def fake_funda_factory(timeout):
+            funda_instance["value"] = FakeFunda(timeout)
+            return funda_instance["value"]
+
+        def run_prefetch():
+            runs = routes[("/prefetch", ("GET",))]()["runs"]
+            routes[("/prefetch", ("POST", "PUT"))](run="1")
+            deadline = time.monotonic() + 5
+            while routes[("/prefetch", ("GET",))]()["runs"] == runs:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            return routes[("/prefetch", ("GET",))]()["last_run"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+                self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+            ), mock.patch.object(self.module, "DeadlineFunda", fake_funda_factory), mock.patch.object(
+                self.module, "is_port_listening", return_value=False
+            ):
+                self.module.spin_up_server(
+                    server_port=9001,
+                    funda_timeout=7,
+                    rate_limit=0,
+                    listing_cache_ttl=0,
+                    state_db=str(Path(tmpdir) / "state.sqlite3"),
+                )
+            funda = funda_instance["value"]
+            events_route = routes[("/events", ("GET",))]
+            routes[("/watch/{name}", ("POST", "PUT"))](
+                name="utrecht", params={"location": "Utrecht"}
+            )
+
+            # The first result is the baseline; the next one is diffed against it.
+            self.assertEqual(run_prefetch()["events"], 0)
+            funda.listings = {
+                "100": (390000, "available"),
+                "200": (500000, "sold"),
+                "300": (250000, "available"),
+            }
+            self.assertEqual(run_prefetch()["events"], 3)
+
+            with mock.patch.object(self.module, "EVENT_STREAM_SECONDS", 0.1):
+                # An id this gateway run did not send replays the whole log.
+                first = Response()
+                self.assertIsNone(events_route(last_event_id="0", http_response=first))
+                streamed = sse_events(first.body)
+                resumed = Response()
+                events_route(last_event_id_header=streamed[2][0], http_response=resumed)
+                other_watch = Response()
+                events_route(
+                    last_event_id=streamed[0][2]["first_available_id"],
+                    watch="amsterdam",
+                    http_response=other_watch,
+                )
+
+            self.assertEqual(first.headers["Content-Type"], "text/event-stream")
+            self.assertEqual(streamed[0][:2], (None, "gap"))
+            self.assertEqual(streamed[0][2]["last_event_id"], "0")
+            run = streamed[0][2]["first_available_id"].split("-")[0]
+            self.assertEqual(
+                [(event_id, kind, data["public_id"]) for event_id, kind, data in streamed[1:]],
+                [
+                    (f"{run}-1", "price_changed", "100"),
+                    (f"{run}-2", "status_changed", "200"),
+                    (f"{run}-3", "listing_new", "300"),
+                ],
+            )
+            self.assertEqual(streamed[1][2]["old"], 400000)
+            self.assertEqual(streamed[1][2]["new"], 390000)
+            self.assertEqual(streamed[2][2]["listing"]["status"], "sold")
+            self.assertEqual([event[0] for event in sse_events(resumed.body)], [f"{run}-3"])
+            self.assertEqual(sse_events(other_watch.body), [])
+            # Subscribers share the poller: three streams, no extra searches.
+            self.assertEqual(funda.search_calls, 2)
+
+            self.assertIsNone(events_route(http_response=Response(fail=True)))
+            text = routes[("/metrics", ("GET",))]()[2].decode("utf-8")
+            self.assertIn("funda_gateway_event_subscribers 0", text)
+            self.assertIn('funda_gateway_events_published_total{type="listing_new"} 1', text)
+
+            invalid = events_route(last_event_id="x", http_response=Response())
+            self.assertEqual(invalid[0], 400)
+
+    def test_only_the_first_worker_polls_and_streams_events(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[(path, tuple(method or ()))] = fn
+                return fn
+
+            return decorator
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                pass
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+                self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+            ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+                self.module, "is_port_listening", return_value=False
+            ):
+                self.module.spin_up_server(
+                    server_port=9001,
+                    funda_timeout=7,
+                    prefetch_interval=60,
+                    state_db=str(Path(tmpdir) / "state.sqlite3"),
+                    worker_index=1,
+                )
+
+            self.assertFalse(routes[("/prefetch", ("GET",))]()["enabled"])
+            # Its event log never gets events, so it must not look like an idle stream.
+            response = types.SimpleNamespace(status_code=None)
+            rejected = routes[("/events", ("GET",))](http_response=response)
+            self.assertEqual(rejected[0], 503)
+            self.assertEqual(rejected[1]["error"]["code"], "not_polling_worker")
+            self.assertEqual(rejected[1]["error"]["details"], {"worker": 1})
+            self.assertIsNone(response.status_code)
+
+            # Nor may it start a second poller.
+            configured = routes[("/prefetch", ("POST", "PUT"))](interval_seconds="60", run="1")
+            self.assertEqual(configured[1]["error"]["code"], "not_polling_worker")
+            status = routes[("/prefetch", ("GET",))]()
+            self.assertEqual((status["enabled"], status["running"], status["runs"]), (False, False, 0))
+
+    def test_flight_follower_without_deadline_outlives_leader_deadline(self):
+        routes = {}
+
+        def fake_route(path, method=None):
+            def decorator(fn):
+                routes[path] = fn
+                return fn
+
+            return decorator
+
+        class FakeListing(dict):
+            def to_dict(self):
+                return dict(self)
+
+        first_call = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        class FakeFunda:
+            def __init__(self, timeout):
+                self.timeout = timeout
+
+            def get_listing(self, path_part):
+                calls.append(path_part)
+                if len(calls) == 1:
+                    first_call.set()
+                    release.wait(5)
+                    # What pyfunda raises once the deadline-capped timeout fires.
+                    raise RuntimeError("Read timed out")
+                return FakeListing(url=f"https://www.funda.nl/detail/koop/a/huis/{path_part}/")
+
+            def get_price_history(self, listing):
+                raise AssertionError("not used in this test")
+
+            def search_listing(self, **kwargs):
+                raise AssertionError("not used in this test")
+
+        with mock.patch.object(self.module, "route", fake_route), mock.patch.object(
+            self.module, "server", types.SimpleNamespace(start=lambda host, port: None)
+        ), mock.patch.object(self.module, "DeadlineFunda", FakeFunda), mock.patch.object(
+            self.module, "is_port_listening", return_value=False
+        ):
+            self.module.spin_up_server(server_port=9001, funda_timeout=7, rate_limit=0)
+
+        results = {}
+        leader = threading.Thread(
+            target=lambda: results.update(
+                batch=routes["/get_listings"](ids="43000001", deadline_ms="100")
+            )
+        )
+        leader.start()
+        self.assertTrue(first_call.wait(5))
+        follower = threading.Thread(
+            target=lambda: results.update(single=routes["/get_listing/{id}"](id="43000001"))
+        )
+        follower.start()
+        deadline = time.monotonic() + 5
+        while routes["/cache_stats"]()["single_flight"]["coalesced"] == 0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+        leader.join(5)
+        release.set()
+        follower.join(5)
+
+        self.assertEqual(results["batch"]["pending"], ["43000001"])
+        # The follower has no deadline: it retries as leader instead of getting a 504.
+        self.assertEqual(
+            results["single"]["url"], "https://www.funda.nl/detail/koop/a/huis/43000001/"
+        )
+        self.assertEqual(len(calls), 2)
+
+
 if __name__ == "__main__":
     unittest.main()